@@ -0,0 +1,70 @@
+# python -m bench.compare BASE.json NEW.json [--threshold PCT]
+#
+# Prints throughput and latency changes per endpoint between two bench.load
+# results and exits with status 1 if any endpoint's p95 or p99 got worse by
+# more than --threshold percent.
+import argparse
+import json
+import sys
+
+FIELDS = ("throughput", "p50_ms", "p95_ms", "p99_ms")
+
+
+def change(base: float, new: float) -> float | None:
+    if not base:
+        return None
+    return (new - base) / base * 100
+
+
+def format_change(pct: float | None) -> str:
+    return "     n/a" if pct is None else f"{pct:+7.1f}%"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0)
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(f"base: {base['meta'].get('commit')} {base['meta']['started_at']}")
+    print(f"new:  {new['meta'].get('commit')} {new['meta']['started_at']}")
+
+    header = f"{'endpoint':<52}"
+    for field in FIELDS:
+        header += f" {field:>20}"
+    print(header)
+
+    base_rows = dict(base["endpoints"], overall=base["overall"])
+    new_rows = dict(new["endpoints"], overall=new["overall"])
+    regressions = []
+    for name in [
+        *sorted((base_rows.keys() | new_rows.keys()) - {"overall"}),
+        "overall",
+    ]:
+        if name not in base_rows or name not in new_rows:
+            print(f"{name:<52} only in {'base' if name in base_rows else 'new'}")
+            continue
+        line = f"{name:<52}"
+        for field in FIELDS:
+            pct = change(base_rows[name][field], new_rows[name][field])
+            line += f" {new_rows[name][field]:>10.1f} {format_change(pct)}"
+            if (
+                field in ("p95_ms", "p99_ms")
+                and pct is not None
+                and pct > args.threshold
+            ):
+                regressions.append((name, field, pct))
+        print(line)
+
+    for name, field, pct in regressions:
+        print(f"REGRESSION {name} {field} {pct:+.1f}%")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,541 @@
+# python -m bench.load [--base-url URL] [--concurrency N] [--duration S] [--out FILE]
+#
+# Drives every endpoint in main.py with a weighted mix of requests from
+# --concurrency workers for --duration seconds and reports throughput and
+# p50/p95/p99 latency per endpoint. Parameters are drawn from the seed
+# manifest written by bench.seed, from a fixed --seed, so two runs issue
+# the same request mix. Writes use ids outside the seeded ranges and clean
+# up after themselves where the API allows it.
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+
+import httpx
+
+# Writes go to users that the seed never creates.
+WRITE_USER_ID_BASE = 9 * 10**17
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.recording = False
+
+    async def request(
+        self, client: httpx.AsyncClient, name: str, method: str, url, **kwargs
+    ):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            # Read streamed bodies completely so their cost is included.
+            await response.aread()
+            failed = response.status_code >= 400
+        except httpx.HTTPError:
+            response = None
+            failed = True
+        elapsed = time.perf_counter() - started
+        if self.recording:
+            self.latencies.setdefault(name, []).append(elapsed)
+            if failed:
+                self.errors[name] = self.errors.get(name, 0) + 1
+        return response
+
+
+def percentile(values: list[float], p: float) -> float:
+    # values must be sorted; nearest-rank percentile.
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def summarize(latencies: list[float], errors: int, duration: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput": len(values) / duration,
+        "mean_ms": sum(values) / len(values) * 1000 if values else 0.0,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": values[-1] * 1000 if values else 0.0,
+    }
+
+
+class Scenarios:
+    def __init__(self, manifest: dict, recorder: Recorder):
+        self.m = manifest
+        self.r = recorder
+        self.year = datetime.date.today().year
+        self.etags: dict[str, str] = {}
+
+    def guild(self, rng):
+        return self.m["guild_id_base"] + min(
+            int(rng.paretovariate(1.2)) - 1, self.m["guilds"] - 1
+        )
+
+    def user(self, rng):
+        return self.m["user_id_base"] + rng.randrange(self.m["users"])
+
+    def hour(self, rng):
+        return rng.choice((24, 168, 720, 2160))
+
+    async def emoji_usage(self, c, rng):
+        params = {"guild_id": self.guild(rng), "hour": self.hour(rng)}
+        await self.r.request(
+            c, "GET /emoji/usage-rank", "GET", "/emoji/usage-rank", params=params
+        )
+
+    async def emoji_usage_approx(self, c, rng):
+        params = {"guild_id": self.guild(rng), "hour": 24, "limit": 10}
+        params["mode"] = "approx"
+        await self.r.request(
+            c,
+            "GET /emoji/usage-rank?mode=approx",
+            "GET",
+            "/emoji/usage-rank",
+            params=params,
+        )
+
+    async def emoji_usage_batch(self, c, rng):
+        # The dashboard: three windows for a handful of guilds.
+        body = [
+            {"guild_id": self.guild(rng), "hour": hour}
+            for _ in range(10)
+            for hour in (24, 168, 720)
+        ]
+        await self.r.request(
+            c, "POST /emoji/usage-ranks", "POST", "/emoji/usage-ranks", json=body
+        )
+
+    async def emoji_usage_user(self, c, rng):
+        params = {
+            "guild_id": self.guild(rng),
+            "hour": self.hour(rng),
+            "user_id": self.user(rng),
+        }
+        await self.r.request(
+            c,
+            "GET /emoji/usage-rank?user_id",
+            "GET",
+            "/emoji/usage-rank",
+            params=params,
+        )
+
+    async def emoji_member(self, c, rng):
+        params = {"guild_id": self.guild(rng), "hour": self.hour(rng)}
+        if rng.random() < 0.5:
+            params["emoji"] = rng.choice(self.m["emojis"][:20])
+        await self.r.request(
+            c, "GET /emoji/member-rank", "GET", "/emoji/member-rank", params=params
+        )
+
+    async def game_titles(self, c, rng):
+        await self.conditional_get(
+            c, rng, "GET /friend-code/games/", "/friend-code/games/"
+        )
+
+    async def game_title_write(self, c, rng):
+        body = {"game_title": f"bench-{rng.randrange(10**9)}"}
+        await self.r.request(
+            c, "POST /friend-code/game/", "POST", "/friend-code/game/", json=body
+        )
+        await self.r.request(
+            c, "DELETE /friend-code/game/", "DELETE", "/friend-code/game/", json=body
+        )
+
+    async def friend_code_list(self, c, rng):
+        await self.r.request(
+            c, "GET /friend-code?limit", "GET", "/friend-code", params={"limit": 100}
+        )
+
+    async def friend_code_stream(self, c, rng):
+        await self.r.request(
+            c,
+            "GET /friend-code?stream",
+            "GET",
+            "/friend-code",
+            params={"stream": "true"},
+        )
+
+    async def friend_code_lookup(self, c, rng):
+        user_id = self.m["user_id_base"] + rng.randrange(self.m["friend_code_users"])
+        params = {"user_id": user_id}
+        if rng.random() < 0.5:
+            params["game_title"] = rng.choice(self.m["games"])
+        await self.r.request(
+            c, "GET /friend-code?user_id", "GET", "/friend-code", params=params
+        )
+
+    async def friend_code_by_title(self, c, rng):
+        params = {"game_title": rng.choice(self.m["games"])}
+        await self.r.request(
+            c, "GET /friend-code?game_title", "GET", "/friend-code", params=params
+        )
+
+    async def friend_code_write(self, c, rng):
+        body = {
+            "user_id": WRITE_USER_ID_BASE + rng.randrange(1000),
+            "game_title": rng.choice(self.m["games"]),
+            "friend_code": f"{rng.randrange(10**12):012d}",
+        }
+        await self.r.request(c, "PUT /friend-code", "PUT", "/friend-code", json=body)
+        del body["friend_code"]
+        await self.r.request(
+            c, "DELETE /friend-code", "DELETE", "/friend-code", json=body
+        )
+
+    async def friend_code_bulk_write(self, c, rng):
+        body = [
+            {
+                "user_id": WRITE_USER_ID_BASE + rng.randrange(1000),
+                "game_title": rng.choice(self.m["games"]),
+                "friend_code": f"{rng.randrange(10**12):012d}",
+            }
+            for _ in range(20)
+        ]
+        await self.r.request(
+            c, "PUT /friend-code/bulk", "PUT", "/friend-code/bulk", json=body
+        )
+
+    async def message_log(self, c, rng):
+        body = {
+            "guild_id": self.guild(rng),
+            "channel_id": self.m["channel_id_base"] + rng.randrange(self.m["channels"]),
+            "user_id": self.user(rng),
+        }
+        await self.r.request(c, "POST /message/log", "POST", "/message/log", json=body)
+
+    async def message_logs(self, c, rng):
+        guild_id = self.guild(rng)
+        body = [
+            {
+                "guild_id": guild_id,
+                "channel_id": self.m["channel_id_base"]
+                + rng.randrange(self.m["channels"]),
+                "user_id": self.user(rng),
+            }
+            for _ in range(50)
+        ]
+        await self.r.request(
+            c, "POST /message/logs", "POST", "/message/logs", json=body
+        )
+
+    async def message_count(self, c, rng):
+        params = {
+            "guild_id": self.guild(rng),
+            "user_id": self.user(rng),
+            "hours": self.hour(rng),
+        }
+        await self.r.request(
+            c, "GET /message/count", "GET", "/message/count", params=params
+        )
+
+    async def message_series(self, c, rng):
+        params = {
+            "guild_id": self.guild(rng),
+            "user_id": [self.user(rng) for _ in range(20)],
+            "hours": 720,
+            "bucket": rng.choice(("day", "week")),
+            "tz": "Asia/Tokyo",
+        }
+        await self.r.request(
+            c, "GET /message/series", "GET", "/message/series", params=params
+        )
+
+    async def advent_event(self, c, rng):
+        params = {
+            "user_id": self.user(rng),
+            "date_str": f"{self.year}-12-{rng.randint(1, 25):02d}",
+        }
+        await self.r.request(
+            c, "GET /advent/event", "GET", "/advent/event", params=params
+        )
+
+    async def advent_write(self, c, rng):
+        body = {
+            "user_id": WRITE_USER_ID_BASE + rng.randrange(1000),
+            "author": "bench",
+            "title": "bench",
+            "url": "https://example.com",
+            "date_str": f"{self.year + 1}-12-{rng.randint(1, 25):02d}",
+        }
+        await self.r.request(c, "PUT /advent/event", "PUT", "/advent/event", json=body)
+        await self.r.request(
+            c, "DELETE /advent/event", "DELETE", "/advent/event", json=body
+        )
+
+    async def advent_bulk_write(self, c, rng):
+        body = [
+            {
+                "user_id": WRITE_USER_ID_BASE + rng.randrange(1000),
+                "author": "bench",
+                "title": "bench",
+                "url": "https://example.com",
+                "date_str": f"{self.year + 1}-12-{day:02d}",
+            }
+            for day in range(1, 26)
+        ]
+        await self.r.request(
+            c, "PUT /advent/events/bulk", "PUT", "/advent/events/bulk", json=body
+        )
+
+    async def advent_events(self, c, rng):
+        year = self.year - rng.randrange(self.m["advent_years"])
+        await self.conditional_get(
+            c, rng, "GET /advent/events", "/advent/events", {"year": year}
+        )
+
+    async def songs_search(self, c, rng):
+        params = {"title": rng.choice(self.m["words"]), "limit": 50}
+        if rng.random() < 0.3:
+            params["game_name"] = rng.choice(self.m["games"])
+        if rng.random() < 0.2:
+            params["artist"] = rng.choice(self.m["words"])
+        await self.r.request(
+            c,
+            "GET /rhythmgamedb/songs?title",
+            "GET",
+            "/rhythmgamedb/songs",
+            params=params,
+        )
+
+    async def songs_by_game(self, c, rng):
+        params = {"game_name": rng.choice(self.m["games"]), "limit": 200}
+        await self.r.request(
+            c,
+            "GET /rhythmgamedb/songs?game_name",
+            "GET",
+            "/rhythmgamedb/songs",
+            params=params,
+        )
+
+    async def songs_all(self, c, rng):
+        await self.conditional_get(
+            c,
+            rng,
+            "GET /rhythmgamedb/songs?stream",
+            "/rhythmgamedb/songs",
+            {"stream": "true"},
+        )
+
+    async def random_song(self, c, rng):
+        params = {"count": rng.choice((1, 1, 1, 5))}
+        if rng.random() < 0.7:
+            params["game_name"] = rng.choice(self.m["games"])
+        if rng.random() < 0.5:
+            params["level"] = rng.choice(self.m["levels"][16:])
+        await self.r.request(
+            c,
+            "GET /rhythmgamedb/random-song",
+            "GET",
+            "/rhythmgamedb/random-song",
+            params=params,
+        )
+
+    async def game_names(self, c, rng):
+        await self.conditional_get(
+            c, rng, "GET /rhythmgamedb/game-names", "/rhythmgamedb/game-names"
+        )
+
+    async def game_names_refresh(self, c, rng):
+        await self.r.request(
+            c,
+            "POST /rhythmgamedb/game-names/refresh",
+            "POST",
+            "/rhythmgamedb/game-names/refresh",
+        )
+
+    async def stats(self, c, rng):
+        path = rng.choice(("/emoji/cache-stats", "/db/pool-stats", "/metrics"))
+        await self.r.request(c, f"GET {path}", "GET", path)
+
+    async def conditional_get(self, c, rng, name: str, path: str, params=None):
+        # Half of the clients revalidate with the last ETag they saw, like a
+        # browser or bot with an HTTP cache would.
+        key = path + json.dumps(params, sort_keys=True)
+        headers = {}
+        etag = self.etags.get(key)
+        if etag is not None and rng.random() < 0.5:
+            headers["If-None-Match"] = etag
+            name += " (If-None-Match)"
+        response = await self.r.request(
+            c, name, "GET", path, params=params, headers=headers
+        )
+        if response is not None and "etag" in response.headers:
+            self.etags[key] = response.headers["etag"]
+
+    def mix(self) -> list[tuple[int, object]]:
+        # Roughly the traffic the bot and web front end generate: reads
+        # dominate, log ingestion is steady, admin writes are rare.
+        return [
+            (20, self.emoji_usage),
+            (5, self.emoji_usage_user),
+            (1, self.emoji_usage_batch),
+            (5, self.emoji_usage_approx),
+            (10, self.emoji_member),
+            (3, self.game_titles),
+            (1, self.game_title_write),
+            (3, self.friend_code_list),
+            (1, self.friend_code_stream),
+            (5, self.friend_code_lookup),
+            (2, self.friend_code_by_title),
+            (2, self.friend_code_write),
+            (1, self.friend_code_bulk_write),
+            (20, self.message_log),
+            (3, self.message_logs),
+            (8, self.message_count),
+            (2, self.message_series),
+            (3, self.advent_event),
+            (1, self.advent_write),
+            (1, self.advent_bulk_write),
+            (4, self.advent_events),
+            (10, self.songs_search),
+            (3, self.songs_by_game),
+            (1, self.songs_all),
+            (8, self.random_song),
+            (4, self.game_names),
+            (1, self.game_names_refresh),
+            (1, self.stats),
+        ]
+
+
+async def worker(scenarios, client, rng, deadline: float, mix) -> None:
+    functions = [fn for _, fn in mix]
+    weights = [weight for weight, _ in mix]
+    while time.monotonic() < deadline:
+        fn = rng.choices(functions, weights)[0]
+        await fn(client, rng)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args, manifest: dict) -> dict:
+    recorder = Recorder()
+    scenarios = Scenarios(manifest, recorder)
+    mix = scenarios.mix()
+    if args.only:
+        mix = [(w, fn) for w, fn in mix if fn.__name__ in args.only]
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=args.base_url,
+        auth=(args.username, args.password),
+        limits=limits,
+        timeout=args.timeout,
+    ) as client:
+        # Warm up caches and connection pools before measuring.
+        deadline = time.monotonic() + args.warmup
+        await asyncio.gather(
+            *(
+                worker(
+                    scenarios,
+                    client,
+                    random.Random(args.seed * 1000 + i),
+                    deadline,
+                    mix,
+                )
+                for i in range(args.concurrency)
+            )
+        )
+        recorder.recording = True
+        started = time.monotonic()
+        deadline = started + args.duration
+        await asyncio.gather(
+            *(
+                worker(
+                    scenarios,
+                    client,
+                    random.Random(args.seed * 1000 + i),
+                    deadline,
+                    mix,
+                )
+                for i in range(args.concurrency)
+            )
+        )
+        duration = time.monotonic() - started
+
+    endpoints = {
+        name: summarize(latencies, recorder.errors.get(name, 0), duration)
+        for name, latencies in sorted(recorder.latencies.items())
+    }
+    everything = [x for latencies in recorder.latencies.values() for x in latencies]
+    return {
+        "meta": {
+            "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "base_url": args.base_url,
+            "concurrency": args.concurrency,
+            "duration": duration,
+            "warmup": args.warmup,
+            "seed": args.seed,
+            "manifest": manifest,
+        },
+        "overall": summarize(everything, sum(recorder.errors.values()), duration),
+        "endpoints": endpoints,
+    }
+
+
+def print_report(result: dict) -> None:
+    print(f"{'endpoint':<52} {'req/s':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'err':>6}")
+    rows = list(result["endpoints"].items()) + [("overall", result["overall"])]
+    for name, s in rows:
+        print(
+            f"{name:<52} {s['throughput']:>9.1f} {s['p50_ms']:>8.1f} "
+            f"{s['p95_ms']:>8.1f} {s['p99_ms']:>8.1f} {s['errors']:>6}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--base-url", default=f"http://127.0.0.1:{os.getenv('PORT', '8765')}"
+    )
+    parser.add_argument("--username", default=os.getenv("API_USERNAME", "bench"))
+    parser.add_argument("--password", default=os.getenv("API_PASSWORD", "bench"))
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--warmup", type=float, default=10)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--only", nargs="*", help="scenario names to run, e.g. songs_search"
+    )
+    parser.add_argument("--manifest", default="bench/results/seed.json")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    result = asyncio.run(run(args, manifest))
+    print_report(result)
+    out = args.out or os.path.join(
+        "bench", "results", f"load-{datetime.datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"Wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
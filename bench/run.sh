@@ -0,0 +1,45 @@
+#!/bin/sh
+# bench/run.sh [--seed-only|--no-seed] [bench.load arguments...]
+#
+# Starts the MariaDB stand-in, seeds it (unless --no-seed), boots the app
+# with bench/bench.env and runs bench.load against it. Set SEED_ARGS to pass
+# scale options to bench.seed, e.g.
+#   SEED_ARGS="--emoji-log-rows 10000000 --message-log-rows 10000000" bench/run.sh
+# and WEB_CONCURRENCY=N to serve with N gunicorn workers instead of one
+# uvicorn process.
+set -eu
+cd "$(dirname "$0")/.."
+
+seed=1
+load=1
+case "${1:-}" in
+    --seed-only) load=0; shift ;;
+    --no-seed) seed=0; shift ;;
+esac
+
+set -a
+. bench/bench.env
+set +a
+
+docker compose -f bench/docker-compose.yml up -d --wait
+python -m db.migrate
+
+if [ "$seed" = 1 ]; then
+    # shellcheck disable=SC2086
+    python -m bench.seed ${SEED_ARGS:-}
+    python -m db.partitions maintain
+fi
+[ "$load" = 1 ] || exit 0
+
+if [ "${WEB_CONCURRENCY:-1}" -gt 1 ]; then
+    gunicorn -c gunicorn.conf.py --log-level warning &
+else
+    python -m uvicorn main:app --host "$HOST" --port "$PORT" --log-level warning &
+fi
+server=$!
+trap 'kill $server 2>/dev/null; wait $server 2>/dev/null' EXIT INT TERM
+until curl -s -o /dev/null -u "$API_USERNAME:$API_PASSWORD" "http://$HOST:$PORT/metrics"; do
+    sleep 0.5
+done
+
+python -m bench.load "$@"
@@ -0,0 +1,9 @@
+-- Loaded by the MariaDB container on first start (see docker-compose.yml).
+-- Tables and indexes come from the app's migrations (python -m db.migrate),
+-- so the benchmark runs against the same schema as production.
+
+CREATE DATABASE IF NOT EXISTS otogame CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+CREATE DATABASE IF NOT EXISTS rgdb CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+
+GRANT ALL PRIVILEGES ON otogame.* TO 'bench'@'%';
+GRANT ALL PRIVILEGES ON rgdb.* TO 'bench'@'%';
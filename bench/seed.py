@@ -0,0 +1,316 @@
+# python -m bench.seed [--emoji-log-rows N] [--message-log-rows N] [--songs N] ...
+#
+# Fills the bench database (bench/docker-compose.yml) with synthetic data.
+# The tables must exist already: run python -m db.migrate first.
+# Everything is generated from --seed, so two runs with the same arguments
+# produce the same rows. Guild and user activity is skewed so a few guilds
+# and users dominate, like the real logs. A manifest with the id ranges is
+# written next to the results so bench.load picks valid parameters.
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import mariadb
+
+GAMES = (
+    "maimai",
+    "CHUNITHM",
+    "オンゲキ",
+    "SOUND VOLTEX",
+    "beatmania IIDX",
+    "pop'n music",
+    "jubeat",
+    "太鼓の達人",
+    "Project DIVA",
+    "Arcaea",
+)
+DIFFICULTIES = ("BASIC", "ADVANCED", "EXPERT", "MASTER", "ULTIMA")
+LEVELS = tuple(f"{n}{plus}" for n in range(1, 16) for plus in ("", "+"))
+WORDS = (
+    "Night", "Star", "Rain", "Blue", "Dream", "Light", "Fire", "Sky", "Heart",
+    "Moon", "Storm", "Echo", "Glitch", "Neon", "Spiral", "Eden", "Zero",
+    "夜", "星", "雨", "夢", "光", "空", "心", "月", "嵐", "花", "桜", "ぼくら",
+    "セカイ", "ミラクル", "シンフォニー", "サクラ", "トキメキ",
+)  # fmt: skip
+EMOJIS = ("👍", "😂", "❤️", "🎉", "🔥", "😭", "🙏", "👀", "✨", "💯") + tuple(
+    f"<:custom{n}:{10**17 + n}>" for n in range(190)
+)
+GUILD_ID_BASE = 10**17
+USER_ID_BASE = 2 * 10**17
+CHANNEL_ID_BASE = 3 * 10**17
+BATCH_SIZE = 10000
+
+
+def connect(database: str):
+    return mariadb.connect(
+        host=os.getenv("DB_HOST", "127.0.0.1"),
+        port=int(os.getenv("DB_PORT", "3307")),
+        user=os.getenv("DB_USER", "bench"),
+        password=os.getenv("DB_PASSWORD", "bench"),
+        database=database,
+    )
+
+
+def skewed(rng: random.Random, n: int) -> int:
+    # Roughly Zipf-like index in [0, n): low indexes are picked far more often.
+    return min(int(rng.paretovariate(1.2)) - 1, n - 1)
+
+
+def insert_batches(conn, table: str, statement: str, rows, total: int) -> None:
+    cur = conn.cursor()
+    batch = []
+    done = 0
+    started = time.monotonic()
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            cur.executemany(statement, batch)
+            conn.commit()
+            done += len(batch)
+            batch = []
+            rate = done / max(time.monotonic() - started, 1e-9)
+            print(f"\r{table}: {done}/{total} ({rate:.0f} rows/s)", end="", flush=True)
+    if batch:
+        cur.executemany(statement, batch)
+        conn.commit()
+        done += len(batch)
+    print(f"\r{table}: {done}/{total} in {time.monotonic() - started:.1f}s")
+    cur.close()
+
+
+def truncate(conn, *tables: str) -> None:
+    cur = conn.cursor()
+    cur.execute("SET FOREIGN_KEY_CHECKS = 0")
+    for table in tables:
+        cur.execute(f"TRUNCATE TABLE {table}")
+    cur.execute("SET FOREIGN_KEY_CHECKS = 1")
+    conn.commit()
+    cur.close()
+
+
+def timestamps(rng: random.Random, now: datetime.datetime, days: int):
+    span = days * 86400
+    while True:
+        yield now - datetime.timedelta(seconds=rng.random() * span)
+
+
+def seed_logs(conn, args, now: datetime.datetime) -> None:
+    rng = random.Random(args.seed)
+    when = timestamps(rng, now, args.days)
+    truncate(conn, "emoji_log", "message_log")
+
+    def emoji_rows():
+        for _ in range(args.emoji_log_rows):
+            yield (
+                GUILD_ID_BASE + skewed(rng, args.guilds),
+                USER_ID_BASE + skewed(rng, args.users),
+                EMOJIS[skewed(rng, len(EMOJIS))],
+                next(when),
+            )
+
+    def message_rows():
+        for _ in range(args.message_log_rows):
+            yield (
+                GUILD_ID_BASE + skewed(rng, args.guilds),
+                CHANNEL_ID_BASE + rng.randrange(args.channels),
+                USER_ID_BASE + skewed(rng, args.users),
+                next(when),
+            )
+
+    insert_batches(
+        conn,
+        "emoji_log",
+        "INSERT INTO emoji_log (guild_id, user_id, PartialEmoji_str, used_at) VALUES (?, ?, ?, ?)",
+        emoji_rows(),
+        args.emoji_log_rows,
+    )
+    insert_batches(
+        conn,
+        "message_log",
+        "INSERT INTO message_log (guild_id, channel_id, user_id, sent_at) VALUES (?, ?, ?, ?)",
+        message_rows(),
+        args.message_log_rows,
+    )
+
+
+def seed_friend_codes(conn, args) -> None:
+    rng = random.Random(args.seed + 1)
+    truncate(conn, "friend_codes", "friend_code_games")
+    cur = conn.cursor()
+    cur.executemany(
+        "INSERT INTO friend_code_games (game_id, title) VALUES (?, ?)",
+        [(game_id, title) for game_id, title in enumerate(GAMES, 1)],
+    )
+    conn.commit()
+    cur.close()
+
+    def rows():
+        for user in range(args.friend_code_users):
+            for game_id in rng.sample(range(1, len(GAMES) + 1), rng.randint(1, 4)):
+                yield (USER_ID_BASE + user, game_id, f"{rng.randrange(10**12):012d}")
+
+    insert_batches(
+        conn,
+        "friend_codes",
+        "INSERT INTO friend_codes (user_id, game_id, friend_code) VALUES (?, ?, ?)",
+        rows(),
+        args.friend_code_users,
+    )
+
+
+def seed_advent(conn, args, now: datetime.datetime) -> None:
+    rng = random.Random(args.seed + 2)
+    truncate(conn, "advent")
+
+    def rows():
+        for year in range(now.year - args.advent_years + 1, now.year + 1):
+            for day in range(1, 26):
+                for slot in range(args.advent_per_day):
+                    user_id = USER_ID_BASE + rng.randrange(args.users)
+                    yield (
+                        user_id,
+                        f"author{user_id % 1000}",
+                        f"{rng.choice(WORDS)} {rng.choice(WORDS)} {slot}",
+                        f"https://example.com/advent/{year}/{day}/{slot}",
+                        datetime.date(year, 12, day),
+                    )
+
+    insert_batches(
+        conn,
+        "advent",
+        "INSERT INTO advent (user_id, author, title, url, date) VALUES (?, ?, ?, ?, ?)",
+        rows(),
+        args.advent_years * 25 * args.advent_per_day,
+    )
+
+
+def seed_rgdb(conn, args) -> None:
+    rng = random.Random(args.seed + 3)
+    truncate(conn, "Charts", "Songs", "Games")
+    cur = conn.cursor()
+    cur.executemany(
+        "INSERT INTO Games (game_id, game_name) VALUES (?, ?)",
+        [(game_id, name) for game_id, name in enumerate(GAMES, 1)],
+    )
+    conn.commit()
+    cur.close()
+
+    def songs():
+        for song_id in range(1, args.songs + 1):
+            bpm = rng.randrange(80, 300)
+            yield (
+                song_id,
+                1 + song_id % len(GAMES),
+                " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))),
+                rng.choice(("POPS", "ORIGINAL", "VARIETY", "GAME", "東方Project")),
+                f"{rng.choice(WORDS)} feat. {rng.choice(WORDS)}",
+                f"https://example.com/jackets/{song_id}.png",
+                datetime.timedelta(seconds=rng.randrange(90, 240)),
+                bpm,
+                bpm // 2,
+                bpm,
+                "",
+                f"https://example.com/songs/{song_id}",
+                f"https://example.com/wiki/{song_id}",
+                datetime.date(2012, 1, 1)
+                + datetime.timedelta(days=rng.randrange(4500)),
+            )
+
+    def charts():
+        for song_id in range(1, args.songs + 1):
+            base = rng.randrange(len(LEVELS) - len(DIFFICULTIES))
+            for i in range(args.charts_per_song):
+                level = LEVELS[min(base + i * 3, len(LEVELS) - 1)]
+                yield (
+                    song_id,
+                    DIFFICULTIES[i % len(DIFFICULTIES)],
+                    round(float(level.rstrip("+")) + rng.random(), 1),
+                    level,
+                    rng.randrange(200, 3000),
+                    f"designer{rng.randrange(50)}",
+                    f"https://example.com/charts/{song_id}/{i}.png",
+                    None,
+                )
+
+    insert_batches(
+        conn,
+        "Songs",
+        "INSERT INTO Songs (song_id, game_id, title, category, artist, jacket_image, length, bpm_main, bpm_min, bpm_max, description, song_url, wiki_url, release_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        songs(),
+        args.songs,
+    )
+    insert_batches(
+        conn,
+        "Charts",
+        "INSERT INTO Charts (song_id, difficulty, const, level, num_notes, designer, chart_image_url, description) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        charts(),
+        args.songs * args.charts_per_song,
+    )
+
+
+def build_derived_tables() -> None:
+    # The rollup and the daily counters are normally kept up to date by the
+    # app; after a bulk load they are rebuilt from the raw logs.
+    for command in (
+        ("db.rollup", "backfill"),
+        ("db.counters", "rebuild", "all"),
+    ):
+        subprocess.run([sys.executable, "-m", *command], check=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--guilds", type=int, default=200)
+    parser.add_argument("--channels", type=int, default=50)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--emoji-log-rows", type=int, default=1000000)
+    parser.add_argument("--message-log-rows", type=int, default=1000000)
+    parser.add_argument("--friend-code-users", type=int, default=5000)
+    parser.add_argument("--advent-years", type=int, default=5)
+    parser.add_argument("--advent-per-day", type=int, default=3)
+    parser.add_argument("--songs", type=int, default=20000)
+    parser.add_argument("--charts-per-song", type=int, default=5)
+    parser.add_argument("--skip-logs", action="store_true")
+    parser.add_argument("--skip-derived", action="store_true")
+    parser.add_argument("--manifest", default="bench/results/seed.json")
+    args = parser.parse_args()
+
+    now = datetime.datetime.now().replace(microsecond=0)
+    conn = connect(os.getenv("DB_NAME", "otogame"))
+    if not args.skip_logs:
+        seed_logs(conn, args, now)
+    seed_friend_codes(conn, args)
+    seed_advent(conn, args, now)
+    conn.close()
+    conn = connect(os.getenv("RGDB_NAME", "rgdb"))
+    seed_rgdb(conn, args)
+    conn.close()
+    if not args.skip_derived:
+        build_derived_tables()
+
+    manifest = dict(vars(args))
+    manifest.update(
+        seeded_at=now.isoformat(),
+        guild_id_base=GUILD_ID_BASE,
+        user_id_base=USER_ID_BASE,
+        channel_id_base=CHANNEL_ID_BASE,
+        games=list(GAMES),
+        levels=list(LEVELS),
+        emojis=list(EMOJIS),
+        words=list(WORDS),
+    )
+    os.makedirs(os.path.dirname(args.manifest), exist_ok=True)
+    with open(args.manifest, "w") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"Wrote {args.manifest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# python -m bench.serialize_songs
+#
+# Compares the old song serialization (positional dicts, json.loads of the
+# charts column, FastAPI's jsonable_encoder + json.dumps) with the
+# song_json fast path and the pre-encoded db.documents path for 1,
+# 100 and 5000 songs.
+import datetime
+import json
+import timeit
+
+from fastapi.encoders import jsonable_encoder
+
+import serialize
+from db.documents import SongDocument
+
+GAME_NAMES = {1: "maimai", 2: "CHUNITHM", 3: "SOUND VOLTEX"}
+
+
+def make_rows(count: int) -> list[dict]:
+    rows = []
+    for song_id in range(count):
+        charts = [
+            {
+                "chart_id": song_id * 5 + i,
+                "difficulty": difficulty,
+                "const": 10.0 + i * 0.7,
+                "level": str(8 + i),
+                "num_notes": 500 + i * 150,
+                "designer": "designer",
+                "chart_image_url": f"https://example.com/charts/{song_id}/{i}.png",
+                "description": None,
+            }
+            for i, difficulty in enumerate(
+                ("BASIC", "ADVANCED", "EXPERT", "MASTER", "ULTIMA")
+            )
+        ]
+        rows.append(
+            {
+                "song_id": song_id,
+                "game_id": 1 + song_id % 3,
+                "title": f"Song {song_id}",
+                "category": "ORIGINAL",
+                "artist": f"Artist {song_id % 97}",
+                "jacket_image": f"https://example.com/jackets/{song_id}.png",
+                "length": 125,
+                "bpm_main": 180,
+                "bpm_min": 90,
+                "bpm_max": 180,
+                "description": "",
+                "song_url": f"https://example.com/songs/{song_id}",
+                "wiki_url": f"https://example.com/wiki/{song_id}",
+                "release_date": datetime.date(2020, 1, 1),
+                "charts": json.dumps(charts),
+            }
+        )
+    return rows
+
+
+def old_path(rows: list[dict]) -> bytes:
+    songs_list = []
+    for row in rows:
+        song_tuple = tuple(row.values())
+        song_dic = {}
+        song_dic["song_id"] = song_tuple[0]
+        game_id = song_tuple[1]
+        song_dic["game_id"] = game_id
+        song_dic["game_name"] = GAME_NAMES.get(game_id)
+        song_dic["title"] = song_tuple[2]
+        song_dic["category"] = song_tuple[3]
+        song_dic["artist"] = song_tuple[4]
+        song_dic["jacket_image"] = song_tuple[5]
+        song_dic["length"] = song_tuple[6]
+        song_dic["bpm_main"] = song_tuple[7]
+        song_dic["bpm_min"] = song_tuple[8]
+        song_dic["bpm_max"] = song_tuple[9]
+        song_dic["description"] = song_tuple[10]
+        song_dic["song_url"] = song_tuple[11]
+        song_dic["wiki_url"] = song_tuple[12]
+        song_dic["release_date"] = song_tuple[13]
+        song_dic["charts"] = json.loads(song_tuple[14])
+        songs_list.append(song_dic)
+    res_dic = {"songs": songs_list, "total": len(songs_list)}
+    return json.dumps(jsonable_encoder(res_dic)).encode()
+
+
+def song_json(song_row: dict, game_names: dict[int, str]) -> bytes:
+    # The previous fast path: the charts column already is a JSON array
+    # built by MariaDB, so it is spliced into the output as-is instead of
+    # being parsed and re-encoded.
+    song_dic = {}
+    for field in serialize.SONG_FIELDS:
+        if field == "game_name":
+            song_dic[field] = game_names.get(song_row["game_id"])
+        else:
+            song_dic[field] = song_row[field]
+    charts = song_row["charts"]
+    if isinstance(charts, str):
+        charts = charts.encode()
+    return serialize.dumps(song_dic)[:-1] + b',"charts":' + (charts or b"[]") + b"}"
+
+
+def fast_path(rows: list[dict]) -> bytes:
+    songs_list = [song_json(row, GAME_NAMES) for row in rows]
+    return serialize.json_object("songs", songs_list, {"total": len(songs_list)})
+
+
+def make_documents(rows: list[dict]) -> list[SongDocument]:
+    return [
+        SongDocument(
+            {**row, "game_name": GAME_NAMES.get(row["game_id"])},
+            json.loads(row["charts"]),
+            b"",
+        )
+        for row in rows
+    ]
+
+
+def document_path(documents: list[SongDocument]) -> bytes:
+    songs_list = [document.json for document in documents]
+    return serialize.json_object("songs", songs_list, {"total": len(songs_list)})
+
+
+def main() -> None:
+    for count in (1, 100, 5000):
+        rows = make_rows(count)
+        documents = make_documents(rows)
+        expected = json.loads(old_path(rows))
+        assert expected == json.loads(fast_path(rows))
+        assert expected == json.loads(document_path(documents))
+        number = max(1, 20000 // count)
+        old = min(timeit.repeat(lambda: old_path(rows), number=number, repeat=5))
+        fast = min(timeit.repeat(lambda: fast_path(rows), number=number, repeat=5))
+        document = min(
+            timeit.repeat(lambda: document_path(documents), number=number, repeat=5)
+        )
+        old_us = old / number * 1e6
+        fast_us = fast / number * 1e6
+        document_us = document / number * 1e6
+        print(
+            f"{count:>5} songs: old {old_us:10.1f} us  fast {fast_us:10.1f} us  "
+            f"documents {document_us:10.1f} us  "
+            f"speedup {old_us / fast_us:5.1f}x / {old_us / document_us:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
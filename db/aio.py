@@ -0,0 +1,99 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import db.db as _db
+import metrics
+from settings import DB_EXECUTOR_WORKERS
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    # Every blocking db.* call runs on this bounded pool so a slow query only
+    # occupies one worker thread instead of the whole event loop.
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db"
+                )
+    return _executor
+
+
+async def run(fn, *args, **kwargs):
+    # The call sees the caller's context variables, as with asyncio.to_thread,
+    # so db.pin_primary() in a request applies to its queries.
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        _get_executor(), functools.partial(context.run, fn, *args, **kwargs)
+    )
+
+
+def wrap(fn):
+    name = fn.__name__
+
+    def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException:
+            metrics.db_query_errors.inc(name)
+            raise
+        metrics.observe_db_call(name, started, result)
+        return result
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run(timed, *args, **kwargs)
+
+    return wrapper
+
+
+async def iterate(fn, *args):
+    # Rows of one of db.db's iter_* generators, read on the same executor
+    # (and timed like the other calls) a batch at a time, so a streamed
+    # response never queries from the event loop or Starlette's threadpool.
+    rows = fn(*args)
+
+    def next_batch():
+        return list(itertools.islice(rows, _db.STREAM_BATCH_SIZE))
+
+    next_batch.__name__ = fn.__name__
+    fetch = wrap(next_batch)
+    try:
+        while True:
+            batch = await fetch()
+            if not batch:
+                break
+            for row in batch:
+                yield row
+    finally:
+        # Hands the connection back even when the client went away.
+        await run(rows.close)
+
+
+def shutdown(wait: bool = True) -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
+
+
+def __getattr__(name: str):
+    # Expose every function in db.db under the same name and signature,
+    # but as a coroutine: `await db.get_emoji_usage(...)`.
+    fn = getattr(_db, name)
+    if not inspect.isfunction(fn):
+        return fn
+    wrapped = wrap(fn)
+    globals()[name] = wrapped
+    return wrapped
@@ -0,0 +1,383 @@
+# python -m db.audit [--min-rows N] [--verbose]
+#
+# Calls every query function in db/db.py (plus db.rollup and db.counters)
+# with sample arguments through a recording connection, then runs EXPLAIN on
+# each distinct statement and flags full table or index scans, filesorts and
+# temporary tables. Reads run for real so later statements get realistic
+# inputs; writes are only recorded, never executed. Exits with status 1 when
+# a plan has a flag that is not listed in ALLOWED.
+import argparse
+import datetime
+import re
+import sys
+
+import mariadb
+
+import db.counters as counters
+import db.db as db
+import db.rollup as rollup
+import db.series as series
+import db.topk as topk
+
+# Flags that are inherent to a function's query, with the reason.
+ALLOWED = {
+    "get_emoji_usage": ({"temporary", "filesort"}, "ranks aggregated counts"),
+    "get_emoji_member_rank": ({"temporary", "filesort"}, "ranks aggregated counts"),
+    "get_message_count_by_guild_and_user_id": (
+        {"temporary", "filesort"},
+        "groups the union of raw and daily counts",
+    ),
+    "get_message_count_series": (
+        {"temporary", "filesort"},
+        "groups counts by user and time",
+    ),
+    "song_search.rebuild": ({"full scan"}, "loads every song into the index"),
+    "song_documents.refresh": (
+        {"full scan", "full index scan", "temporary", "filesort"},
+        "digests every song and its charts; runs periodically off the request path",
+    ),
+    "random_songs.rebuild": (
+        {"full scan", "full index scan", "temporary"},
+        "loads every song and level into the index",
+    ),
+    "roll_up_emoji_log": ({"temporary", "filesort"}, "aggregates an hour range"),
+    "check_message_counts": ({"temporary", "filesort"}, "aggregates a day"),
+    "rebuild_message_counts": ({"temporary", "filesort"}, "aggregates a day"),
+}
+EXPLAINABLE = re.compile(
+    r"^\s*(SELECT|UPDATE|DELETE|INSERT\s.*\sSELECT\s)", re.S | re.I
+)
+
+
+class _RecordingCursor:
+    def __init__(self, cur, database: str, recorder):
+        self._cur = cur
+        self._database = database
+        self._recorder = recorder
+        self._executed = False
+
+    def execute(self, query: str, params: tuple = ()):
+        self._recorder.record(self._database, query, params)
+        self._executed = query.lstrip().upper().startswith("SELECT")
+        if self._executed:
+            self._cur.execute(query, params)
+
+    def executemany(self, query: str, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        if seq_of_params:
+            self._recorder.record(self._database, query, seq_of_params[0])
+        self._executed = False
+
+    def fetchall(self):
+        return self._cur.fetchall() if self._executed else []
+
+    def fetchone(self):
+        return self._cur.fetchone() if self._executed else None
+
+    def fetchmany(self, size: int):
+        return self._cur.fetchmany(size) if self._executed else []
+
+    @property
+    def rowcount(self) -> int:
+        return self._cur.rowcount if self._executed else 0
+
+    def close(self):
+        self._cur.close()
+
+
+class _RecordingConnection:
+    def __init__(self, conn, database: str, recorder):
+        self._conn = conn
+        self._database = database
+        self._recorder = recorder
+
+    def cursor(self, dictionary: bool = False, **kwargs):
+        return _RecordingCursor(
+            self._conn.cursor(dictionary=dictionary), self._database, self._recorder
+        )
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self._conn.rollback()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class Recorder:
+    def __init__(self):
+        self.function = None
+        # (database, normalized query) -> [query, params, [functions]]
+        self.statements: dict[tuple[str, str], list] = {}
+
+    def record(self, database: str, query: str, params) -> None:
+        key = (database, " ".join(query.split()))
+        entry = self.statements.setdefault(key, [query, tuple(params), []])
+        if self.function not in entry[2]:
+            entry[2].append(self.function)
+
+
+def _sample(get_conn, query: str, default: tuple) -> tuple:
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(query)
+        row = cur.fetchone()
+    except mariadb.Error:
+        row = None
+    cur.close()
+    conn.close()
+    return tuple(row) if row else default
+
+
+def sample_calls() -> list[tuple[str, object, tuple]]:
+    # (label, function, args); loaders come first so later calls hit the
+    # in-process caches instead of attributing the loads to themselves.
+    guild_id, user_id, emoji = _sample(
+        db.get_connection,
+        "SELECT guild_id, user_id, PartialEmoji_str FROM emoji_log ORDER BY id DESC LIMIT 1",
+        (0, 0, "👍"),
+    )
+    (channel_id,) = _sample(
+        db.get_connection, "SELECT channel_id FROM message_log LIMIT 1", (0,)
+    )
+    fc_user_id, game_title = _sample(
+        db.get_connection,
+        "SELECT fc.user_id, fcg.title FROM friend_codes fc JOIN friend_code_games fcg ON fc.game_id = fcg.game_id LIMIT 1",
+        (0, "maimai"),
+    )
+    advent_user_id, advent_date, advent_id = _sample(
+        db.get_connection,
+        "SELECT user_id, date, id FROM advent ORDER BY date DESC LIMIT 1",
+        (0, datetime.date.today(), 0),
+    )
+    game_name, level = _sample(
+        db.get_rgdb_connection,
+        "SELECT Games.game_name, Charts.level FROM Games JOIN Songs ON Songs.game_id = Games.game_id JOIN Charts ON Charts.song_id = Songs.song_id LIMIT 1",
+        ("maimai", "13"),
+    )
+    date_str = advent_date.strftime("%Y-%m-%d")
+    write_user_id = 9 * 10**17
+    return [
+        ("load_game_names", db.load_game_names, ()),
+        ("song_search.rebuild", db.song_search.rebuild, ()),
+        ("random_songs.rebuild", db.random_songs.rebuild, ()),
+        ("song_documents.refresh", db.song_documents.refresh, ()),
+        ("get_emoji_usage", db.get_emoji_usage, (guild_id, 1)),
+        ("get_emoji_usage", db.get_emoji_usage, (guild_id, 720)),
+        ("get_emoji_usage", db.get_emoji_usage, (guild_id, 720, user_id)),
+        ("get_emoji_usage", db.get_emoji_usage, (guild_id, 720, None, 10)),
+        ("get_emoji_member_rank", db.get_emoji_member_rank, (guild_id, None, 720)),
+        ("get_emoji_member_rank", db.get_emoji_member_rank, (guild_id, emoji, 720)),
+        ("insert_game_title", db.insert_game_title, ("audit",)),
+        ("delete_game_title", db.delete_game_title, ("audit",)),
+        ("get_game_titles", db.get_game_titles, ()),
+        (
+            "get_friend_code_by_id_and_title",
+            db.get_friend_code_by_id_and_title,
+            (fc_user_id, game_title),
+        ),
+        ("get_friend_code_by_title", db.get_friend_code_by_title, (game_title,)),
+        ("get_friend_code_by_id", db.get_friend_code_by_id, (fc_user_id,)),
+        ("get_friend_code", db.get_friend_code, (None, 100)),
+        ("get_friend_code", db.get_friend_code, ([fc_user_id, 1], 100)),
+        (
+            "upsert_friend_code",
+            db.upsert_friend_code,
+            (write_user_id, game_title, "0"),
+        ),
+        (
+            "upsert_friend_codes",
+            db.upsert_friend_codes,
+            ([(write_user_id, game_title, "0")],),
+        ),
+        ("delete_friend_code", db.delete_friend_code, (write_user_id, game_title)),
+        (
+            "insert_message_log",
+            db.insert_message_log,
+            (guild_id, channel_id, user_id),
+        ),
+        (
+            "insert_message_logs",
+            db.insert_message_logs,
+            ([(guild_id, channel_id, user_id)],),
+        ),
+        (
+            "get_message_count_by_guild_and_user_id",
+            db.get_message_count_by_guild_and_user_id,
+            (guild_id, user_id, 168),
+        ),
+        (
+            "get_message_count_by_guild_and_user_id",
+            db.get_message_count_by_guild_and_user_id,
+            (guild_id, user_id, 168, channel_id),
+        ),
+        (
+            "get_message_count_series",
+            series.get_message_count_series,
+            (guild_id, [user_id], 720, "day"),
+        ),
+        (
+            "get_message_count_series",
+            series.get_message_count_series,
+            (guild_id, [user_id], 168, "hour", "UTC", channel_id),
+        ),
+        ("get_advent_by_year", db.get_advent_by_year, (advent_date.year,)),
+        (
+            "get_advent_by_year",
+            db.get_advent_by_year,
+            (advent_date.year, [date_str, advent_id], 50),
+        ),
+        (
+            "get_advent_by_id_and_date",
+            db.get_advent_by_id_and_date,
+            (advent_user_id, date_str),
+        ),
+        (
+            "upsert_advent",
+            db.upsert_advent,
+            (write_user_id, "audit", "audit", "", date_str),
+        ),
+        (
+            "upsert_advents",
+            db.upsert_advents,
+            ([(write_user_id, "audit", "audit", "", date_str)],),
+        ),
+        ("delete_advent", db.delete_advent, (write_user_id, date_str)),
+        (
+            "get_song_by_title_and_game_name_and_artist",
+            db.get_song_by_title_and_game_name_and_artist,
+            (None, game_name, None, 50),
+        ),
+        (
+            "get_song_by_title_and_game_name_and_artist",
+            db.get_song_by_title_and_game_name_and_artist,
+            (None, None, None, 50, [1]),
+        ),
+        (
+            "get_song_by_title_and_game_name_and_artist",
+            db.get_song_by_title_and_game_name_and_artist,
+            ("a", None, None, 50),
+        ),
+        ("get_random_song", db.get_random_song, (game_name, level, 5)),
+        ("get_random_song", db.get_random_song, (None, None)),
+        ("roll_up_emoji_log", rollup.roll_up_emoji_log, ()),
+        ("emoji_topk.poll", topk.EmojiTopK(200, 24).poll, ()),
+        ("check_message_counts", counters.check_message_counts, (1,)),
+        ("rebuild_message_counts", counters.rebuild_message_counts, (1,)),
+    ]
+
+
+def record_statements() -> Recorder:
+    recorder = Recorder()
+    get_connection = db.get_connection
+    get_rgdb_connection = db.get_rgdb_connection
+    rgdb_snapshot = db.rgdb_snapshot
+    replicas = db.replicas
+    calls = sample_calls()
+    db.get_connection = lambda: _RecordingConnection(get_connection(), "app", recorder)
+    db.get_rgdb_connection = lambda: _RecordingConnection(
+        get_rgdb_connection(), "rgdb", recorder
+    )
+    # Audit the MariaDB queries even when reads are served from the snapshot,
+    # and run every query on the primary.
+    db.rgdb_snapshot = None
+    db.replicas = None
+    try:
+        for label, fn, args in calls:
+            recorder.function = label
+            try:
+                result = fn(*args)
+                if hasattr(result, "__next__"):
+                    list(result)
+            except (mariadb.Error, TypeError, ValueError) as e:
+                print(f"Error calling {label}: {e}")
+    finally:
+        db.get_connection = get_connection
+        db.get_rgdb_connection = get_rgdb_connection
+        db.rgdb_snapshot = rgdb_snapshot
+        db.replicas = replicas
+    return recorder
+
+
+def plan_flags(plan: list[dict], min_rows: int) -> set[str]:
+    flags = set()
+    for row in plan:
+        table = row.get("table") or ""
+        extra = row.get("Extra") or ""
+        rows = row.get("rows") or 0
+        # Derived tables and unions are temporary results of the query itself.
+        if not table.startswith("<") and rows >= min_rows:
+            if row.get("type") == "ALL":
+                flags.add("full scan")
+            elif row.get("type") == "index":
+                flags.add("full index scan")
+        if "Using filesort" in extra:
+            flags.add("filesort")
+        if "Using temporary" in extra:
+            flags.add("temporary")
+    return flags
+
+
+def explain(database: str, query: str, params: tuple) -> list[dict]:
+    conn = db.get_rgdb_connection() if database == "rgdb" else db.get_connection()
+    cur = conn.cursor(dictionary=True)
+    try:
+        cur.execute("EXPLAIN " + query, params)
+        return cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+
+
+def audit(min_rows: int = 1000, verbose: bool = False) -> int:
+    recorder = record_statements()
+    problems = 0
+    for (database, normalized), (query, params, functions) in sorted(
+        recorder.statements.items(), key=lambda item: item[1][2]
+    ):
+        if not EXPLAINABLE.match(query):
+            continue
+        try:
+            plan = explain(database, query, params)
+        except mariadb.Error as e:
+            print(f"ERROR    {', '.join(functions)}: {e}\n    {normalized}")
+            problems += 1
+            continue
+        flags = plan_flags(plan, min_rows)
+        allowed = set()
+        for function in functions:
+            allowed |= ALLOWED.get(function, (set(), ""))[0]
+        unexpected = flags - allowed
+        status = "FLAG" if unexpected else "ok"
+        if unexpected:
+            problems += 1
+        if unexpected or verbose:
+            print(f"{status:<8} {', '.join(functions)} [{database}]")
+            print(f"    {normalized[:300]}")
+            if flags:
+                print(f"    flags: {', '.join(sorted(flags))}")
+            for row in plan:
+                print(
+                    f"    {row.get('table')}: type={row.get('type')} key={row.get('key')} rows={row.get('rows')} {row.get('Extra') or ''}"
+                )
+    print(f"{len(recorder.statements)} statements, {problems} flagged")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--min-rows", type=int, default=1000)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    sys.exit(1 if audit(args.min_rows, args.verbose) else 0)
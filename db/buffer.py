@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+
+class WriteBehindBuffer:
+    def __init__(
+        self,
+        flush,
+        max_size: int = 500,
+        max_age: float = 1.0,
+        max_retries: int = 3,
+        max_rows: int | None = None,
+    ):
+        # flush is an async callable that receives the buffered rows. Rows
+        # whose flush failed are retried with the next flush; they are
+        # dropped (and printed) after max_retries failed flushes in a row,
+        # or oldest first once more than max_rows (default 10 * max_size)
+        # are held.
+        self._flush = flush
+        self.max_size = max_size
+        self.max_age = max_age
+        self.max_retries = max_retries
+        self.max_rows = max_rows if max_rows is not None else max_size * 10
+        self._rows = []
+        self._oldest_at = None
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._pending = set()
+        self._failures = 0
+        self.flushed_rows = 0
+        self.flushes = 0
+        self.dropped_rows = 0
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def add(self, row) -> None:
+        if not self._rows:
+            self._oldest_at = time.monotonic()
+        self._rows.append(row)
+        if len(self._rows) > self.max_rows:
+            self._drop(self._rows[: -self.max_rows], "buffer full")
+            del self._rows[: -self.max_rows]
+        # After a failed flush, retries wait for max_age instead.
+        if (
+            len(self._rows) >= self.max_size
+            and not self._pending
+            and not self._failures
+        ):
+            task = asyncio.create_task(self.flush())
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def flush(self) -> None:
+        async with self._lock:
+            rows, self._rows = self._rows, []
+            self._oldest_at = None
+            if not rows:
+                return
+            try:
+                await self._flush(rows)
+            except Exception as e:
+                print(f"Error flushing {len(rows)} buffered rows: {e}")
+                self._failures += 1
+                if self._failures > self.max_retries:
+                    self._drop(rows, f"{self._failures} failed flushes")
+                    self._failures = 0
+                    return
+                # Keep the rows for the next attempt rather than dropping them.
+                self._rows[:0] = rows
+                self._oldest_at = time.monotonic()
+                if len(self._rows) > self.max_rows:
+                    self._drop(self._rows[: -self.max_rows], "buffer full")
+                    del self._rows[: -self.max_rows]
+                return
+            self._failures = 0
+            self.flushed_rows += len(rows)
+            self.flushes += 1
+
+    def _drop(self, rows: list, reason: str) -> None:
+        self.dropped_rows += len(rows)
+        print(f"Dropping {len(rows)} buffered rows after {reason}")
+
+    async def _run(self) -> None:
+        interval = max(self.max_age / 4, 0.01)
+        while True:
+            await asyncio.sleep(interval)
+            if (
+                self._oldest_at is not None
+                and time.monotonic() - self._oldest_at >= self.max_age
+            ):
+                await self.flush()
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._rows),
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "dropped_rows": self.dropped_rows,
+        }
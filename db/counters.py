@@ -0,0 +1,92 @@
+import datetime
+import sys
+
+import db.db as db
+import db.migrate as migrate
+
+
+def _get_day_range(cur, days: int | None) -> tuple[datetime.date, datetime.date]:
+    cur.execute("SELECT CURDATE()")
+    today = cur.fetchone()[0]
+    if days is not None:
+        return today - datetime.timedelta(days=days - 1), today
+    cur.execute("SELECT DATE(MIN(sent_at)) FROM message_log")
+    first_day = cur.fetchone()[0]
+    return first_day or today, today
+
+
+def check_message_counts(days: int | None = 7) -> list[tuple]:
+    # Returns (guild_id, user_id, channel_id, day, raw_count, counter_count)
+    # for every key where message_count_daily disagrees with message_log.
+    with db.get_connection() as conn:
+        cur = conn.cursor()
+        first_day, last_day = _get_day_range(cur, days)
+
+        mismatches = []
+        day = first_day
+        while day <= last_day:
+            cur.execute(
+                "SELECT guild_id, user_id, channel_id, COUNT(*) FROM message_log WHERE sent_at >= ? AND sent_at < ? + INTERVAL 1 DAY GROUP BY guild_id, user_id, channel_id",
+                (day, day),
+            )
+            raw = {row[:3]: row[3] for row in cur.fetchall()}
+            cur.execute(
+                "SELECT guild_id, user_id, channel_id, message_count FROM message_count_daily WHERE day = ?",
+                (day,),
+            )
+            counted = {row[:3]: row[3] for row in cur.fetchall()}
+            for key in raw.keys() | counted.keys():
+                raw_count = raw.get(key, 0)
+                counter_count = counted.get(key, 0)
+                if raw_count != counter_count:
+                    mismatches.append((*key, day, raw_count, counter_count))
+            day += datetime.timedelta(days=1)
+
+        cur.close()
+    return mismatches
+
+
+def rebuild_message_counts(days: int | None = 7) -> int:
+    # Recomputes the counters one day per transaction. Rows ingested for the
+    # day being rebuilt while it runs may be counted twice, so prefer running
+    # it for past days or during a quiet period.
+    with db.get_connection() as conn:
+        cur = conn.cursor()
+        first_day, last_day = _get_day_range(cur, days)
+
+        rebuilt = 0
+        day = first_day
+        while day <= last_day:
+            cur.execute("DELETE FROM message_count_daily WHERE day = ?", (day,))
+            cur.execute(
+                "INSERT INTO message_count_daily (guild_id, user_id, channel_id, day, message_count) SELECT guild_id, user_id, channel_id, ?, COUNT(*) FROM message_log WHERE sent_at >= ? AND sent_at < ? + INTERVAL 1 DAY GROUP BY guild_id, user_id, channel_id",
+                (day, day, day),
+            )
+            conn.commit()
+            rebuilt += 1
+            day += datetime.timedelta(days=1)
+
+        cur.close()
+    return rebuilt
+
+
+if __name__ == "__main__":
+    # python -m db.counters check|rebuild [days|all]
+    usage = "usage: python -m db.counters check|rebuild [days|all]"
+    if len(sys.argv) < 2 or sys.argv[1] not in ("check", "rebuild"):
+        print(usage)
+        sys.exit(2)
+    days = 7
+    if len(sys.argv) > 2:
+        days = None if sys.argv[2] == "all" else int(sys.argv[2])
+    migrate.exit_if_pending(("app",))
+    if sys.argv[1] == "check":
+        mismatches = check_message_counts(days)
+        for guild_id, user_id, channel_id, day, raw, counted in mismatches:
+            print(
+                f"{day} guild={guild_id} user={user_id} channel={channel_id}: message_log={raw} message_count_daily={counted}"
+            )
+        print(f"{len(mismatches)} mismatched counters")
+        sys.exit(1 if mismatches else 0)
+    else:
+        print(f"Rebuilt message_count_daily for {rebuild_message_counts(days)} days")
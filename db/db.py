@@ -1,125 +1,273 @@
+import contextvars
 import datetime
 import mariadb
+import serialize
+import sqlite3
 import sys
-from main import DB_HOST, DB_USER, DB_PASSWORD, DB_NAME, RGDB_NAME
-
-
-def get_connection() -> mariadb.Connection | None:
+import threading
+from db.documents import SongDocument, SongDocuments
+from db.games import GameNameCache
+from db.pool import ConnectionPool, PooledConnection
+from db.random_index import RandomSongIndex
+from db.replicas import ReplicaSet, parse_hosts
+from db.search import SongSearchIndex
+from db.snapshot import RgdbSnapshot
+from db.versions import TableVersions
+from settings import (
+    DB_HOST,
+    DB_PORT,
+    DB_USER,
+    DB_PASSWORD,
+    DB_NAME,
+    RGDB_NAME,
+    DB_POOL_SIZE,
+    DB_POOL_MAX_OVERFLOW,
+    DB_POOL_RECYCLE,
+    DB_POOL_IDLE_TIMEOUT,
+    DB_POOL_TIMEOUT,
+    DB_REPLICA_HOSTS,
+    DB_REPLICA_MAX_LAG,
+    DB_REPLICA_EJECT_SECONDS,
+    DB_REPLICA_ACQUIRE_TIMEOUT,
+    DB_REPLICA_CHECK_INTERVAL,
+    GAME_NAME_CACHE_TTL,
+    RGDB_SNAPSHOT_PATH,
+    SHARED_VERSIONS,
+)
+
+
+# Bumped by every write below; the API derives ETags from them.
+versions = TableVersions((lambda: get_connection()) if SHARED_VERSIONS else None)
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(database: str, host: tuple[str, int] | None = None) -> ConnectionPool:
+    # The primary's pools are named after the database, a replica's after
+    # database@host:port.
+    name = database if host is None else f"{database}@{host[0]}:{host[1]}"
+    pool = _pools.get(name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(name)
+            if pool is None:
+                pool = ConnectionPool(
+                    name,
+                    dict(
+                        host=DB_HOST if host is None else host[0],
+                        port=DB_PORT if host is None else host[1],
+                        user=DB_USER,
+                        password=DB_PASSWORD,
+                        database=database,
+                    ),
+                    size=DB_POOL_SIZE,
+                    max_overflow=DB_POOL_MAX_OVERFLOW,
+                    recycle=DB_POOL_RECYCLE,
+                    idle_timeout=DB_POOL_IDLE_TIMEOUT,
+                    timeout=DB_POOL_TIMEOUT,
+                )
+                _pools[name] = pool
+    return pool
+
+
+def get_pool_stats() -> list[dict]:
+    return [pool.stats() for pool in _pools.values()]
+
+
+def close_pools() -> None:
+    for pool in _pools.values():
+        pool.close()
+
+
+def get_connection() -> PooledConnection | None:
     try:
-        conn = mariadb.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME,
-        )
-        return conn
+        return _get_pool(DB_NAME).acquire()
     except mariadb.Error as e:
         print(f"Error connecting to MariaDB Platform: {e}")
         sys.exit(1)
 
 
-def get_rgdb_connection() -> mariadb.Connection | None:
+def get_rgdb_connection() -> PooledConnection | None:
     try:
-        conn = mariadb.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=RGDB_NAME,
-        )
-        return conn
+        return _get_pool(RGDB_NAME).acquire()
     except mariadb.Error as e:
         print(f"Error connecting to MariaDB Platform: {e}")
         sys.exit(1)
 
 
-def get_emoji_usage(
+replicas = (
+    ReplicaSet(
+        parse_hosts(DB_REPLICA_HOSTS, DB_PORT),
+        _get_pool,
+        DB_NAME,
+        max_lag=DB_REPLICA_MAX_LAG,
+        eject_seconds=DB_REPLICA_EJECT_SECONDS,
+        acquire_timeout=DB_REPLICA_ACQUIRE_TIMEOUT,
+    )
+    if DB_REPLICA_HOSTS
+    else None
+)
+# A replica may be this far behind before check_replicas() notices, so
+# tables written more recently are read from the primary.
+REPLICA_PIN_SECONDS = DB_REPLICA_MAX_LAG + DB_REPLICA_CHECK_INTERVAL
+_read_primary = contextvars.ContextVar("read_primary", default=False)
+
+
+def pin_primary() -> None:
+    # Reads in the current context (a request, and the db.aio calls made
+    # from it) go to the primary from here on.
+    _read_primary.set(True)
+
+
+def _read_connection(database: str, tables: tuple[str, ...]):
+    if (
+        replicas is None
+        or _read_primary.get()
+        or versions.changed_within(REPLICA_PIN_SECONDS, *tables)
+    ):
+        return None
+    return replicas.acquire(database)
+
+
+def get_read_connection(*tables: str) -> PooledConnection | None:
+    # For queries a replica may answer. tables are the ones written through
+    # this API that the query reads; while one of them was written in the
+    # last REPLICA_PIN_SECONDS, it is read from the primary instead.
+    return _read_connection(DB_NAME, tables) or get_connection()
+
+
+def check_replicas() -> None:
+    if replicas is not None:
+        replicas.check()
+
+
+EMOJI_ROLLUP = "emoji_log_hourly"
+STREAM_BATCH_SIZE = 500
+
+
+def floor_hour(dt: datetime.datetime) -> datetime.datetime:
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def _get_emoji_counts(
+    group_column: str,
     guild_id: int,
     hour: int,
-    user_id: int | None = None,
+    filter_column: str | None = None,
+    filter_value: int | str | None = None,
+    limit: int | None = None,
 ):
-    conn = get_connection()
-    cur = conn.cursor()
+    # Whole hours come from emoji_log_hourly; the partial hour at the start
+    # of the window and everything after the rollup watermark come from the
+    # raw emoji_log rows.
+    with get_read_connection() as conn:
+        cur = conn.cursor()
 
-    if user_id is None:
-        cur.execute(
-            "SELECT PartialEmoji_str, COUNT(*) AS emoji_count FROM emoji_log WHERE guild_id=? AND used_at >= DATE_SUB(NOW(), INTERVAL ? HOUR) GROUP BY PartialEmoji_str ORDER BY emoji_count DESC",
-            (
-                guild_id,
-                hour,
-            ),
-        )
-    else:
         cur.execute(
-            "SELECT PartialEmoji_str, COUNT(*) AS emoji_count FROM emoji_log WHERE guild_id=? AND user_id=? AND used_at >= DATE_SUB(NOW(), INTERVAL ? HOUR) GROUP BY PartialEmoji_str ORDER BY emoji_count DESC",
-            (
-                guild_id,
-                user_id,
-                hour,
-            ),
+            "SELECT NOW(), (SELECT rolled_until FROM rollup_watermarks WHERE name = ?)",
+            (EMOJI_ROLLUP,),
         )
-    result = cur.fetchall()
+        now, rolled_until = cur.fetchone()
+        start = now - datetime.timedelta(hours=hour)
+        bucket_start = floor_hour(start)
+        if bucket_start < start:
+            bucket_start += datetime.timedelta(hours=1)
+
+        where = "guild_id = ?"
+        params = [guild_id]
+        if filter_column is not None:
+            where += f" AND {filter_column} = ?"
+            params.append(filter_value)
+
+        limit_clause = "" if limit is None else f" LIMIT {max(int(limit), 0)}"
+        if rolled_until is None or rolled_until <= bucket_start:
+            query = f"SELECT {group_column}, COUNT(*) AS usage_count FROM emoji_log WHERE {where} AND used_at >= ? GROUP BY {group_column} ORDER BY usage_count DESC{limit_clause}"
+            cur.execute(query, (*params, start))
+        else:
+            query = f"""
+                SELECT {group_column}, CAST(SUM(usage_count) AS UNSIGNED) AS usage_count
+                FROM (
+                    SELECT {group_column}, SUM(usage_count) AS usage_count FROM emoji_log_hourly WHERE {where} AND hour >= ? AND hour < ? GROUP BY {group_column}
+                    UNION ALL
+                    SELECT {group_column}, COUNT(*) FROM emoji_log WHERE {where} AND used_at >= ? AND used_at < ? GROUP BY {group_column}
+                    UNION ALL
+                    SELECT {group_column}, COUNT(*) FROM emoji_log WHERE {where} AND used_at >= ? GROUP BY {group_column}
+                ) AS windowed
+                GROUP BY {group_column}
+                ORDER BY usage_count DESC
+            """
+            query += limit_clause
+            cur.execute(
+                query,
+                (
+                    *params,
+                    bucket_start,
+                    rolled_until,
+                    *params,
+                    start,
+                    bucket_start,
+                    *params,
+                    rolled_until,
+                ),
+            )
+        result = cur.fetchall()
 
-    cur.close()
-    conn.close()
+        cur.close()
     return result
 
 
-def get_emoji_member_rank(guild_id: int, PartialEmoji_str: str | None, hour: int):
-    conn = get_connection()
-    cur = conn.cursor()
+def get_emoji_usage(
+    guild_id: int,
+    hour: int,
+    user_id: int | None = None,
+    limit: int | None = None,
+):
+    if user_id is None:
+        return _get_emoji_counts("PartialEmoji_str", guild_id, hour, limit=limit)
+    return _get_emoji_counts(
+        "PartialEmoji_str", guild_id, hour, "user_id", user_id, limit
+    )
+
 
+def get_emoji_member_rank(
+    guild_id: int,
+    PartialEmoji_str: str | None,
+    hour: int,
+    limit: int | None = None,
+):
     if PartialEmoji_str:
-        cur.execute(
-            "SELECT user_id, COUNT(*) AS usage_count FROM emoji_log WHERE guild_id=? AND PartialEmoji_str=? AND used_at >= DATE_SUB(NOW(), INTERVAL ? HOUR) GROUP BY user_id ORDER BY usage_count DESC",
-            (
-                guild_id,
-                PartialEmoji_str,
-                hour,
-            ),
-        )
-    else:
-        cur.execute(
-            "SELECT user_id, COUNT(*) AS usage_count FROM emoji_log WHERE guild_id=? AND used_at >= DATE_SUB(NOW(), INTERVAL ? HOUR) GROUP BY user_id ORDER BY usage_count DESC",
-            (
-                guild_id,
-                hour,
-            ),
+        return _get_emoji_counts(
+            "user_id", guild_id, hour, "PartialEmoji_str", PartialEmoji_str, limit
         )
-
-    result = cur.fetchall()
-
-    cur.close()
-    conn.close()
-    return result
+    return _get_emoji_counts("user_id", guild_id, hour, limit=limit)
 
 
 def insert_game_title(game_title: str) -> None:
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO friend_code_games (title) VALUES (?);", (game_title,))
-    conn.commit()
-    cur.close()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO friend_code_games (title) VALUES (?);", (game_title,))
+        conn.commit()
+        cur.close()
+    versions.bump("friend_code_games")
     return
 
 
 def delete_game_title(game_title: str) -> None:
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM friend_code_games WHERE title = ?;", (game_title,))
-    conn.commit()
-    cur.close()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM friend_code_games WHERE title = ?;", (game_title,))
+        conn.commit()
+        cur.close()
+    versions.bump("friend_code_games", "friend_codes")
     return
 
 
 def get_game_titles():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT title FROM friend_code_games ORDER BY title")
-    result = cur.fetchall()
-    cur.close()
-    conn.close()
+    with get_read_connection("friend_code_games") as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT title FROM friend_code_games ORDER BY title")
+        result = cur.fetchall()
+        cur.close()
     return result
 
 
@@ -127,358 +275,664 @@ def get_friend_code_by_id_and_title(
     user_id: int,
     game_title: str,
 ):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT fc.user_id, fcg.title, fc.friend_code FROM friend_codes fc JOIN friend_code_games fcg ON fc.game_id = fcg.game_id WHERE fc.user_id = ? AND fcg.title = ?;",
-        (
-            user_id,
-            game_title,
-        ),
-    )
-    result = cur.fetchall()
-    cur.close()
-    conn.close()
+    with get_read_connection("friend_codes", "friend_code_games") as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT fc.user_id, fcg.title, fc.friend_code FROM friend_codes fc JOIN friend_code_games fcg ON fc.game_id = fcg.game_id WHERE fc.user_id = ? AND fcg.title = ?;",
+            (
+                user_id,
+                game_title,
+            ),
+        )
+        result = cur.fetchall()
+        cur.close()
     return result
 
 
 def get_friend_code_by_title(
     game_title: str,
 ):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT fc.user_id, fcg.title, fc.friend_code FROM friend_codes fc JOIN friend_code_games fcg ON fc.game_id = fcg.game_id WHERE fcg.title = ?;",
-        (game_title,),
-    )
-    result = cur.fetchall()
-    cur.close()
-    conn.close()
+    with get_read_connection("friend_codes", "friend_code_games") as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT fc.user_id, fcg.title, fc.friend_code FROM friend_codes fc JOIN friend_code_games fcg ON fc.game_id = fcg.game_id WHERE fcg.title = ?;",
+            (game_title,),
+        )
+        result = cur.fetchall()
+        cur.close()
     return result
 
 
 def get_friend_code_by_id(
     user_id: int,
 ):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT fc.user_id, fcg.title, fc.friend_code FROM friend_codes fc JOIN friend_code_games fcg ON fc.game_id = fcg.game_id WHERE fc.user_id = ?;",
-        (user_id,),
-    )
-    result = cur.fetchall()
-    cur.close()
-    conn.close()
+    with get_read_connection("friend_codes", "friend_code_games") as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT fc.user_id, fcg.title, fc.friend_code FROM friend_codes fc JOIN friend_code_games fcg ON fc.game_id = fcg.game_id WHERE fc.user_id = ?;",
+            (user_id,),
+        )
+        result = cur.fetchall()
+        cur.close()
     return result
 
 
-def get_friend_code():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT fc.user_id, fcg.title, fc.friend_code FROM friend_codes fc JOIN friend_code_games fcg ON fc.game_id = fcg.game_id;"
-    )
-    result = cur.fetchall()
-    cur.close()
-    conn.close()
+def _iter_rows(get_conn, query: str, params: tuple, dictionary: bool = False):
+    # Yields rows as the server sends them instead of buffering the whole
+    # result set; the connection is held until the generator is exhausted
+    # or closed.
+    conn = get_conn()
+    cur = conn.cursor(buffered=False, dictionary=dictionary)
+    try:
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _friend_code_query(after: list | None, limit: int | None) -> tuple[str, tuple]:
+    query = "SELECT fc.user_id, fcg.title, fc.friend_code, fc.game_id FROM friend_codes fc JOIN friend_code_games fcg ON fc.game_id = fcg.game_id"
+    params = []
+    if after is not None:
+        query += " WHERE fc.user_id > ? OR (fc.user_id = ? AND fc.game_id > ?)"
+        params.extend((after[0], after[0], after[1]))
+    query += " ORDER BY fc.user_id, fc.game_id"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return query, tuple(params)
+
+
+def get_friend_code(after: list | None = None, limit: int | None = None):
+    with get_read_connection("friend_codes", "friend_code_games") as conn:
+        cur = conn.cursor()
+        cur.execute(*_friend_code_query(after, limit))
+        result = cur.fetchall()
+        cur.close()
     return result
 
 
-def upsert_friend_code(user_id: int, game_title: str, friend_code: str) -> None:
-    conn = get_connection()
-    cur = conn.cursor()
-    result = get_friend_code_by_id_and_title(user_id, game_title)
-    if result:
+def iter_friend_code(after: list | None = None, limit: int | None = None):
+    return _iter_rows(
+        lambda: get_read_connection("friend_codes", "friend_code_games"),
+        *_friend_code_query(after, limit),
+    )
+
+
+def upsert_friend_code(user_id: int, game_title: str, friend_code: str) -> bool:
+    # False if game_title is unknown. The game is looked up first because
+    # the upsert's rowcount is also 0 when the friend code is unchanged.
+    with get_connection() as conn:
+        cur = conn.cursor()
         cur.execute(
-            "UPDATE friend_codes SET friend_code = ? WHERE user_id = ? AND game_id = (SELECT game_id FROM friend_code_games WHERE title = ?);",
-            (
-                friend_code,
-                user_id,
-                game_title,
-            ),
+            "SELECT game_id FROM friend_code_games WHERE title = ?", (game_title,)
         )
-    else:
+        game = cur.fetchone()
+        if game is None:
+            cur.close()
+            return False
         cur.execute(
-            "INSERT INTO friend_codes (user_id, game_id, friend_code) SELECT ?, (SELECT game_id FROM friend_code_games WHERE title = ?), ?;",
-            (user_id, game_title, friend_code),
+            "INSERT INTO friend_codes (user_id, game_id, friend_code) VALUES (?, ?, ?) ON DUPLICATE KEY UPDATE friend_code = VALUES(friend_code)",
+            (user_id, game[0], friend_code),
         )
-    conn.commit()
-    cur.close()
-    conn.close()
-    return
+        conn.commit()
+        cur.close()
+    versions.bump("friend_codes")
+    return True
+
+
+def upsert_friend_codes(rows: list[tuple[int, str, str]]) -> list[str] | None:
+    # rows are (user_id, game_title, friend_code), applied in one
+    # transaction. Returns the unknown game titles (nothing is written if
+    # there are any), or None if the write failed.
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT title, game_id FROM friend_code_games")
+            game_ids = dict(cur.fetchall())
+            unknown = sorted({title for _, title, _ in rows if title not in game_ids})
+            if unknown:
+                return unknown
+            cur.executemany(
+                "INSERT INTO friend_codes (user_id, game_id, friend_code) VALUES (?, ?, ?) ON DUPLICATE KEY UPDATE friend_code = VALUES(friend_code)",
+                [
+                    (user_id, game_ids[title], friend_code)
+                    for user_id, title, friend_code in rows
+                ],
+            )
+            conn.commit()
+        except mariadb.Error as e:
+            conn.rollback()
+            print(f"Error: {e}")
+            return None
+        finally:
+            cur.close()
+    versions.bump("friend_codes")
+    return []
 
 
 def delete_friend_code(user_id: int, game_title: str) -> None:
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "DELETE FROM friend_codes WHERE user_id = ? AND game_id = (SELECT game_id FROM friend_code_games WHERE title = ?);",
-        (user_id, game_title),
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "DELETE FROM friend_codes WHERE user_id = ? AND game_id = (SELECT game_id FROM friend_code_games WHERE title = ?);",
+            (user_id, game_title),
+        )
+        conn.commit()
+        cur.close()
+    versions.bump("friend_codes")
     return
 
 
+# The per-day counters are bumped in the same transaction as the raw row.
+# CURDATE() can disagree with DATE(sent_at) for a row inserted right at
+# midnight; python -m db.counters check/rebuild reconciles such drift.
+INCREMENT_MESSAGE_COUNT = "INSERT INTO message_count_daily (guild_id, user_id, channel_id, day, message_count) VALUES (?, ?, ?, CURDATE(), ?) ON DUPLICATE KEY UPDATE message_count = message_count + VALUES(message_count)"
+
+
 def insert_message_log(
     guild_id: int,
     channel_id: int,
     user_id: int,
 ) -> None:
-    conn = get_connection()
-    cur = conn.cursor()
+    with get_connection() as conn:
+        cur = conn.cursor()
 
-    cur.execute(
-        "INSERT INTO message_log (guild_id, channel_id, user_id) VALUES (?, ?, ?)",
-        (
-            guild_id,
-            channel_id,
-            user_id,
-        ),
-    )
-    conn.commit()
+        cur.execute(
+            "INSERT INTO message_log (guild_id, channel_id, user_id) VALUES (?, ?, ?)",
+            (
+                guild_id,
+                channel_id,
+                user_id,
+            ),
+        )
+        cur.execute(INCREMENT_MESSAGE_COUNT, (guild_id, user_id, channel_id, 1))
+        conn.commit()
 
-    cur.close()
-    conn.close()
+        cur.close()
+    versions.touch("message_log", "message_count_daily")
     return
 
 
-def get_message_count_by_guild_and_user_id(guild_id: int, user_id: int, hours: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT DATE_FORMAT(sent_at, '%Y-%m-%d') AS time_interval, COUNT(id) AS id_count FROM message_log WHERE guild_id = ? AND user_id = ? AND sent_at >= DATE_SUB(NOW(), INTERVAL ? HOUR) GROUP BY time_interval;",
-        (
-            guild_id,
-            user_id,
-            hours,
-        ),
-    )
+def insert_message_logs(rows: list[tuple[int, int, int]]) -> None:
+    if not rows:
+        return
+    counts = {}
+    for guild_id, channel_id, user_id in rows:
+        key = (guild_id, user_id, channel_id)
+        counts[key] = counts.get(key, 0) + 1
+
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        cur.executemany(
+            "INSERT INTO message_log (guild_id, channel_id, user_id) VALUES (?, ?, ?)",
+            rows,
+        )
+        cur.executemany(
+            INCREMENT_MESSAGE_COUNT,
+            [(*key, count) for key, count in counts.items()],
+        )
+        conn.commit()
+
+        cur.close()
+    versions.touch("message_log", "message_count_daily")
+    return
+
+
+def get_message_count_by_guild_and_user_id(
+    guild_id: int, user_id: int, hours: int, channel_id: int | None = None
+):
+    # Whole days are read from message_count_daily; only the first, partial
+    # day of the window is counted from message_log.
+    channel_filter = "" if channel_id is None else " AND channel_id = ?"
+    channel_params = () if channel_id is None else (channel_id,)
+    with get_read_connection("message_log", "message_count_daily") as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            SELECT time_interval, CAST(SUM(id_count) AS UNSIGNED) AS id_count
+            FROM (
+                SELECT DATE_FORMAT(sent_at, '%Y-%m-%d') AS time_interval, COUNT(id) AS id_count FROM message_log WHERE guild_id = ? AND user_id = ? AND sent_at >= DATE_SUB(NOW(), INTERVAL ? HOUR) AND sent_at < DATE(DATE_SUB(NOW(), INTERVAL ? HOUR)) + INTERVAL 1 DAY{channel_filter} GROUP BY time_interval
+                UNION ALL
+                SELECT DATE_FORMAT(day, '%Y-%m-%d') AS time_interval, SUM(message_count) AS id_count FROM message_count_daily WHERE guild_id = ? AND user_id = ? AND day > DATE(DATE_SUB(NOW(), INTERVAL ? HOUR)){channel_filter} GROUP BY day
+            ) AS daily
+            GROUP BY time_interval
+            ORDER BY time_interval;
+            """,
+            (
+                guild_id,
+                user_id,
+                hours,
+                hours,
+                *channel_params,
+                guild_id,
+                user_id,
+                hours,
+                *channel_params,
+            ),
+        )
 
-    result = cur.fetchall()
+        result = cur.fetchall()
 
-    cur.close()
-    conn.close()
+        cur.close()
     return result
 
 
-def get_advent_by_year(year: int):
-    conn = get_connection()
-    cur = conn.cursor()
+def _advent_by_year_query(
+    year: int, after: list | None, limit: int | None
+) -> tuple[str, tuple]:
+    # A date range instead of YEAR(date) so an index on date can be used.
+    query = "SELECT * FROM advent WHERE date >= ? AND date < ?"
+    params = [datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)]
+    if after is not None:
+        query += " AND (date > ? OR (date = ? AND id > ?))"
+        params.extend((after[0], after[0], after[1]))
+    query += " ORDER BY date, id"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return query, tuple(params)
+
 
-    cur.execute("SELECT * FROM advent WHERE YEAR(date) = ? ORDER BY date", (year,))
+def get_advent_by_year(year: int, after: list | None = None, limit: int | None = None):
+    with get_read_connection("advent") as conn:
+        cur = conn.cursor()
 
-    result = cur.fetchall()
-    cur.close()
-    conn.close()
+        cur.execute(*_advent_by_year_query(year, after, limit))
+
+        result = cur.fetchall()
+        cur.close()
     return result
 
 
-def get_advent_by_id_and_date(user_id: int, date_str: str):
-    conn = get_connection()
-    cur = conn.cursor()
+def iter_advent_by_year(year: int, after: list | None = None, limit: int | None = None):
+    return _iter_rows(
+        lambda: get_read_connection("advent"),
+        *_advent_by_year_query(year, after, limit),
+    )
+
 
+def get_advent_by_id_and_date(user_id: int, date_str: str):
+    # A malformed date raises ValueError before a connection is taken.
     date_obj = datetime.datetime.strptime(date_str, "%Y-%m-%d")
-    cur.execute(
-        "SELECT * FROM advent WHERE user_id = ? AND date = ?", (user_id, date_obj)
-    )
+    with get_read_connection("advent") as conn:
+        cur = conn.cursor()
 
-    result = cur.fetchall()
-    cur.close()
-    conn.close()
+        cur.execute(
+            "SELECT * FROM advent WHERE user_id = ? AND date = ?", (user_id, date_obj)
+        )
+
+        result = cur.fetchall()
+        cur.close()
     return result
 
 
+UPSERT_ADVENT = "INSERT INTO advent (user_id, author, title, url, date) VALUES (?, ?, ?, ?, ?) ON DUPLICATE KEY UPDATE author = VALUES(author), title = VALUES(title), url = VALUES(url)"
+
+
 def upsert_advent(
     user_id: int, author: str, title: str | None, url: str | None, date_str: str
 ):
-    conn = get_connection()
-    cur = conn.cursor()
-
     if title is None:
         title = ""
     if url is None:
         url = ""
     date_obj = datetime.datetime.strptime(date_str, "%Y-%m-%d")
-    result = get_advent_by_id_and_date(user_id, date_str)
-    if result:
-        cur.execute(
-            "UPDATE advent SET author = ?, title = ?, url = ? WHERE user_id = ? AND date = ?;",
-            (author, title, url, user_id, date_obj),
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        cur.execute(UPSERT_ADVENT, (user_id, author, title, url, date_obj))
+
+        conn.commit()
+        cur.close()
+    versions.bump("advent")
+    return
+
+
+def upsert_advents(rows: list[tuple[int, str, str | None, str | None, str]]) -> bool:
+    # rows are (user_id, author, title, url, date_str), applied in one
+    # transaction. Raises ValueError on a malformed date before writing.
+    params = [
+        (
+            user_id,
+            author,
+            title or "",
+            url or "",
+            datetime.datetime.strptime(date_str, "%Y-%m-%d"),
         )
-    else:
+        for user_id, author, title, url, date_str in rows
+    ]
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.executemany(UPSERT_ADVENT, params)
+            conn.commit()
+        except mariadb.Error as e:
+            conn.rollback()
+            print(f"Error: {e}")
+            return False
+        finally:
+            cur.close()
+    versions.bump("advent")
+    return True
+
+
+def delete_advent(user_id: int, date_str: str):
+    date_obj = datetime.datetime.strptime(date_str, "%Y-%m-%d")
+    with get_connection() as conn:
+        cur = conn.cursor()
+
         cur.execute(
-            "INSERT INTO advent (user_id, author, title, url, date) VALUES (?, ?, ?, ?, ?)",
-            (user_id, author, title, url, date_obj),
+            "DELETE FROM advent WHERE user_id = ? and date = ?;",
+            (
+                user_id,
+                date_obj,
+            ),
         )
 
-    conn.commit()
-    cur.close()
-    conn.close()
+        conn.commit()
+        cur.close()
+    versions.bump("advent")
     return
 
 
-def delete_advent(user_id: int, date_str: str):
-    conn = get_connection()
-    cur = conn.cursor()
-
-    date_obj = datetime.datetime.strptime(date_str, "%Y-%m-%d")
-    cur.execute(
-        "DELETE FROM advent WHERE user_id = ? and date = ?;",
-        (
-            user_id,
-            date_obj,
-        ),
+def _export_rgdb():
+    with get_rgdb_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT game_id, game_name FROM Games")
+        games = cur.fetchall()
+        cur.close()
+    # Songs with a charts column holding all their charts as a JSON array,
+    # which the snapshot's song digests cover.
+    songs = _iter_rows(
+        get_rgdb_connection,
+        "SELECT Songs.*, JSON_ARRAYAGG(JSON_OBJECT('chart_id', Charts.chart_id, 'difficulty', Charts.difficulty, 'const', Charts.const, 'level', Charts.level, 'num_notes', Charts.num_notes, 'designer', Charts.designer, 'chart_image_url', Charts.chart_image_url, 'description', Charts.description)) AS charts FROM Songs LEFT JOIN Charts ON Songs.song_id = Charts.song_id GROUP BY Songs.song_id",
+        (),
+        dictionary=True,
     )
+    charts = _iter_rows(
+        get_rgdb_connection,
+        "SELECT chart_id, song_id, difficulty, const, level, num_notes, designer, chart_image_url, description FROM Charts",
+        (),
+    )
+    return games, songs, charts
 
-    conn.commit()
-    cur.close()
-    conn.close()
-    return
 
+# With RGDB_SNAPSHOT_PATH set, Games, Songs and Charts are exported to a local
+# SQLite file and every RGDB read below is served from it.
+rgdb_snapshot = (
+    RgdbSnapshot(RGDB_SNAPSHOT_PATH, _export_rgdb) if RGDB_SNAPSHOT_PATH else None
+)
 
-def get_game_id(game_name: str) -> int | None:
+
+def _get_rgdb_snapshot() -> RgdbSnapshot | None:
+    # Falls back to MariaDB until the first snapshot has been built.
+    if rgdb_snapshot is not None and rgdb_snapshot.exists():
+        return rgdb_snapshot
+    return None
+
+
+def build_rgdb_snapshot(checksum=None) -> bool:
+    if rgdb_snapshot is None:
+        return False
+    if checksum is None:
+        checksum = get_rgdb_checksum()
+    try:
+        rgdb_snapshot.build(checksum)
+    except (mariadb.Error, sqlite3.Error, OSError) as e:
+        print(f"Error building RGDB snapshot: {e}")
+        return False
+    return True
+
+
+def _load_game_names() -> list[tuple[int, str]] | None:
+    snapshot = _get_rgdb_snapshot()
+    if snapshot is not None:
+        return snapshot.games()
     conn = get_rgdb_connection()
     cur = conn.cursor()
     try:
-        cur.execute("SELECT game_id FROM Games WHERE game_name = ?", (game_name,))
-        result = cur.fetchone()
-        if result:
-            return result[0]
-        else:
-            print(f"No game found with name: {game_name}")
-            return None
+        cur.execute("SELECT game_id, game_name FROM Games ORDER BY game_id")
+        return cur.fetchall()
     except mariadb.Error as e:
         print(f"Error: {e}")
         return None
+    finally:
+        cur.close()
+        conn.close()
+
+
+game_names = GameNameCache(
+    _load_game_names,
+    ttl=GAME_NAME_CACHE_TTL,
+)
+
+
+def load_game_names() -> None:
+    game_names.refresh()
+
+
+def get_game_id(game_name: str) -> int | None:
+    game_id = game_names.get_id(game_name)
+    if game_id is None:
+        print(f"No game found with name: {game_name}")
+    return game_id
 
 
 def get_all_game_names():
+    result = [(game_name,) for game_name in game_names.names()]
+    if result:
+        return result
+    else:
+        print(f"No game found.")
+        return None
+
+
+def get_game_name_by_id(game_id: int):
+    game_name = game_names.get_name(game_id)
+    if game_name is None:
+        print(f"No game found with name: {game_id}")
+    return game_name
+
+
+def _load_song_search_rows() -> list[tuple[int, int, str, str]] | None:
+    snapshot = _get_rgdb_snapshot()
+    if snapshot is not None:
+        return snapshot.song_search_rows()
     conn = get_rgdb_connection()
     cur = conn.cursor()
     try:
-        cur.execute("SELECT game_name FROM Games")
-        result = cur.fetchall()
-        if result:
-            return result
-        else:
-            print(f"No game found.")
-            return None
+        cur.execute("SELECT song_id, game_id, title, artist FROM Songs")
+        return cur.fetchall()
     except mariadb.Error as e:
         print(f"Error: {e}")
         return None
+    finally:
+        cur.close()
+        conn.close()
 
 
-def get_game_name_by_id(game_id: int):
+song_search = SongSearchIndex(_load_song_search_rows)
+
+
+def _search_song_ids(
+    title: str | None,
+    game_id: int | None,
+    artist: str | None,
+    limit: int | None,
+    after: list | None,
+) -> list[int]:
+    # Title and artist matching happens in the in-process trigram index;
+    # SQL only fetches the rows of the songs it ranked. Pages continue after
+    # the position of the last song id in the ranking.
+    song_ids = song_search.search(title, artist, game_id)
+    if after is not None:
+        try:
+            song_ids = song_ids[song_ids.index(after[0]) + 1 :]
+        except ValueError:
+            return []
+    return song_ids if limit is None else song_ids[:limit]
+
+
+_SONG_COLUMNS = tuple(
+    "Games.game_name" if field == "game_name" else f"Songs.{field}"
+    for field in serialize.SONG_FIELDS
+)
+_SONG_SELECT = ", ".join(_SONG_COLUMNS)
+_SONG_QUOTED = ", ".join(f"QUOTE({column})" for column in _SONG_COLUMNS)
+_CHART_QUOTED = ", ".join(f"QUOTE({field})" for field in serialize.CHART_FIELDS)
+# One digest per song over its columns, its game name and its charts.
+# QUOTE() keeps NULL apart from the empty string.
+SONG_DIGEST_QUERY = f"""
+    SELECT Songs.song_id, UNHEX(MD5(CONCAT_WS(',', {_SONG_QUOTED}, QUOTE(charts.digest))))
+    FROM Songs
+    LEFT JOIN Games ON Games.game_id = Songs.game_id
+    LEFT JOIN (
+        SELECT song_id, MD5(GROUP_CONCAT(CONCAT_WS(',', {_CHART_QUOTED}) ORDER BY chart_id SEPARATOR ';')) AS digest
+        FROM Charts
+        GROUP BY song_id
+    ) AS charts ON charts.song_id = Songs.song_id
+"""
+
+
+def _load_song_digests() -> list[tuple[int, bytes]] | None:
+    snapshot = _get_rgdb_snapshot()
+    if snapshot is not None:
+        return snapshot.song_digests()
     conn = get_rgdb_connection()
     cur = conn.cursor()
     try:
-        cur.execute("SELECT game_name FROM Games WHERE game_id = ?", (game_id,))
-        result = cur.fetchone()
-        if result:
-            return result[0]
-        else:
-            print(f"No game found with name: {game_id}")
-            return None
+        cur.execute(SONG_DIGEST_QUERY)
+        return cur.fetchall()
+    except mariadb.Error as e:
+        print(f"Error: {e}")
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _load_songs(song_ids: list[int]) -> tuple[list[dict], list[dict]] | None:
+    snapshot = _get_rgdb_snapshot()
+    if snapshot is not None:
+        return snapshot.songs_with_charts(song_ids)
+    params = ", ".join("?" * len(song_ids))
+    conn = get_rgdb_connection()
+    cur = conn.cursor(dictionary=True)
+    try:
+        cur.execute(
+            f"SELECT {_SONG_SELECT} FROM Songs LEFT JOIN Games ON Games.game_id = Songs.game_id WHERE Songs.song_id IN ({params})",
+            tuple(song_ids),
+        )
+        songs = cur.fetchall()
+        cur.execute(
+            f"SELECT song_id, {', '.join(serialize.CHART_FIELDS)} FROM Charts WHERE song_id IN ({params}) ORDER BY song_id, chart_id",
+            tuple(song_ids),
+        )
+        return songs, cur.fetchall()
     except mariadb.Error as e:
         print(f"Error: {e}")
         return None
+    finally:
+        cur.close()
+        conn.close()
+
+
+song_documents = SongDocuments(_load_song_digests, _load_songs)
 
 
 def get_song_by_title_and_game_name_and_artist(
     title: str | None,
     game_name: str | None,
     artist: str | None,
-):
-    conn = get_rgdb_connection()
-    cur = conn.cursor()
-    query = """
-            SELECT 
-                Songs.*,
-                JSON_ARRAYAGG(
-                    JSON_OBJECT(
-                        'chart_id', Charts.chart_id,
-                        'difficulty', Charts.difficulty,
-                        'const', Charts.const,
-                        'level', Charts.level,
-                        'num_notes', Charts.num_notes,
-                        'designer', Charts.designer,
-                        'chart_image_url', Charts.chart_image_url,
-                        'description', Charts.description
-                    )
-                ) AS charts
-            FROM 
-                Songs
-            LEFT JOIN 
-                Charts ON Songs.song_id = Charts.song_id
-            WHERE 1 = 1
-        """
-    query_tuple_list = []
-    if title is not None:
-        title = f"%{title}%"
-        query += " AND Songs.title LIKE ?"
-        query_tuple_list.append(title)
+    limit: int | None = None,
+    after: list | None = None,
+) -> list[SongDocument]:
+    game_id = None
     if game_name:
         game_id = get_game_id(game_name)
-        query += " AND Songs.game_id = ?"
-        query_tuple_list.append(game_id)
-    if artist:
-        artist = f"%{artist}%"
-        query += " AND Songs.artist LIKE ?"
-        query_tuple_list.append(artist)
-    query += " GROUP BY Songs.song_id"
-    cur.execute(query, tuple(query_tuple_list))
-
-    result = cur.fetchall()
-    cur.close()
-    conn.close()
-    return result
+        if game_id is None:
+            return []
+    if title or artist:
+        return song_documents.get(
+            _search_song_ids(title, game_id, artist, limit, after)
+        )
+    return song_documents.by_game(game_id, limit, after)
+
+
+def _load_song_levels() -> list[tuple[int, int, str | None]] | None:
+    snapshot = _get_rgdb_snapshot()
+    if snapshot is not None:
+        return snapshot.song_levels()
+    conn = get_rgdb_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT DISTINCT Songs.song_id, Songs.game_id, Charts.level FROM Songs LEFT JOIN Charts ON Songs.song_id = Charts.song_id"
+        )
+        return cur.fetchall()
+    except mariadb.Error as e:
+        print(f"Error: {e}")
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+
+random_songs = RandomSongIndex(_load_song_levels)
+_rgdb_checksum = None
+
+
+def get_rgdb_checksum() -> tuple | None:
+    conn = get_rgdb_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("CHECKSUM TABLE Games, Songs, Charts")
+        return tuple(cur.fetchall())
+    except mariadb.Error as e:
+        print(f"Error: {e}")
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+
+def refresh_rgdb_if_changed() -> bool:
+    # Called periodically; rebuilds every in-process RGDB structure when the
+    # Games, Songs or Charts tables changed since the last check.
+    global _rgdb_checksum
+    checksum = get_rgdb_checksum()
+    if checksum is None or checksum == _rgdb_checksum:
+        return False
+    if rgdb_snapshot is not None and rgdb_snapshot.checksum() != repr(checksum):
+        if not build_rgdb_snapshot(checksum):
+            return False
+    load_game_names()
+    random_songs.rebuild()
+    song_search.rebuild()
+    if not song_documents.refresh():
+        return False
+    _rgdb_checksum = checksum
+    versions.bump("rgdb")
+    return True
 
 
 def get_random_song(
     game_name: str | None,
     level: str | None,
-):
-    conn = get_rgdb_connection()
-    cur = conn.cursor()
-    query = """
-            SELECT 
-                Songs.*,
-                JSON_ARRAYAGG(
-                    JSON_OBJECT(
-                        'chart_id', Charts.chart_id,
-                        'difficulty', Charts.difficulty,
-                        'const', Charts.const,
-                        'level', Charts.level,
-                        'num_notes', Charts.num_notes,
-                        'designer', Charts.designer,
-                        'description', Charts.description
-                    )
-                ) AS charts
-            FROM 
-                Songs
-            LEFT JOIN 
-                Charts ON Songs.song_id = Charts.song_id
-        """
-    query_tuple_list = []
+    count: int = 1,
+    seed: int | None = None,
+) -> list[SongDocument]:
+    # Render with document.to_json(level) to keep only the charts of level.
+    game_id = None
     if game_name:
         game_id = get_game_id(game_name)
-        query += " WHERE Songs.game_id = ?"
-        query_tuple_list.append(game_id)
-        if level:
-            query += " AND Charts.level = ?"
-            query_tuple_list.append(level)
-    elif level:
-        query += " WHERE Charts.level = ?"
-        query_tuple_list.append(level)
-    query += " GROUP BY Songs.song_id ORDER BY RAND() LIMIT 1"
-    if len(query_tuple_list) == 0:
-        cur.execute(query)
-    else:
-        cur.execute(query, tuple(query_tuple_list))
-
-    result = cur.fetchall()
-    cur.close()
-    conn.close()
-    return result
+        if game_id is None:
+            return []
+    return song_documents.get(random_songs.sample(game_id, level, count, seed))
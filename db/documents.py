@@ -0,0 +1,143 @@
+import bisect
+import sys
+import threading
+
+import serialize
+
+# Songs loaded per query when documents are (re)built.
+LOAD_BATCH_SIZE = 500
+
+
+class SongDocument:
+    # One song with its charts, encoded once as the JSON the API sends.
+    # charts holds (level, start, end) of every chart object in json, so the
+    # charts of one level can be cut out without decoding anything. Levels
+    # are interned; the rest only lives in the encoded bytes.
+    __slots__ = ("song_id", "game_id", "digest", "json", "charts_start", "charts")
+
+    def __init__(self, song: dict, charts: list[dict], digest: bytes):
+        head = serialize.dumps({field: song[field] for field in serialize.SONG_FIELDS})
+        head = head[:-1] + b',"charts":['
+        parts = []
+        spans = []
+        offset = len(head)
+        for chart in charts:
+            part = serialize.dumps(
+                {field: chart[field] for field in serialize.CHART_FIELDS}
+            )
+            level = chart["level"]
+            if level is not None:
+                level = sys.intern(level)
+            spans.append((level, offset, offset + len(part)))
+            parts.append(part)
+            offset += len(part) + 1
+        self.song_id = song["song_id"]
+        self.game_id = song["game_id"]
+        self.digest = digest
+        self.json = head + b",".join(parts) + b"]}"
+        self.charts_start = len(head)
+        self.charts = tuple(spans)
+
+    def to_json(self, level: str | None = None) -> bytes:
+        # The document, or with only the charts of the given level.
+        if not level:
+            return self.json
+        json = self.json
+        charts = b",".join(
+            json[start:end]
+            for chart_level, start, end in self.charts
+            if chart_level == level
+        )
+        return json[: self.charts_start] + charts + b"]}"
+
+
+class SongDocuments:
+    # Every song as a SongDocument, so the song endpoints never query
+    # MariaDB. refresh() asks for one digest per song and only reloads and
+    # re-encodes the songs whose digest changed.
+    def __init__(self, load_digests, load_songs):
+        # load_digests returns [(song_id, digest), ...], digest covering the
+        # song, its game name and its charts. load_songs(song_ids) returns
+        # (songs, charts): dicts with serialize.SONG_FIELDS, and dicts with
+        # song_id and serialize.CHART_FIELDS ordered by song_id, chart_id.
+        # Both return None on error.
+        self._load_digests = load_digests
+        self._load_songs = load_songs
+        self._lock = threading.Lock()
+        # (song_id -> document, sorted song ids, game_id -> sorted song ids),
+        # replaced as a whole so readers see one version or the next.
+        self._state: tuple[dict, tuple, dict] | None = None
+        self._bytes = 0
+        self._encoded = 0
+        self._removed = 0
+
+    def refresh(self) -> bool:
+        with self._lock:
+            digests = self._load_digests()
+            if digests is None:
+                return False
+            old = self._state[0] if self._state is not None else {}
+            documents = {}
+            stale = []
+            for song_id, digest in digests:
+                document = old.get(song_id)
+                if document is not None and document.digest == digest:
+                    documents[song_id] = document
+                else:
+                    stale.append(song_id)
+            digest_by_id = dict(digests)
+            for i in range(0, len(stale), LOAD_BATCH_SIZE):
+                loaded = self._load_songs(stale[i : i + LOAD_BATCH_SIZE])
+                if loaded is None:
+                    return False
+                songs, charts = loaded
+                charts_by_song = {}
+                for chart in charts:
+                    charts_by_song.setdefault(chart["song_id"], []).append(chart)
+                for song in songs:
+                    song_id = song["song_id"]
+                    documents[song_id] = SongDocument(
+                        song, charts_by_song.get(song_id, []), digest_by_id[song_id]
+                    )
+            song_ids = tuple(sorted(documents))
+            by_game = {}
+            for song_id in song_ids:
+                by_game.setdefault(documents[song_id].game_id, []).append(song_id)
+            self._state = (
+                documents,
+                song_ids,
+                {game_id: tuple(ids) for game_id, ids in by_game.items()},
+            )
+            self._bytes = sum(len(document.json) for document in documents.values())
+            self._encoded = len(stale)
+            self._removed = len(old.keys() - digest_by_id.keys())
+            return True
+
+    def _get_state(self) -> tuple[dict, tuple, dict]:
+        if self._state is None:
+            self.refresh()
+        return self._state or ({}, (), {})
+
+    def get(self, song_ids: list[int]) -> list[SongDocument]:
+        # In the order given; unknown ids are skipped.
+        documents = self._get_state()[0]
+        return [documents[song_id] for song_id in song_ids if song_id in documents]
+
+    def by_game(
+        self, game_id: int | None, limit: int | None, after: list | None
+    ) -> list[SongDocument]:
+        # Songs of one game, or all of them, by song id.
+        documents, song_ids, by_game = self._get_state()
+        if game_id is not None:
+            song_ids = by_game.get(game_id, ())
+        start = 0 if after is None else bisect.bisect_right(song_ids, after[0])
+        end = None if limit is None else start + limit
+        return [documents[song_id] for song_id in song_ids[start:end]]
+
+    def stats(self) -> dict:
+        return {
+            "songs": len(self._state[0]) if self._state is not None else 0,
+            "bytes": self._bytes,
+            "encoded": self._encoded,
+            "removed": self._removed,
+        }
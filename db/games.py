@@ -0,0 +1,63 @@
+import threading
+import time
+
+
+class GameNameCache:
+    def __init__(self, loader, ttl: float = 600, miss_refresh_interval: float = 30):
+        # loader returns [(game_id, game_name), ...] or None on error.
+        self._loader = loader
+        self.ttl = ttl
+        self.miss_refresh_interval = miss_refresh_interval
+        self._id_by_name: dict[str, int] = {}
+        self._name_by_id: dict[int, str] = {}
+        self._loaded_at: float | None = None
+        self._lock = threading.Lock()
+
+    def refresh(self) -> None:
+        with self._lock:
+            rows = self._loader()
+            if rows is None:
+                # Keep serving the previous map if the reload failed.
+                if self._loaded_at is not None:
+                    self._loaded_at = time.monotonic()
+                return
+            # Build new dicts and swap them in so readers never see a
+            # half-filled map.
+            self._name_by_id = {game_id: game_name for game_id, game_name in rows}
+            self._id_by_name = {game_name: game_id for game_id, game_name in rows}
+            self._loaded_at = time.monotonic()
+
+    def _ensure_fresh(self) -> None:
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self.ttl:
+            self.refresh()
+
+    def _refresh_on_miss(self) -> bool:
+        # A game added since the last load shows up as a miss; reload, but
+        # not more often than miss_refresh_interval.
+        loaded_at = self._loaded_at
+        if (
+            loaded_at is not None
+            and time.monotonic() - loaded_at < self.miss_refresh_interval
+        ):
+            return False
+        self.refresh()
+        return True
+
+    def get_id(self, game_name: str) -> int | None:
+        self._ensure_fresh()
+        game_id = self._id_by_name.get(game_name)
+        if game_id is None and self._refresh_on_miss():
+            game_id = self._id_by_name.get(game_name)
+        return game_id
+
+    def get_name(self, game_id: int) -> str | None:
+        self._ensure_fresh()
+        game_name = self._name_by_id.get(game_id)
+        if game_name is None and self._refresh_on_miss():
+            game_name = self._name_by_id.get(game_id)
+        return game_name
+
+    def names(self) -> list[str]:
+        self._ensure_fresh()
+        return list(self._id_by_name)
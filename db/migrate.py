@@ -0,0 +1,131 @@
+import os
+import re
+import sys
+
+import mariadb
+
+import db.db as db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+# Subdirectories of MIGRATIONS_DIR: "app" targets DB_NAME, "rgdb" RGDB_NAME.
+DATABASES = ("app", "rgdb")
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version VARCHAR(255) NOT NULL PRIMARY KEY,
+        applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+# Several app processes may start at once; only one applies migrations.
+LOCK_NAME = "schema_migrations"
+LOCK_TIMEOUT = 60
+
+
+def _connect(database: str):
+    if database == "rgdb":
+        return db.get_rgdb_connection()
+    return db.get_connection()
+
+
+def _split_statements(sql: str) -> list[str]:
+    sql = re.sub(r"^\s*--.*$", "", sql, flags=re.MULTILINE)
+    return [statement.strip() for statement in sql.split(";") if statement.strip()]
+
+
+def migration_files(database: str) -> list[tuple[str, str]]:
+    # [(version, path), ...] in the order they are applied.
+    directory = os.path.join(MIGRATIONS_DIR, database)
+    return [
+        (name[: -len(".sql")], os.path.join(directory, name))
+        for name in sorted(os.listdir(directory))
+        if name.endswith(".sql")
+    ]
+
+
+def _applied_versions(cur) -> set[str]:
+    cur.execute(CREATE_TABLE)
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+
+def pending_migrations(database: str) -> list[str]:
+    with _connect(database) as conn:
+        cur = conn.cursor()
+        applied = _applied_versions(cur)
+        cur.close()
+    return [
+        version for version, _ in migration_files(database) if version not in applied
+    ]
+
+
+def exit_if_pending(databases=DATABASES) -> None:
+    # For CLIs that need the current schema: they never change it
+    # themselves, python -m db.migrate does.
+    pending = [
+        f"{database}/{version}"
+        for database in databases
+        for version in pending_migrations(database)
+    ]
+    if pending:
+        for version in pending:
+            print(f"pending {version}")
+        print("Run python -m db.migrate first")
+        sys.exit(1)
+
+
+def migrate(databases=DATABASES) -> list[str]:
+    # Applies every pending migration and returns "<database>/<version>" for
+    # each one. MariaDB commits DDL implicitly, so a migration that fails
+    # halfway is not rolled back. Every statement is written to be
+    # repeatable (IF NOT EXISTS, or one ALTER that gives the same table
+    # again), so the migration can simply be re-run after fixing the cause.
+    applied_now = []
+    for database in databases:
+        conn = _connect(database)
+        cur = conn.cursor()
+        cur.execute("SELECT GET_LOCK(?, ?)", (LOCK_NAME, LOCK_TIMEOUT))
+        if cur.fetchone()[0] != 1:
+            cur.close()
+            conn.close()
+            raise RuntimeError(f"Could not lock {LOCK_NAME} on {database}")
+        try:
+            applied = _applied_versions(cur)
+            for version, path in migration_files(database):
+                if version in applied:
+                    continue
+                with open(path) as f:
+                    statements = _split_statements(f.read())
+                try:
+                    for statement in statements:
+                        cur.execute(statement)
+                except mariadb.Error as e:
+                    print(f"Error in migration {database}/{version}: {e}")
+                    raise
+                cur.execute(
+                    "INSERT INTO schema_migrations (version) VALUES (?)", (version,)
+                )
+                conn.commit()
+                applied_now.append(f"{database}/{version}")
+        finally:
+            cur.execute("SELECT RELEASE_LOCK(?)", (LOCK_NAME,))
+            cur.fetchall()
+            cur.close()
+            conn.close()
+    return applied_now
+
+
+if __name__ == "__main__":
+    # python -m db.migrate [status]
+    command = sys.argv[1] if len(sys.argv) > 1 else "up"
+    if command not in ("up", "status"):
+        print("usage: python -m db.migrate [up|status]")
+        sys.exit(2)
+    if command == "status":
+        pending = 0
+        for database in DATABASES:
+            for version in pending_migrations(database):
+                print(f"pending {database}/{version}")
+                pending += 1
+        print(f"{pending} pending migrations")
+        sys.exit(1 if pending else 0)
+    for version in migrate():
+        print(f"Applied {version}")
@@ -0,0 +1,39 @@
+-- Tables the bot and the API write to. IF NOT EXISTS keeps this a no-op on
+-- databases that were created before migrations existed.
+
+CREATE TABLE IF NOT EXISTS emoji_log (
+    id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    guild_id BIGINT NOT NULL,
+    user_id BIGINT NOT NULL,
+    PartialEmoji_str VARCHAR(255) NOT NULL,
+    used_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS message_log (
+    id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    guild_id BIGINT NOT NULL,
+    channel_id BIGINT NOT NULL,
+    user_id BIGINT NOT NULL,
+    sent_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS friend_code_games (
+    game_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    title VARCHAR(255) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS friend_codes (
+    user_id BIGINT NOT NULL,
+    game_id INT NOT NULL,
+    friend_code VARCHAR(255) NOT NULL,
+    PRIMARY KEY (user_id, game_id)
+);
+
+CREATE TABLE IF NOT EXISTS advent (
+    id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    author VARCHAR(255),
+    title VARCHAR(255),
+    url VARCHAR(1024),
+    date DATE NOT NULL
+);
@@ -0,0 +1,29 @@
+-- Indexes for the queries in db/db.py. The emoji_log indexes cover every
+-- column the leaderboards read, so the raw part of those queries never
+-- touches the table rows.
+
+-- Usage rank for a guild, and the rollup watermark lookups.
+CREATE INDEX IF NOT EXISTS guild_used_at
+    ON emoji_log (guild_id, used_at, PartialEmoji_str, user_id);
+-- Usage rank for one member.
+CREATE INDEX IF NOT EXISTS guild_user_used_at
+    ON emoji_log (guild_id, user_id, used_at, PartialEmoji_str);
+-- Member rank for one emoji.
+CREATE INDEX IF NOT EXISTS guild_emoji_used_at
+    ON emoji_log (guild_id, PartialEmoji_str, used_at, user_id);
+-- db.rollup reads emoji_log by time range only.
+CREATE INDEX IF NOT EXISTS used_at ON emoji_log (used_at);
+
+-- /message/count for the partial first day.
+CREATE INDEX IF NOT EXISTS guild_user_sent_at
+    ON message_log (guild_id, user_id, sent_at);
+-- db.counters rebuilds one day at a time.
+CREATE INDEX IF NOT EXISTS sent_at ON message_log (sent_at);
+
+CREATE UNIQUE INDEX IF NOT EXISTS title ON friend_code_games (title);
+CREATE INDEX IF NOT EXISTS game_id ON friend_codes (game_id);
+
+-- /advent/event looks up one user and day; /advent/events pages by
+-- (date, id) within a year.
+CREATE INDEX IF NOT EXISTS user_date ON advent (user_id, date);
+CREATE INDEX IF NOT EXISTS date_id ON advent (date, id);
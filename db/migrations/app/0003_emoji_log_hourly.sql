@@ -0,0 +1,16 @@
+-- Hourly emoji counts maintained by db.rollup.
+
+CREATE TABLE IF NOT EXISTS emoji_log_hourly (
+    guild_id BIGINT NOT NULL,
+    hour DATETIME NOT NULL,
+    user_id BIGINT NOT NULL,
+    PartialEmoji_str VARCHAR(255) NOT NULL,
+    usage_count INT UNSIGNED NOT NULL,
+    PRIMARY KEY (guild_id, hour, user_id, PartialEmoji_str),
+    KEY guild_emoji_hour (guild_id, PartialEmoji_str, hour)
+);
+
+CREATE TABLE IF NOT EXISTS rollup_watermarks (
+    name VARCHAR(64) NOT NULL PRIMARY KEY,
+    rolled_until DATETIME NOT NULL
+);
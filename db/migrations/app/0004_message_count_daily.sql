@@ -0,0 +1,10 @@
+-- Daily message counters maintained on insert and by db.counters.
+
+CREATE TABLE IF NOT EXISTS message_count_daily (
+    guild_id BIGINT NOT NULL,
+    user_id BIGINT NOT NULL,
+    channel_id BIGINT NOT NULL,
+    day DATE NOT NULL,
+    message_count INT UNSIGNED NOT NULL,
+    PRIMARY KEY (guild_id, user_id, day, channel_id)
+);
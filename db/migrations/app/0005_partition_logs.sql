@@ -0,0 +1,20 @@
+-- Monthly RANGE partitions on the log tables, maintained by db.partitions.
+-- The partitioning column has to be part of every unique key, hence the
+-- wider primary keys. Existing rows all start out in pmax; the first run of
+-- `python -m db.partitions maintain` splits them into monthly partitions,
+-- which copies the table once, so run it in a quiet period.
+-- Each table is converted by a single ALTER, which MariaDB applies as a
+-- whole and which leaves the same table when repeated, so the migration can
+-- be re-run after failing part way.
+
+ALTER TABLE emoji_log
+    DROP PRIMARY KEY, ADD PRIMARY KEY (id, used_at)
+    PARTITION BY RANGE (TO_DAYS(used_at)) (
+        PARTITION pmax VALUES LESS THAN MAXVALUE
+    );
+
+ALTER TABLE message_log
+    DROP PRIMARY KEY, ADD PRIMARY KEY (id, sent_at)
+    PARTITION BY RANGE (TO_DAYS(sent_at)) (
+        PARTITION pmax VALUES LESS THAN MAXVALUE
+    );
@@ -0,0 +1,10 @@
+-- Unique keys for the INSERT ... ON DUPLICATE KEY UPDATE upserts.
+-- ALTER IGNORE drops any duplicate rows the old read-then-write upserts
+-- could create under concurrency, keeping the first one.
+
+ALTER IGNORE TABLE friend_codes
+    ADD UNIQUE INDEX IF NOT EXISTS user_game (user_id, game_id);
+
+ALTER IGNORE TABLE advent
+    ADD UNIQUE INDEX IF NOT EXISTS user_date_unique (user_id, date);
+DROP INDEX IF EXISTS user_date ON advent;
@@ -0,0 +1,3 @@
+-- db.topk loads recent hours across all guilds at startup.
+
+CREATE INDEX IF NOT EXISTS hour ON emoji_log_hourly (hour);
@@ -0,0 +1,6 @@
+-- ETag versions shared by every server process, see db.versions.
+
+CREATE TABLE IF NOT EXISTS table_versions (
+    name VARCHAR(64) NOT NULL PRIMARY KEY,
+    version BIGINT UNSIGNED NOT NULL
+);
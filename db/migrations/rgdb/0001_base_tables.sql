@@ -0,0 +1,36 @@
+-- The rhythm game DB is filled by the song importer; these only create the
+-- tables on an empty database.
+
+CREATE TABLE IF NOT EXISTS Games (
+    game_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    game_name VARCHAR(255) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS Songs (
+    song_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    game_id INT NOT NULL,
+    title VARCHAR(255) NOT NULL,
+    category VARCHAR(255),
+    artist VARCHAR(255),
+    jacket_image VARCHAR(1024),
+    length TIME,
+    bpm_main DECIMAL(6, 2),
+    bpm_min DECIMAL(6, 2),
+    bpm_max DECIMAL(6, 2),
+    description TEXT,
+    song_url VARCHAR(1024),
+    wiki_url VARCHAR(1024),
+    release_date DATE
+);
+
+CREATE TABLE IF NOT EXISTS Charts (
+    chart_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    song_id INT NOT NULL,
+    difficulty VARCHAR(32),
+    const DECIMAL(4, 1),
+    level VARCHAR(8),
+    num_notes INT,
+    designer VARCHAR(255),
+    chart_image_url VARCHAR(1024),
+    description TEXT
+);
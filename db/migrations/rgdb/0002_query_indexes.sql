@@ -0,0 +1,5 @@
+CREATE UNIQUE INDEX IF NOT EXISTS game_name ON Games (game_name);
+-- Song listing by game, paged by song_id.
+CREATE INDEX IF NOT EXISTS game_id_song_id ON Songs (game_id, song_id);
+-- The JSON_ARRAYAGG join and the random-song level filter.
+CREATE INDEX IF NOT EXISTS song_id_level ON Charts (song_id, level);
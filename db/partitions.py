@@ -0,0 +1,230 @@
+import datetime
+import re
+import sys
+
+import mariadb
+
+import db.db as db
+from settings import (
+    EMOJI_LOG_RETENTION_MONTHS,
+    MESSAGE_LOG_RETENTION_MONTHS,
+    PARTITION_ARCHIVE,
+    PARTITION_MONTHS_AHEAD,
+)
+
+# Partitioned table -> column its monthly RANGE partitions are keyed on.
+PARTITIONED_TABLES = {
+    "emoji_log": "used_at",
+    "message_log": "sent_at",
+}
+MONTH_PARTITION = re.compile(r"^p(\d{4})(\d{2})$")
+LOCK_NAME = "partition_maintenance"
+
+
+def _month_start(day: datetime.date) -> datetime.date:
+    return day.replace(day=1)
+
+
+def _add_months(month: datetime.date, months: int) -> datetime.date:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def get_partitions(cur, table: str) -> list[datetime.date] | None:
+    # Months that have their own partition, oldest first, or None if the
+    # table is not partitioned.
+    cur.execute(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = ? ORDER BY PARTITION_ORDINAL_POSITION",
+        (table,),
+    )
+    names = [row[0] for row in cur.fetchall()]
+    if not names or names == [None]:
+        return None
+    months = []
+    for name in names:
+        match = MONTH_PARTITION.match(name)
+        if match:
+            months.append(datetime.date(int(match[1]), int(match[2]), 1))
+    return months
+
+
+def _partition_definition(month: datetime.date) -> str:
+    upper = _add_months(month, 1)
+    return f"PARTITION p{month:%Y%m} VALUES LESS THAN (TO_DAYS('{upper:%Y-%m-%d}'))"
+
+
+def ensure_partitions(
+    cur, table: str, today: datetime.date, months_ahead: int, split_rows: bool = False
+) -> list[str]:
+    # Splits pmax so every month up to months_ahead from now has its own
+    # partition. pmax normally stays empty, which makes this a metadata-only
+    # change. A pmax that holds rows (as after db/migrations 0005) is only
+    # split with split_rows, since that copies the rows.
+    months = get_partitions(cur, table)
+    if months is None:
+        print(f"{table} is not partitioned; run python -m db.migrate")
+        return []
+    if not split_rows and _has_rows(cur, table, "pmax"):
+        print(
+            f"Not splitting pmax of {table}: it holds rows; run python -m db.partitions maintain"
+        )
+        return []
+    if months:
+        first = _add_months(months[-1], 1)
+    else:
+        cur.execute(f"SELECT MIN({PARTITIONED_TABLES[table]}) FROM {table}")
+        oldest = cur.fetchone()[0]
+        first = _month_start(oldest.date() if oldest else today)
+    last = _add_months(_month_start(today), months_ahead)
+    new_months = []
+    month = first
+    while month <= last:
+        new_months.append(month)
+        month = _add_months(month, 1)
+    if not new_months:
+        return []
+    definitions = [_partition_definition(month) for month in new_months]
+    definitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+    cur.execute(
+        f"ALTER TABLE {table} REORGANIZE PARTITION pmax INTO ({', '.join(definitions)})"
+    )
+    return [f"p{month:%Y%m}" for month in new_months]
+
+
+def _has_rows(cur, table: str, partition: str | None = None) -> bool:
+    source = table if partition is None else f"{table} PARTITION ({partition})"
+    cur.execute(f"SELECT 1 FROM {source} LIMIT 1")
+    return bool(cur.fetchall())
+
+
+def _archive_partition(cur, table: str, partition: str) -> bool:
+    # Swaps the partition's rows into <table>_archive_<partition>. Safe to
+    # re-run after a failure part way: an archive table that already holds
+    # the rows is not swapped back.
+    archive_table = f"{table}_archive_{partition}"
+    cur.execute(
+        "SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = ?",
+        (archive_table,),
+    )
+    if not cur.fetchone()[0]:
+        cur.execute(f"CREATE TABLE {archive_table} LIKE {table}")
+        cur.execute(f"ALTER TABLE {archive_table} REMOVE PARTITIONING")
+    if not _has_rows(cur, table, partition):
+        return True
+    if _has_rows(cur, archive_table):
+        print(f"Not archiving {table} {partition}: {archive_table} is not empty")
+        return False
+    cur.execute(
+        f"ALTER TABLE {table} EXCHANGE PARTITION {partition} WITH TABLE {archive_table}"
+    )
+    return True
+
+
+def prune_partitions(
+    cur,
+    table: str,
+    today: datetime.date,
+    retention_months: int,
+    archive: bool,
+    keep_after: datetime.datetime | None = None,
+) -> list[str]:
+    # Drops monthly partitions that only hold rows older than
+    # retention_months. With archive, each one is first swapped into its own
+    # <table>_archive_pYYYYMM table, so the rows are kept outside the hot
+    # table and can be dumped or moved at leisure. Partitions ending after
+    # keep_after are kept regardless.
+    months = get_partitions(cur, table)
+    if not months or retention_months <= 0:
+        return []
+    cutoff = _add_months(_month_start(today), -retention_months)
+    pruned = []
+    for month in months:
+        upper = _add_months(month, 1)
+        if upper > cutoff:
+            break
+        if keep_after is not None and upper > keep_after.date():
+            break
+        name = f"p{month:%Y%m}"
+        if archive and not _archive_partition(cur, table, name):
+            break
+        cur.execute(f"ALTER TABLE {table} DROP PARTITION {name}")
+        pruned.append(name)
+    return pruned
+
+
+def maintain_partitions(split_rows: bool = False) -> dict[str, dict[str, list[str]]]:
+    # The periodic job only makes metadata-only changes; the CLI passes
+    # split_rows for the first split of the rows migrated into pmax.
+    retention = {
+        "emoji_log": EMOJI_LOG_RETENTION_MONTHS,
+        "message_log": MESSAGE_LOG_RETENTION_MONTHS,
+    }
+    conn = db.get_connection()
+    cur = conn.cursor()
+    changes = {}
+    # Every server process runs this job; only one at a time does the DDL.
+    cur.execute("SELECT GET_LOCK(?, 0)", (LOCK_NAME,))
+    if cur.fetchone()[0] != 1:
+        cur.close()
+        conn.close()
+        return changes
+    try:
+        cur.execute(
+            "SELECT CURDATE(), (SELECT rolled_until FROM rollup_watermarks WHERE name = ?)",
+            (db.EMOJI_ROLLUP,),
+        )
+        today, rolled_until = cur.fetchone()
+        for table in PARTITIONED_TABLES:
+            created = ensure_partitions(
+                cur, table, today, PARTITION_MONTHS_AHEAD, split_rows
+            )
+            # emoji_log rows are only dropped once db.rollup has counted them.
+            keep_after = rolled_until if table == "emoji_log" else None
+            if table == "emoji_log" and rolled_until is None:
+                pruned = []
+            else:
+                pruned = prune_partitions(
+                    cur,
+                    table,
+                    today,
+                    retention[table],
+                    PARTITION_ARCHIVE,
+                    keep_after,
+                )
+            changes[table] = {"created": created, "pruned": pruned}
+    except mariadb.Error as e:
+        print(f"Error maintaining partitions: {e}")
+    finally:
+        cur.execute("SELECT RELEASE_LOCK(?)", (LOCK_NAME,))
+        cur.fetchall()
+        cur.close()
+        conn.close()
+    return changes
+
+
+def partition_status() -> list[tuple]:
+    # (table, partition, rows, upper bound) as estimated by the server.
+    with db.get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT TABLE_NAME, PARTITION_NAME, TABLE_ROWS, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({', '.join('?' * len(PARTITIONED_TABLES))}) ORDER BY TABLE_NAME, PARTITION_ORDINAL_POSITION",
+            tuple(PARTITIONED_TABLES),
+        )
+        result = cur.fetchall()
+        cur.close()
+    return result
+
+
+if __name__ == "__main__":
+    # python -m db.partitions [status|maintain]
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+    if command not in ("status", "maintain"):
+        print("usage: python -m db.partitions [status|maintain]")
+        sys.exit(2)
+    if command == "maintain":
+        for table, change in maintain_partitions(split_rows=True).items():
+            print(
+                f"{table}: created {', '.join(change['created']) or 'none'}; pruned {', '.join(change['pruned']) or 'none'}"
+            )
+    for table, partition, rows, upper in partition_status():
+        print(f"{table} {partition} rows~{rows} < {upper}")
@@ -0,0 +1,204 @@
+import queue
+import threading
+import time
+
+import mariadb
+
+import metrics
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection:
+    __slots__ = ("_pool", "_conn", "created_at", "released_at")
+
+    def __init__(self, pool, conn: mariadb.Connection):
+        self._pool = pool
+        self._conn = conn
+        self.created_at = time.monotonic()
+        self.released_at = self.created_at
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self) -> None:
+        # Callers keep calling conn.close() as before; it hands the
+        # connection back to the pool instead of tearing it down.
+        if self._conn is None or self._pool is None:
+            return
+        pool, self._pool = self._pool, None
+        pool._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            try:
+                self._conn.rollback()
+            except mariadb.Error:
+                pass
+        self.close()
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        name: str,
+        connect_kwargs: dict,
+        size: int = 5,
+        max_overflow: int = 10,
+        recycle: float = 1800,
+        idle_timeout: float = 300,
+        timeout: float = 30,
+        ping_interval: float = 5,
+    ):
+        self.name = name
+        self.connect_kwargs = connect_kwargs
+        self.size = size
+        self.max_overflow = max_overflow
+        self.recycle = recycle
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._in_use = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._recycled = 0
+        self._ping_failures = 0
+
+    def _connect(self) -> PooledConnection:
+        conn = mariadb.connect(**self.connect_kwargs)
+        return PooledConnection(self, conn)
+
+    def _discard(self, pooled: PooledConnection) -> None:
+        conn, pooled._conn = pooled._conn, None
+        with self._lock:
+            self._opened -= 1
+        try:
+            conn.close()
+        except mariadb.Error:
+            pass
+
+    def _reserve_slot(self) -> bool:
+        with self._lock:
+            if self._opened < self.size + self.max_overflow:
+                self._opened += 1
+                return True
+            return False
+
+    def _is_usable(self, pooled: PooledConnection) -> bool:
+        now = time.monotonic()
+        idle_for = now - pooled.released_at
+        if (self.recycle and now - pooled.created_at > self.recycle) or (
+            self.idle_timeout and idle_for > self.idle_timeout
+        ):
+            with self._lock:
+                self._recycled += 1
+            return False
+        # Skip the health check for connections that were in use moments
+        # ago so hot lookups don't pay an extra round-trip.
+        if idle_for > self.ping_interval:
+            try:
+                pooled._conn.ping()
+            except mariadb.Error:
+                with self._lock:
+                    self._ping_failures += 1
+                return False
+        return True
+
+    def acquire(self, timeout: float | None = None) -> PooledConnection:
+        # timeout overrides the pool's own for callers with somewhere else
+        # to go, such as replica reads that can fall back to the primary.
+        if timeout is None:
+            timeout = self.timeout
+        started = time.monotonic()
+        waited = False
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                if self._reserve_slot():
+                    try:
+                        pooled = self._connect()
+                    except mariadb.Error:
+                        with self._lock:
+                            self._opened -= 1
+                        raise
+                    break
+                waited = True
+                remaining = timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise PoolTimeout(
+                        f"{self.name}: no connection available after {timeout}s"
+                    )
+                try:
+                    # Poll so that slots freed by discarded overflow
+                    # connections are noticed as well.
+                    pooled = self._idle.get(timeout=min(remaining, 0.05))
+                except queue.Empty:
+                    continue
+            if self._is_usable(pooled):
+                break
+            self._discard(pooled)
+
+        pooled._pool = self
+        elapsed = time.monotonic() - started
+        metrics.db_pool_acquire_duration.observe(elapsed, self.name)
+        with self._lock:
+            self._in_use += 1
+            if waited:
+                self._waits += 1
+                self._wait_seconds += elapsed
+                self._wait_max = max(self._wait_max, elapsed)
+        return pooled
+
+    def _release(self, pooled: PooledConnection) -> None:
+        with self._lock:
+            self._in_use -= 1
+            keep = self._idle.qsize() < self.size
+        if not keep:
+            self._discard(pooled)
+            return
+        try:
+            # Never hand out a connection with an open transaction.
+            pooled._conn.rollback()
+        except mariadb.Error:
+            self._discard(pooled)
+            return
+        pooled.released_at = time.monotonic()
+        self._idle.put(pooled)
+
+    def close(self) -> None:
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(pooled)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "size": self.size,
+                "max_overflow": self.max_overflow,
+                "opened": self._opened,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "waits": self._waits,
+                "wait_seconds_total": self._wait_seconds,
+                "wait_seconds_max": self._wait_max,
+                "timeouts": self._timeouts,
+                "recycled": self._recycled,
+                "ping_failures": self._ping_failures,
+            }
@@ -0,0 +1,62 @@
+import random
+import threading
+
+
+class RandomSongIndex:
+    def __init__(self, loader):
+        # loader returns [(song_id, game_id, level), ...] with level None for
+        # songs without charts, or None on error.
+        self._loader = loader
+        self._all: tuple[int, ...] = ()
+        self._by_game: dict[int, tuple[int, ...]] = {}
+        self._by_level: dict[str, tuple[int, ...]] = {}
+        self._by_game_level: dict[tuple[int, str], tuple[int, ...]] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def rebuild(self) -> None:
+        with self._lock:
+            rows = self._loader()
+            if rows is None:
+                return
+            all_ids = set()
+            by_game = {}
+            by_level = {}
+            by_game_level = {}
+            for song_id, game_id, level in rows:
+                all_ids.add(song_id)
+                by_game.setdefault(game_id, set()).add(song_id)
+                if level is not None:
+                    by_level.setdefault(level, set()).add(song_id)
+                    by_game_level.setdefault((game_id, level), set()).add(song_id)
+            # Sorted tuples give O(1) indexing and a stable order, so the same
+            # seed picks the same songs as long as the data is unchanged.
+            self._by_game_level = {
+                k: tuple(sorted(v)) for k, v in by_game_level.items()
+            }
+            self._by_level = {k: tuple(sorted(v)) for k, v in by_level.items()}
+            self._by_game = {k: tuple(sorted(v)) for k, v in by_game.items()}
+            self._all = tuple(sorted(all_ids))
+            self._loaded = True
+
+    def _bucket(self, game_id: int | None, level: str | None) -> tuple[int, ...]:
+        if not self._loaded:
+            self.rebuild()
+        if game_id is not None and level:
+            return self._by_game_level.get((game_id, level), ())
+        if game_id is not None:
+            return self._by_game.get(game_id, ())
+        if level:
+            return self._by_level.get(level, ())
+        return self._all
+
+    def sample(
+        self,
+        game_id: int | None,
+        level: str | None,
+        count: int = 1,
+        seed: int | None = None,
+    ) -> list[int]:
+        bucket = self._bucket(game_id, level)
+        rng = random.Random(seed) if seed is not None else random
+        return rng.sample(bucket, min(max(count, 0), len(bucket)))
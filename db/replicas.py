@@ -0,0 +1,125 @@
+import itertools
+import threading
+import time
+
+import mariadb
+
+from db.pool import PoolTimeout
+
+
+def parse_hosts(specs: list[str], default_port: int) -> list[tuple[str, int]]:
+    hosts = []
+    for spec in specs:
+        host, sep, port = spec.partition(":")
+        hosts.append((host, int(port) if sep else default_port))
+    return hosts
+
+
+class ReplicaSet:
+    # Read replicas, taken in turn. A replica that cannot be reached is left
+    # out for eject_seconds; one that has stopped replicating or is more than
+    # max_lag seconds behind is left out until check() finds it caught up.
+    def __init__(
+        self,
+        hosts: list[tuple[str, int]],
+        get_pool,
+        check_database: str,
+        max_lag: float = 5,
+        eject_seconds: float = 30,
+        acquire_timeout: float = 0.1,
+    ):
+        # get_pool(database, (host, port)) returns the ConnectionPool for
+        # that database on that replica.
+        self.hosts = hosts
+        self._get_pool = get_pool
+        self.check_database = check_database
+        self.max_lag = max_lag
+        self.eject_seconds = eject_seconds
+        # How long a read waits for a busy replica's pool before trying the
+        # next one; the primary's pool still gets its full timeout.
+        self.acquire_timeout = acquire_timeout
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        self._ejected_until = {host: 0.0 for host in hosts}
+        self._lagging = {host: False for host in hosts}
+        self._lag: dict[tuple, int | None] = {host: None for host in hosts}
+        self._ejections = {host: 0 for host in hosts}
+        self.fallbacks = 0
+
+    def _available(self, host: tuple[str, int], now: float) -> bool:
+        return not self._lagging[host] and now >= self._ejected_until[host]
+
+    def _eject(self, host: tuple[str, int], reason) -> None:
+        with self._lock:
+            self._ejected_until[host] = time.monotonic() + self.eject_seconds
+            self._ejections[host] += 1
+        print(
+            f"Not reading from replica {host[0]}:{host[1]} for {self.eject_seconds}s: {reason}"
+        )
+
+    def acquire(self, database: str):
+        # A connection to the next available replica, or None if there is
+        # none and the caller should read from the primary.
+        start = next(self._turn)
+        now = time.monotonic()
+        for i in range(len(self.hosts)):
+            host = self.hosts[(start + i) % len(self.hosts)]
+            if not self._available(host, now):
+                continue
+            try:
+                return self._get_pool(database, host).acquire(self.acquire_timeout)
+            except PoolTimeout as e:
+                # The replica is up but busy; try the next one, or the
+                # primary, without leaving it out.
+                print(f"Error: {e}")
+            except mariadb.Error as e:
+                self._eject(host, e)
+        with self._lock:
+            self.fallbacks += 1
+        return None
+
+    def check(self) -> None:
+        now = time.monotonic()
+        for host in self.hosts:
+            if now < self._ejected_until[host]:
+                continue
+            try:
+                pool = self._get_pool(self.check_database, host)
+                with pool.acquire(self.acquire_timeout) as conn:
+                    cur = conn.cursor(dictionary=True)
+                    cur.execute("SHOW REPLICA STATUS")
+                    status = cur.fetchone()
+                    cur.close()
+            except PoolTimeout:
+                # Busy serving reads; check it next time.
+                continue
+            except mariadb.Error as e:
+                self._eject(host, e)
+                continue
+            lag = None if status is None else status["Seconds_Behind_Master"]
+            lagging = lag is None or lag > self.max_lag
+            with self._lock:
+                was_lagging = self._lagging[host]
+                self._lagging[host] = lagging
+                self._lag[host] = lag
+            if lagging and not was_lagging:
+                state = "not replicating" if lag is None else f"{lag}s behind"
+                print(f"Not reading from replica {host[0]}:{host[1]}: {state}")
+            elif was_lagging and not lagging:
+                print(f"Reading from replica {host[0]}:{host[1]} again")
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "hosts": [
+                    {
+                        "host": f"{host[0]}:{host[1]}",
+                        "available": self._available(host, now),
+                        "lag": self._lag[host],
+                        "ejections": self._ejections[host],
+                    }
+                    for host in self.hosts
+                ],
+                "fallbacks": self.fallbacks,
+            }
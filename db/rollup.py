@@ -0,0 +1,68 @@
+import datetime
+import sys
+
+import db.db as db
+import db.migrate as migrate
+
+# Hours are only rolled up once they ended this long ago, so rows that are
+# committed a little after their used_at timestamp still land in the bucket.
+ROLLUP_LAG = datetime.timedelta(minutes=5)
+# Each transaction covers at most this much raw data.
+ROLLUP_CHUNK = datetime.timedelta(hours=24)
+
+
+def roll_up_emoji_log(rebuild: bool = False) -> int:
+    with db.get_connection() as conn:
+        cur = conn.cursor()
+
+        cur.execute(
+            "SELECT NOW(), (SELECT rolled_until FROM rollup_watermarks WHERE name = ?)",
+            (db.EMOJI_ROLLUP,),
+        )
+        now, rolled_until = cur.fetchone()
+        end = db.floor_hour(now - ROLLUP_LAG)
+        if rebuild or rolled_until is None:
+            cur.execute("SELECT MIN(used_at) FROM emoji_log")
+            first_used_at = cur.fetchone()[0]
+            if first_used_at is None:
+                cur.close()
+                return 0
+            start = db.floor_hour(first_used_at)
+        else:
+            start = rolled_until
+
+        hours = 0
+        while start < end:
+            chunk_end = min(start + ROLLUP_CHUNK, end)
+            if rebuild:
+                # Replace the chunk in the same transaction so readers never
+                # see it half-built.
+                cur.execute(
+                    "DELETE FROM emoji_log_hourly WHERE hour >= ? AND hour < ?",
+                    (start, chunk_end),
+                )
+            cur.execute(
+                "INSERT INTO emoji_log_hourly (guild_id, hour, user_id, PartialEmoji_str, usage_count) SELECT guild_id, DATE_FORMAT(used_at, '%Y-%m-%d %H:00:00') AS hour, user_id, PartialEmoji_str, COUNT(*) FROM emoji_log WHERE used_at >= ? AND used_at < ? GROUP BY guild_id, hour, user_id, PartialEmoji_str ON DUPLICATE KEY UPDATE usage_count = VALUES(usage_count)",
+                (start, chunk_end),
+            )
+            cur.execute(
+                "INSERT INTO rollup_watermarks (name, rolled_until) VALUES (?, ?) ON DUPLICATE KEY UPDATE rolled_until = GREATEST(rolled_until, VALUES(rolled_until))",
+                (db.EMOJI_ROLLUP, chunk_end),
+            )
+            conn.commit()
+            hours += int((chunk_end - start).total_seconds() // 3600)
+            start = chunk_end
+
+        cur.close()
+    return hours
+
+
+if __name__ == "__main__":
+    # python -m db.rollup [backfill]
+    command = sys.argv[1] if len(sys.argv) > 1 else "update"
+    if command not in ("update", "backfill"):
+        print("usage: python -m db.rollup [update|backfill]")
+        sys.exit(2)
+    migrate.exit_if_pending(("app",))
+    hours = roll_up_emoji_log(rebuild=command == "backfill")
+    print(f"Rolled up {hours} hours of emoji_log into emoji_log_hourly")
@@ -0,0 +1,232 @@
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+_KANA_ROMAJI = {
+    "あ": "a", "い": "i", "う": "u", "え": "e", "お": "o",
+    "か": "ka", "き": "ki", "く": "ku", "け": "ke", "こ": "ko",
+    "さ": "sa", "し": "si", "す": "su", "せ": "se", "そ": "so",
+    "た": "ta", "ち": "ti", "つ": "tu", "て": "te", "と": "to",
+    "な": "na", "に": "ni", "ぬ": "nu", "ね": "ne", "の": "no",
+    "は": "ha", "ひ": "hi", "ふ": "hu", "へ": "he", "ほ": "ho",
+    "ま": "ma", "み": "mi", "む": "mu", "め": "me", "も": "mo",
+    "や": "ya", "ゆ": "yu", "よ": "yo",
+    "ら": "ra", "り": "ri", "る": "ru", "れ": "re", "ろ": "ro",
+    "わ": "wa", "ゐ": "i", "ゑ": "e", "を": "o", "ん": "n",
+    "が": "ga", "ぎ": "gi", "ぐ": "gu", "げ": "ge", "ご": "go",
+    "ざ": "za", "じ": "zi", "ず": "zu", "ぜ": "ze", "ぞ": "zo",
+    "だ": "da", "ぢ": "zi", "づ": "zu", "で": "de", "ど": "do",
+    "ば": "ba", "び": "bi", "ぶ": "bu", "べ": "be", "ぼ": "bo",
+    "ぱ": "pa", "ぴ": "pi", "ぷ": "pu", "ぺ": "pe", "ぽ": "po",
+    "ゔ": "vu",
+    "ぁ": "a", "ぃ": "i", "ぅ": "u", "ぇ": "e", "ぉ": "o",
+    "ゃ": "ya", "ゅ": "yu", "ょ": "yo", "ゎ": "wa",
+}  # fmt: skip
+_SMALL_Y = {"ゃ": "ya", "ゅ": "yu", "ょ": "yo"}
+
+# Hepburn spellings are folded onto the Kunrei-style spelling produced by
+# _KANA_ROMAJI, so "shi", "si" and "し" all end up as "si". _romanize
+# doubles the first letter after っ, so "ffu" has to become "hhu" like っふ.
+_HEPBURN = (
+    ("ffu", "hhu"),
+    ("tsu", "tu"),
+    ("shi", "si"),
+    ("chi", "ti"),
+    ("sh", "sy"),
+    ("ch", "ty"),
+    ("ji", "zi"),
+    ("jy", "zy"),
+    ("j", "zy"),
+    ("fu", "hu"),
+)
+_HEPBURN_RE = re.compile("|".join(src for src, _ in _HEPBURN))
+_HEPBURN_MAP = dict(_HEPBURN)
+
+
+def _fold_char(ch: str) -> str:
+    # Katakana to hiragana, and strip accents from Latin letters.
+    code = ord(ch)
+    if 0x30A1 <= code <= 0x30F6:
+        return chr(code - 0x60)
+    if code < 0x250:
+        return "".join(
+            c for c in unicodedata.normalize("NFKD", ch) if not unicodedata.combining(c)
+        )
+    return ch
+
+
+def _romanize(text: str) -> str:
+    out = []
+    geminate = False
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if ch == "っ":
+            geminate = True
+            i += 1
+            continue
+        romaji = _KANA_ROMAJI.get(ch)
+        if romaji is None:
+            out.append(ch)
+            geminate = False
+            i += 1
+            continue
+        if i + 1 < len(text) and text[i + 1] in _SMALL_Y and romaji.endswith("i"):
+            romaji = romaji[:-1] + _SMALL_Y[text[i + 1]]
+            i += 1
+        if geminate:
+            romaji = romaji[0] + romaji
+            geminate = False
+        out.append(romaji)
+        i += 1
+    return "".join(out)
+
+
+def normalize(text: str | None) -> str:
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = "".join(
+        _fold_char(ch)
+        for ch in text
+        if unicodedata.category(ch)[0] not in ("P", "Z", "C") and ch != "ー"
+    )
+    text = _romanize(text)
+    return _HEPBURN_RE.sub(lambda m: _HEPBURN_MAP[m.group(0)], text)
+
+
+def normalize_raw(text: str | None) -> str:
+    # For queries normalize() leaves nothing of, such as "!!!": only width,
+    # case and whitespace are folded.
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return "".join(ch for ch in text if unicodedata.category(ch)[0] != "Z")
+
+
+def trigrams(text: str) -> set[str]:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def _substring_score(query: str, value: str) -> float | None:
+    # Exact > prefix > infix, all above any trigram similarity.
+    if query not in value:
+        return None
+    if value == query:
+        return 3.0
+    if value.startswith(query):
+        return 2.0 + len(query) / len(value)
+    return 1.0 + len(query) / len(value)
+
+
+class _Field:
+    def __init__(self, values: dict[int, str], raw_values: dict[int, str]):
+        # values are normalize()d, raw_values normalize_raw()ed.
+        self.values = values
+        self.raw_values = raw_values
+        self.postings: dict[str, list[int]] = {}
+        for song_id, value in values.items():
+            for gram in trigrams(value):
+                self.postings.setdefault(gram, []).append(song_id)
+
+    def score(self, query: str, min_similarity: float) -> dict[int, float]:
+        # Substring matches score above 1 (exact > prefix > infix); other
+        # songs score by the fraction of query trigrams they share.
+        grams = trigrams(query)
+        if not grams:
+            candidates = self.values.keys()
+            shared = None
+        else:
+            shared = Counter()
+            for gram in grams:
+                shared.update(self.postings.get(gram, ()))
+            candidates = shared.keys()
+
+        scores = {}
+        for song_id in candidates:
+            score = _substring_score(query, self.values[song_id])
+            if score is not None:
+                scores[song_id] = score
+            elif shared is not None:
+                similarity = shared[song_id] / len(grams)
+                if similarity >= min_similarity:
+                    scores[song_id] = similarity * 0.99
+        return scores
+
+    def score_raw(self, query: str) -> dict[int, float]:
+        # Substring matches on the raw values, without an index; only used
+        # for the rare query that normalizes to nothing.
+        scores = {}
+        for song_id, value in self.raw_values.items():
+            score = _substring_score(query, value)
+            if score is not None:
+                scores[song_id] = score
+        return scores
+
+
+class SongSearchIndex:
+    def __init__(self, loader, min_similarity: float = 0.6):
+        # loader returns [(song_id, game_id, title, artist), ...] or None on
+        # error.
+        self._loader = loader
+        self.min_similarity = min_similarity
+        self._title = _Field({}, {})
+        self._artist = _Field({}, {})
+        self._game_ids: dict[int, int] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def rebuild(self) -> None:
+        with self._lock:
+            rows = self._loader()
+            if rows is None:
+                return
+            title = _Field(
+                {row[0]: normalize(row[2]) for row in rows},
+                {row[0]: normalize_raw(row[2]) for row in rows},
+            )
+            artist = _Field(
+                {row[0]: normalize(row[3]) for row in rows},
+                {row[0]: normalize_raw(row[3]) for row in rows},
+            )
+            self._title, self._artist = title, artist
+            self._game_ids = {row[0]: row[1] for row in rows}
+            self._loaded = True
+
+    def search(
+        self,
+        title: str | None = None,
+        artist: str | None = None,
+        game_id: int | None = None,
+        limit: int | None = None,
+    ) -> list[int]:
+        if not self._loaded:
+            self.rebuild()
+        scores = None
+        for field, query in ((self._title, title), (self._artist, artist)):
+            raw_query = normalize_raw(query)
+            if not raw_query:
+                continue
+            query = normalize(query)
+            if query:
+                field_scores = field.score(query, self.min_similarity)
+            else:
+                # Only punctuation and the like: match it literally rather
+                # than ignoring the filter.
+                field_scores = field.score_raw(raw_query)
+            if scores is None:
+                scores = field_scores
+            else:
+                scores = {
+                    song_id: score + field_scores[song_id]
+                    for song_id, score in scores.items()
+                    if song_id in field_scores
+                }
+        if scores is None:
+            scores = dict.fromkeys(self._game_ids, 0.0)
+        if game_id is not None:
+            game_ids = self._game_ids
+            scores = {k: v for k, v in scores.items() if game_ids.get(k) == game_id}
+        ranked = sorted(scores, key=lambda song_id: (-scores[song_id], song_id))
+        return ranked if limit is None else ranked[:limit]
@@ -0,0 +1,115 @@
+import datetime
+import zoneinfo
+
+import numpy as np
+
+import db.db as db
+
+# message_log rows are counted in quarter hours, the finest step any UTC
+# offset uses, so they can be bucketed in any time zone.
+RAW_STEP = 900
+
+
+def _bucket_edges(
+    start: datetime.datetime, end: datetime.datetime, bucket: str
+) -> list[datetime.datetime]:
+    # Starts of the buckets covering [start, end], in start's time zone.
+    # Days and weeks follow the wall clock across DST changes; hours are
+    # stepped in UTC so none is skipped or repeated.
+    if bucket == "hour":
+        first = start.replace(minute=0, second=0, microsecond=0)
+        step = datetime.timedelta(hours=1)
+        edges = []
+        t = first.astimezone(datetime.timezone.utc)
+        while t <= end:
+            edges.append(t.astimezone(start.tzinfo))
+            t += step
+        return edges
+    first = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == "week":
+        first -= datetime.timedelta(days=first.weekday())
+    step = datetime.timedelta(days=7 if bucket == "week" else 1)
+    edges = []
+    t = first
+    while t <= end:
+        edges.append(t)
+        t += step
+    return edges
+
+
+def _counts(
+    cur, guild_id: int, user_ids: list[int], start, channel_id, use_daily: bool
+) -> list[tuple]:
+    # (user_id, epoch seconds, count) rows. With use_daily only the first,
+    # partial day comes from message_log and the rest from
+    # message_count_daily, as in db.get_message_count_by_guild_and_user_id.
+    users = ", ".join("?" * len(user_ids))
+    channel_filter = "" if channel_id is None else " AND channel_id = ?"
+    channel_params = () if channel_id is None else (channel_id,)
+    where = f"guild_id = ? AND user_id IN ({users}) AND sent_at >= ?"
+    params = (guild_id, *user_ids, start)
+    if use_daily:
+        where += " AND sent_at < DATE(?) + INTERVAL 1 DAY"
+        params += (start,)
+    cur.execute(
+        f"SELECT user_id, UNIX_TIMESTAMP(sent_at) DIV {RAW_STEP} * {RAW_STEP} AS t, COUNT(*) FROM message_log WHERE {where}{channel_filter} GROUP BY user_id, t",
+        (*params, *channel_params),
+    )
+    rows = cur.fetchall()
+    if use_daily:
+        cur.execute(
+            f"SELECT user_id, UNIX_TIMESTAMP(day), CAST(SUM(message_count) AS UNSIGNED) FROM message_count_daily WHERE guild_id = ? AND user_id IN ({users}) AND day > DATE(?){channel_filter} GROUP BY user_id, day",
+            (guild_id, *user_ids, start, *channel_params),
+        )
+        rows += cur.fetchall()
+    return rows
+
+
+def get_message_count_series(
+    guild_id: int,
+    user_ids: list[int],
+    hours: int,
+    bucket: str = "day",
+    tz: str | None = None,
+    channel_id: int | None = None,
+) -> tuple[list[datetime.datetime], list[int], np.ndarray]:
+    # Messages per user and bucket over the last `hours`, in time zone tz
+    # (the database's when None). Returns the bucket starts, the sorted
+    # user ids and a zero-filled (users, buckets) array of counts; the
+    # first bucket only counts from the start of the window.
+    out_tz = zoneinfo.ZoneInfo(tz) if tz else None
+    user_ids = sorted(set(user_ids))
+    conn = db.get_read_connection("message_log", "message_count_daily")
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT NOW(), UNIX_TIMESTAMP(NOW())")
+        now, now_epoch = cur.fetchone()
+        utc_now = datetime.datetime.fromtimestamp(int(now_epoch), datetime.timezone.utc)
+        db_tz = datetime.timezone(now - utc_now.replace(tzinfo=None))
+        end = utc_now.astimezone(out_tz or db_tz)
+        start = (utc_now - datetime.timedelta(hours=hours)).astimezone(end.tzinfo)
+        # message_count_daily has whole days in the database's time zone,
+        # which only line up with day and week buckets in the same offset.
+        use_daily = bucket != "hour" and end.utcoffset() == db_tz.utcoffset(None)
+        rows = _counts(
+            cur,
+            guild_id,
+            user_ids,
+            now - datetime.timedelta(hours=hours),
+            channel_id,
+            use_daily,
+        )
+    finally:
+        cur.close()
+        conn.close()
+
+    edges = _bucket_edges(start, end, bucket)
+    counts = np.zeros((len(user_ids), len(edges)), dtype=np.int64)
+    if rows:
+        data = np.array(rows, dtype=np.int64).reshape(-1, 3)
+        edge_epochs = np.array([int(edge.timestamp()) for edge in edges])
+        user_index = np.searchsorted(np.array(user_ids, dtype=np.int64), data[:, 0])
+        bucket_index = np.searchsorted(edge_epochs, data[:, 1], side="right") - 1
+        keep = bucket_index >= 0
+        np.add.at(counts, (user_index[keep], bucket_index[keep]), data[keep, 2])
+    return edges, user_ids, counts
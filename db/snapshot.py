@@ -0,0 +1,241 @@
+import datetime
+import decimal
+import hashlib
+import os
+import sqlite3
+import threading
+
+SCHEMA = (
+    "CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE Games (game_id INTEGER PRIMARY KEY, game_name TEXT NOT NULL)",
+    """
+    CREATE TABLE Songs (
+        song_id INTEGER PRIMARY KEY,
+        game_id INTEGER,
+        title TEXT,
+        category TEXT,
+        artist TEXT,
+        jacket_image TEXT,
+        length,
+        bpm_main,
+        bpm_min,
+        bpm_max,
+        description TEXT,
+        song_url TEXT,
+        wiki_url TEXT,
+        release_date TEXT,
+        charts TEXT
+    )
+    """,
+    """
+    CREATE TABLE Charts (
+        chart_id INTEGER PRIMARY KEY,
+        song_id INTEGER,
+        difficulty TEXT,
+        const,
+        level TEXT,
+        num_notes INTEGER,
+        designer TEXT,
+        chart_image_url TEXT,
+        description TEXT
+    )
+    """,
+)
+INDEXES = (
+    "CREATE INDEX Songs_game_id ON Songs (game_id, song_id)",
+    "CREATE INDEX Charts_song_id ON Charts (song_id, level)",
+)
+SONG_COLUMNS = (
+    "song_id",
+    "game_id",
+    "title",
+    "category",
+    "artist",
+    "jacket_image",
+    "length",
+    "bpm_main",
+    "bpm_min",
+    "bpm_max",
+    "description",
+    "song_url",
+    "wiki_url",
+    "release_date",
+    "charts",
+)
+CHART_COLUMNS = (
+    "chart_id",
+    "song_id",
+    "difficulty",
+    "const",
+    "level",
+    "num_notes",
+    "designer",
+    "chart_image_url",
+    "description",
+)
+BATCH_SIZE = 1000
+
+
+def _to_sqlite(value):
+    # Store values the way the API renders them, so a song read from the
+    # snapshot serializes to the same JSON as one read from MariaDB.
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.decode()
+    return value
+
+
+def _dict_factory(cur, row) -> dict:
+    return {column[0]: value for column, value in zip(cur.description, row)}
+
+
+class RgdbSnapshot:
+    def __init__(self, path: str, exporter):
+        # exporter returns (games, songs, charts) iterables of rows from
+        # MariaDB: (game_id, game_name), dicts with SONG_COLUMNS, and tuples
+        # in CHART_COLUMNS order.
+        self.path = path
+        self._exporter = exporter
+        self._local = threading.local()
+        self._build_lock = threading.Lock()
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def build(self, checksum=None) -> None:
+        # Written to a temporary file and renamed over the old snapshot, so
+        # readers see either the old or the new file, never a partial one.
+        # Connections already open keep reading the old file until they
+        # notice it was replaced.
+        with self._build_lock:
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            conn = sqlite3.connect(tmp_path)
+            try:
+                conn.execute("PRAGMA journal_mode = OFF")
+                conn.execute("PRAGMA synchronous = OFF")
+                for statement in SCHEMA:
+                    conn.execute(statement)
+                games, songs, charts = self._exporter()
+                conn.executemany(
+                    "INSERT INTO Games (game_id, game_name) VALUES (?, ?)", games
+                )
+                self._insert(
+                    conn,
+                    "Songs",
+                    SONG_COLUMNS,
+                    (tuple(song[c] for c in SONG_COLUMNS) for song in songs),
+                )
+                self._insert(conn, "Charts", CHART_COLUMNS, charts)
+                for statement in INDEXES:
+                    conn.execute(statement)
+                conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('checksum', ?), ('built_at', ?)",
+                    (
+                        repr(checksum),
+                        datetime.datetime.now().isoformat(timespec="seconds"),
+                    ),
+                )
+                conn.commit()
+            except BaseException:
+                conn.close()
+                os.remove(tmp_path)
+                raise
+            conn.close()
+            os.replace(tmp_path, self.path)
+
+    def _insert(self, conn, table: str, columns: tuple[str, ...], rows) -> None:
+        statement = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        batch = []
+        for row in rows:
+            batch.append(tuple(_to_sqlite(value) for value in row))
+            if len(batch) == BATCH_SIZE:
+                conn.executemany(statement, batch)
+                batch = []
+        if batch:
+            conn.executemany(statement, batch)
+
+    def _connection(self) -> sqlite3.Connection:
+        # One read-only connection per thread, reopened when the file was
+        # replaced, whether by this process or by `python -m db.snapshot`.
+        local = self._local
+        stat = os.stat(self.path)
+        generation = (stat.st_ino, stat.st_mtime_ns)
+        if getattr(local, "generation", None) != generation:
+            if getattr(local, "conn", None) is not None:
+                local.conn.close()
+            local.conn = sqlite3.connect(
+                f"file:{self.path}?mode=ro", uri=True, check_same_thread=False
+            )
+            local.generation = generation
+        return local.conn
+
+    def _query(self, query: str, params: tuple = (), dictionary: bool = False):
+        cur = self._connection().cursor()
+        if dictionary:
+            cur.row_factory = _dict_factory
+        try:
+            cur.execute(query, params)
+            return cur.fetchall()
+        finally:
+            cur.close()
+
+    def checksum(self) -> str | None:
+        if not self.exists():
+            return None
+        rows = self._query("SELECT value FROM meta WHERE key = 'checksum'")
+        return rows[0][0] if rows else None
+
+    def games(self) -> list[tuple[int, str]]:
+        return self._query("SELECT game_id, game_name FROM Games ORDER BY game_id")
+
+    def song_search_rows(self) -> list[tuple[int, int, str, str]]:
+        return self._query("SELECT song_id, game_id, title, artist FROM Songs")
+
+    def song_levels(self) -> list[tuple[int, int, str | None]]:
+        return self._query(
+            "SELECT DISTINCT Songs.song_id, Songs.game_id, Charts.level FROM Songs LEFT JOIN Charts ON Songs.song_id = Charts.song_id"
+        )
+
+    def song_digests(self) -> list[tuple[int, bytes]]:
+        # The charts column holds every chart of the song, so one row covers
+        # everything a song document is built from.
+        rows = self._query(
+            f"SELECT {', '.join(f'Songs.{c}' for c in SONG_COLUMNS)}, Games.game_name FROM Songs LEFT JOIN Games ON Games.game_id = Songs.game_id"
+        )
+        return [(row[0], hashlib.md5(repr(row).encode()).digest()) for row in rows]
+
+    def songs_with_charts(self, song_ids: list[int]) -> tuple[list[dict], list[dict]]:
+        params = ", ".join("?" * len(song_ids))
+        songs = self._query(
+            f"SELECT Songs.*, Games.game_name FROM Songs LEFT JOIN Games ON Games.game_id = Songs.game_id WHERE Songs.song_id IN ({params})",
+            tuple(song_ids),
+            dictionary=True,
+        )
+        charts = self._query(
+            f"SELECT * FROM Charts WHERE song_id IN ({params}) ORDER BY song_id, chart_id",
+            tuple(song_ids),
+            dictionary=True,
+        )
+        return songs, charts
+
+
+if __name__ == "__main__":
+    # python -m db.snapshot
+    # Builds the snapshot at RGDB_SNAPSHOT_PATH, e.g. before starting the app.
+    import sys
+
+    import db.db as db
+
+    if db.rgdb_snapshot is None:
+        print("RGDB_SNAPSHOT_PATH is not set")
+        sys.exit(2)
+    if not db.build_rgdb_snapshot():
+        sys.exit(1)
+    print(f"Wrote {db.rgdb_snapshot.path}")
@@ -0,0 +1,180 @@
+import datetime
+import heapq
+import operator
+import threading
+
+import db.db as db
+
+# Rows fetched per query when tailing emoji_log.
+POLL_BATCH_SIZE = 10000
+
+
+class SpaceSaving:
+    # Space-Saving heavy hitters (Metwally et al.): at most capacity keys are
+    # tracked. A new key replaces the smallest counter and inherits its
+    # count, so counts never undercount and overcount by at most that
+    # inherited amount.
+    __slots__ = ("capacity", "counts")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: dict = {}
+
+    def offer(self, key, n: int = 1) -> None:
+        counts = self.counts
+        if key in counts:
+            counts[key] += n
+        elif len(counts) < self.capacity:
+            counts[key] = n
+        else:
+            victim = min(counts, key=counts.__getitem__)
+            counts[key] = counts.pop(victim) + n
+
+
+class EmojiTopK:
+    # Approximate emoji and member leaderboards per guild, kept in memory.
+    # Each guild has one bucket per hour holding a Space-Saving summary of
+    # emojis and one of users; a window of N hours merges the buckets of the
+    # current hour and the N - 1 before it. Memory is bounded by
+    # guilds * max_hours * 2 * capacity counters.
+    #
+    # The tracker follows emoji_log by id, so it sees rows however they were
+    # written. A row whose id is committed after a higher one may be missed.
+    def __init__(self, capacity: int, max_hours: int):
+        self.capacity = capacity
+        self.max_hours = max_hours
+        # guild_id -> {hour: (emoji summary, user summary)}
+        self._guilds: dict[int, dict[datetime.datetime, tuple]] = {}
+        self._lock = threading.Lock()
+        self._clock_offset = datetime.timedelta(0)
+        self.last_id = None
+
+    @property
+    def ready(self) -> bool:
+        return self.last_id is not None
+
+    def _now(self) -> datetime.datetime:
+        # Database time, which used_at is in.
+        return datetime.datetime.now() + self._clock_offset
+
+    def _add(self, guild_id: int, hour, user_id: int, emoji: str, n: int) -> None:
+        buckets = self._guilds.setdefault(guild_id, {})
+        bucket = buckets.get(hour)
+        if bucket is None:
+            bucket = buckets[hour] = (
+                SpaceSaving(self.capacity),
+                SpaceSaving(self.capacity),
+            )
+        bucket[0].offer(emoji, n)
+        bucket[1].offer(user_id, n)
+
+    def _add_rows(self, cur) -> None:
+        # Rows of (guild_id, hour, user_id, PartialEmoji_str, count).
+        while True:
+            rows = cur.fetchmany(POLL_BATCH_SIZE)
+            if not rows:
+                return
+            with self._lock:
+                for guild_id, hour, user_id, emoji, n in rows:
+                    self._add(guild_id, hour, user_id, emoji, int(n))
+
+    def _expire(self) -> None:
+        oldest = db.floor_hour(self._now()) - datetime.timedelta(
+            hours=self.max_hours - 1
+        )
+        with self._lock:
+            for guild_id in list(self._guilds):
+                buckets = self._guilds[guild_id]
+                for hour in [hour for hour in buckets if hour < oldest]:
+                    del buckets[hour]
+                if not buckets:
+                    del self._guilds[guild_id]
+
+    def _warm_up(self, cur) -> None:
+        # Whole hours come from emoji_log_hourly, the rest from emoji_log, as
+        # in db._get_emoji_counts.
+        cur.execute(
+            "SELECT NOW(), (SELECT rolled_until FROM rollup_watermarks WHERE name = ?), (SELECT MAX(id) FROM emoji_log)",
+            (db.EMOJI_ROLLUP,),
+        )
+        now, rolled_until, max_id = cur.fetchone()
+        start = db.floor_hour(now) - datetime.timedelta(hours=self.max_hours - 1)
+        if rolled_until is not None and rolled_until > start:
+            cur.execute(
+                "SELECT guild_id, hour, user_id, PartialEmoji_str, usage_count FROM emoji_log_hourly WHERE hour >= ? AND hour < ?",
+                (start, rolled_until),
+            )
+            self._add_rows(cur)
+            start = rolled_until
+        cur.execute(
+            "SELECT guild_id, CAST(DATE_FORMAT(used_at, '%Y-%m-%d %H:00:00') AS DATETIME) AS hour, user_id, PartialEmoji_str, COUNT(*) FROM emoji_log WHERE used_at >= ? AND id <= ? GROUP BY guild_id, hour, user_id, PartialEmoji_str",
+            (start, max_id or 0),
+        )
+        self._add_rows(cur)
+        self.last_id = max_id or 0
+
+    def poll(self) -> int:
+        # Adds emoji_log rows written since the last call; the first call
+        # loads the last max_hours. Returns the number of new rows.
+        conn = db.get_connection()
+        cur = conn.cursor()
+        added = 0
+        try:
+            if self.last_id is None:
+                self._warm_up(cur)
+            cur.execute("SELECT NOW()")
+            self._clock_offset = cur.fetchone()[0] - datetime.datetime.now()
+            while True:
+                cur.execute(
+                    "SELECT id, guild_id, user_id, PartialEmoji_str, used_at FROM emoji_log WHERE id > ? ORDER BY id LIMIT ?",
+                    (self.last_id, POLL_BATCH_SIZE),
+                )
+                rows = cur.fetchall()
+                with self._lock:
+                    for _, guild_id, user_id, emoji, used_at in rows:
+                        self._add(guild_id, db.floor_hour(used_at), user_id, emoji, 1)
+                if rows:
+                    self.last_id = rows[-1][0]
+                added += len(rows)
+                if len(rows) < POLL_BATCH_SIZE:
+                    break
+        finally:
+            cur.close()
+            conn.close()
+        self._expire()
+        return added
+
+    def top(
+        self, guild_id: int, hour: int, by: str, limit: int | None = None
+    ) -> list[tuple] | None:
+        # [(PartialEmoji_str or user_id, estimated count), ...] by count, or
+        # None if the tracker cannot answer: not loaded yet, or the window
+        # is longer than max_hours.
+        if not self.ready or hour > self.max_hours:
+            return None
+        index = 0 if by == "emoji" else 1
+        start = db.floor_hour(self._now()) - datetime.timedelta(hours=hour - 1)
+        totals: dict = {}
+        with self._lock:
+            for bucket_hour, bucket in self._guilds.get(guild_id, {}).items():
+                if bucket_hour >= start:
+                    for key, count in bucket[index].counts.items():
+                        totals[key] = totals.get(key, 0) + count
+        if limit is None:
+            return sorted(totals.items(), key=operator.itemgetter(1), reverse=True)
+        return heapq.nlargest(limit, totals.items(), key=operator.itemgetter(1))
+
+    def stats(self) -> dict:
+        with self._lock:
+            buckets = sum(len(buckets) for buckets in self._guilds.values())
+            counters = sum(
+                len(bucket[0].counts) + len(bucket[1].counts)
+                for buckets in self._guilds.values()
+                for bucket in buckets.values()
+            )
+        return {
+            "guilds": len(self._guilds),
+            "buckets": buckets,
+            "counters": counters,
+            "last_id": self.last_id,
+        }
@@ -0,0 +1,96 @@
+import secrets
+import threading
+import time
+
+import mariadb
+
+from db.pool import PoolTimeout
+
+
+class TableVersions:
+    def __init__(self, connect=None):
+        # The boot token keeps ETags from different processes (or from
+        # before a restart, when the counters start over) from colliding.
+        #
+        # With connect, a callable returning a connection to the database
+        # holding table_versions, the counters are shared by every process
+        # instead: bump() increments the row and refresh() picks up the
+        # other processes' bumps. Shared counters never start over, so once
+        # they are loaded the token is the same everywhere.
+        self._connect = connect
+        self.boot = secrets.token_hex(4)
+        self._versions: dict[str, int] = {}
+        # When this process last saw each table change, for
+        # changed_within().
+        self._changed_at: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def bump(self, *tables: str) -> None:
+        if self._connect is not None:
+            self._bump_shared(tables)
+            return
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+                self._changed_at[table] = time.monotonic()
+
+    def touch(self, *tables: str) -> None:
+        # Records a write for changed_within() without a new version, for
+        # tables no ETag covers. Stays in this process, so it costs nothing
+        # on hot write paths.
+        now = time.monotonic()
+        with self._lock:
+            for table in tables:
+                self._changed_at[table] = now
+
+    def _bump_shared(self, tables: tuple[str, ...]) -> None:
+        # Callers bump after returning their own connection, so this never
+        # holds two connections at once.
+        try:
+            conn = self._connect()
+        except PoolTimeout as e:
+            print(f"Error bumping table versions: {e}")
+            self.touch(*tables)
+            return
+        cur = conn.cursor()
+        try:
+            for table in tables:
+                cur.execute(
+                    "INSERT INTO table_versions (name, version) VALUES (?, LAST_INSERT_ID(1)) ON DUPLICATE KEY UPDATE version = LAST_INSERT_ID(version + 1)",
+                    (table,),
+                )
+                cur.execute("SELECT LAST_INSERT_ID()")
+                version = cur.fetchone()[0]
+                with self._lock:
+                    self._versions[table] = max(self._versions.get(table, 0), version)
+                    self._changed_at[table] = time.monotonic()
+            conn.commit()
+        except mariadb.Error as e:
+            print(f"Error bumping table versions: {e}")
+            self.touch(*tables)
+        finally:
+            cur.close()
+            conn.close()
+
+    def refresh(self) -> None:
+        with self._connect() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT name, version FROM table_versions")
+            rows = cur.fetchall()
+            cur.close()
+        with self._lock:
+            for table, version in rows:
+                if version > self._versions.get(table, 0):
+                    self._versions[table] = version
+                    self._changed_at[table] = time.monotonic()
+        self.boot = "shared"
+
+    def changed_within(self, seconds: float, *tables: str) -> bool:
+        now = time.monotonic()
+        changed_at = self._changed_at
+        return any(now - changed_at.get(table, -seconds) < seconds for table in tables)
+
+    def etag(self, *tables: str) -> str:
+        versions = self._versions
+        parts = ".".join(f"{table}-{versions.get(table, 0)}" for table in tables)
+        return f'"{self.boot}.{parts}"'
@@ -0,0 +1,34 @@
+# gunicorn -c gunicorn.conf.py
+#
+# Serves the app with WEB_CONCURRENCY uvicorn workers (default 1). Only the
+# ETag versions are shared, through the table_versions table
+# (SHARED_VERSIONS), and partition maintenance takes a database lock so
+# only one worker runs it at a time. Everything else is per worker:
+# - connection pools and db executor threads: DB_POOL_SIZE and
+#   DB_EXECUTOR_WORKERS apply to each, so MariaDB sees N times as many
+#   connections;
+# - event streams: a client only receives the updates for writes its own
+#   worker took, plus the STREAM_REFRESH_INTERVAL refreshes;
+# - the message log buffer: each worker flushes its own rows;
+# - the emoji leaderboard cache, the mode=approx tracker and the song,
+#   game name and search caches, each loaded and polled once per worker;
+# - /metrics and /db/pool-stats, which report the worker that answered.
+#
+# The app is preloaded, so kill -HUP only re-forks workers from the code
+# the arbiter already imported. To deploy new code, start a new arbiter
+# with kill -USR2 <arbiter pid>, stop the old workers once the new ones
+# serve with kill -WINCH <old arbiter pid>, then kill -TERM <old arbiter
+# pid>.
+import settings
+
+wsgi_app = "main:app"
+bind = f"{settings.HOST or '127.0.0.1'}:{settings.PORT}"
+workers = settings.WEB_CONCURRENCY
+worker_class = "worker.Worker"
+# The app is imported once in the arbiter and forked, so workers start
+# without importing FastAPI and the routes again. Connection pools, the
+# executor and background tasks are only created after the fork.
+preload_app = True
+# Workers cancel what is left after GRACEFUL_TIMEOUT; the extra time is for
+# the lifespan shutdown.
+graceful_timeout = int(settings.GRACEFUL_TIMEOUT) + 10
@@ -1,16 +1,77 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-import json
-from os import getenv
+import metrics
 import secrets
+import serialize
+import streams
 import uvicorn
+import zoneinfo
 
-import db.db as db
-from dotenv import load_dotenv
-from fastapi import Depends, FastAPI, HTTPException, status
+import db.aio as db
+import db.db as db_sync
+import db.migrate as migrate
+import db.partitions as partitions
+import db.rollup as rollup
+import db.series as series
+from db.buffer import WriteBehindBuffer
+from db.cache import AsyncTTLCache
+from db.pagination import decode_cursor, encode_cursor
+from db.topk import EmojiTopK
+from fastapi import (
+    APIRouter,
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    status,
+)
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from pydantic import BaseModel
-from typing import Annotated
+from pydantic import BaseModel, Field
+from settings import (
+    MESSAGE_LOG_BUFFER_SIZE,
+    MESSAGE_LOG_BUFFER_MAX_AGE,
+    MESSAGE_LOG_BUFFER_MAX_RETRIES,
+    MESSAGE_LOG_BUFFER_MAX_ROWS,
+    RGDB_CHANGE_CHECK_INTERVAL,
+    RGDB_SNAPSHOT_PATH,
+    RUN_MIGRATIONS,
+    RANDOM_SONG_MAX_COUNT,
+    PAGE_MAX_LIMIT,
+    BULK_UPSERT_MAX_ROWS,
+    EMOJI_BATCH_MAX_SPECS,
+    EMOJI_BATCH_CONCURRENCY,
+    MESSAGE_SERIES_MAX_USERS,
+    MESSAGE_SERIES_MAX_BUCKETS,
+    EMOJI_ROLLUP_INTERVAL,
+    STREAM_MIN_INTERVAL,
+    STREAM_REFRESH_INTERVAL,
+    STREAM_KEEPALIVE,
+    PARTITION_MAINTENANCE_INTERVAL,
+    EMOJI_CACHE_TTLS,
+    EMOJI_CACHE_SIZE,
+    EMOJI_TOPK_POLL_INTERVAL,
+    EMOJI_TOPK_CAPACITY,
+    EMOJI_TOPK_MAX_HOURS,
+    CACHE_CONTROL,
+    HOST,
+    PORT,
+    API_USERNAME,
+    API_PASSWORD,
+    ORIGIN1,
+    ORIGIN2,
+    ORIGIN3,
+    WEB_CONCURRENCY,
+    GRACEFUL_TIMEOUT,
+    SHARED_VERSIONS,
+    VERSION_REFRESH_INTERVAL,
+    DB_REPLICA_CHECK_INTERVAL,
+)
+from typing import Annotated, Literal
 
 
 class Game(BaseModel):
@@ -34,6 +95,14 @@ class MessageLog(BaseModel):
     user_id: int
 
 
+class EmojiUsageSpec(BaseModel):
+    guild_id: int
+    hour: int = 720
+    user_id: int | None = None
+    limit: int | None = Field(default=None, ge=1)
+    mode: Literal["approx", "exact"] = "exact"
+
+
 class Advent(BaseModel):
     user_id: int
     author: str | None
@@ -42,21 +111,125 @@ class Advent(BaseModel):
     date_str: str
 
 
-app = FastAPI()
+# A zero or negative limit would be a SQL error or a wrong slice.
+RankLimit = Annotated[int | None, Query(ge=1)]
+PageLimit = Annotated[int | None, Query(ge=1, le=PAGE_MAX_LIMIT)]
+
+
+async def run_periodically(interval: float, fn):
+    while True:
+        try:
+            await fn()
+        except Exception as e:
+            print(f"Error in periodic {fn.__name__}: {e}")
+        await asyncio.sleep(interval)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global message_log_buffer
+    if RUN_MIGRATIONS:
+        await db.run(migrate.migrate)
+    else:
+        for database in migrate.DATABASES:
+            for version in await db.run(migrate.pending_migrations, database):
+                print(
+                    f"Pending migration {database}/{version}, run python -m db.migrate"
+                )
+    if RGDB_SNAPSHOT_PATH:
+        # Build or validate the snapshot before serving, so the first
+        # requests already read from it.
+        await db.refresh_rgdb_if_changed()
+    background_tasks = []
+    if RGDB_CHANGE_CHECK_INTERVAL > 0:
+        background_tasks.append(
+            asyncio.create_task(
+                run_periodically(RGDB_CHANGE_CHECK_INTERVAL, db.refresh_rgdb_if_changed)
+            )
+        )
+    if EMOJI_ROLLUP_INTERVAL > 0:
+        background_tasks.append(
+            asyncio.create_task(
+                run_periodically(
+                    EMOJI_ROLLUP_INTERVAL, db.wrap(rollup.roll_up_emoji_log)
+                )
+            )
+        )
+    if emoji_topk is not None:
+        background_tasks.append(
+            asyncio.create_task(
+                run_periodically(EMOJI_TOPK_POLL_INTERVAL, db.wrap(emoji_topk.poll))
+            )
+        )
+    if SHARED_VERSIONS:
+        background_tasks.append(
+            asyncio.create_task(
+                run_periodically(
+                    VERSION_REFRESH_INTERVAL, db.wrap(db_sync.versions.refresh)
+                )
+            )
+        )
+    if db_sync.replicas is not None and DB_REPLICA_CHECK_INTERVAL > 0:
+        background_tasks.append(
+            asyncio.create_task(
+                run_periodically(DB_REPLICA_CHECK_INTERVAL, db.check_replicas)
+            )
+        )
+    if PARTITION_MAINTENANCE_INTERVAL > 0:
+        background_tasks.append(
+            asyncio.create_task(
+                run_periodically(
+                    PARTITION_MAINTENANCE_INTERVAL,
+                    db.wrap(partitions.maintain_partitions),
+                )
+            )
+        )
+    guild_streams.start()
+    if MESSAGE_LOG_BUFFER_SIZE > 0:
+        message_log_buffer = WriteBehindBuffer(
+            insert_message_logs_and_notify,
+            max_size=MESSAGE_LOG_BUFFER_SIZE,
+            max_age=MESSAGE_LOG_BUFFER_MAX_AGE,
+            max_retries=MESSAGE_LOG_BUFFER_MAX_RETRIES,
+            max_rows=MESSAGE_LOG_BUFFER_MAX_ROWS,
+        )
+        message_log_buffer.start()
+    yield
+    for task in background_tasks:
+        task.cancel()
+    await guild_streams.close()
+    if message_log_buffer is not None:
+        await message_log_buffer.close()
+        message_log_buffer = None
+    await db.close_pools()
+    db.shutdown()
+
+
+async def read_preference(
+    x_read_primary: Annotated[bool, Header()] = False,
+) -> None:
+    # Reads go to a replica when one is configured; a client that needs to
+    # see its own write right away sends X-Read-Primary: 1.
+    if x_read_primary:
+        db_sync.pin_primary()
+
+
+message_log_buffer: WriteBehindBuffer | None = None
+router = APIRouter(dependencies=[Depends(read_preference)])
 security = HTTPBasic()
-load_dotenv()
-DB_USER = getenv("DB_USER")
-DB_PASSWORD = getenv("DB_PASSWORD")
-DB_HOST = getenv("DB_HOST")
-DB_NAME = getenv("DB_NAME")
-RGDB_NAME = getenv("RGDB_NAME")
-HOST = getenv("HOST")
-PORT = int(getenv("PORT"))
-API_USERNAME = getenv("API_USERNAME")
-API_PASSWORD = getenv("API_PASSWORD")
-ORIGIN1 = getenv("ORIGIN1")
-ORIGIN2 = getenv("ORIGIN2")
-ORIGIN3 = getenv("ORIGIN3")
+
+emoji_cache = AsyncTTLCache(EMOJI_CACHE_SIZE)
+guild_streams = streams.GuildStreams(
+    lambda guild_id, topic: compute_guild_events(guild_id, topic),
+    STREAM_MIN_INTERVAL,
+    STREAM_REFRESH_INTERVAL,
+    STREAM_KEEPALIVE,
+)
+emoji_topk = (
+    EmojiTopK(EMOJI_TOPK_CAPACITY, EMOJI_TOPK_MAX_HOURS)
+    if EMOJI_TOPK_POLL_INTERVAL > 0
+    else None
+)
 
 origins = [
     ORIGIN1,
@@ -64,13 +237,216 @@ origins = [
     ORIGIN3,
 ]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+
+def friend_code_tuple_to_dict(friend_code_tuple) -> dict:
+    friend_code_dic = {}
+    friend_code_dic["user_id"] = friend_code_tuple[0]
+    friend_code_dic["game_title"] = friend_code_tuple[1]
+    friend_code_dic["friend_code"] = friend_code_tuple[2]
+    return friend_code_dic
+
+
+def events_tuple_to_dict(events_tuple) -> dict:
+    events_dic = {}
+    events_dic["user_id"] = events_tuple[1]
+    events_dic["author"] = events_tuple[2]
+    events_dic["title"] = events_tuple[3]
+    events_dic["url"] = events_tuple[4]
+    date_str = events_tuple[5].strftime("%Y-%m-%d")
+    events_dic["date_str"] = date_str
+    return events_dic
+
+
+def emoji_usage_to_dict(result, hour: int) -> dict:
+    res_dic = {}
+    rank_list = []
+    rank = 1
+    for stats_tuple in result:
+        emoji_stats_dic = {}
+        emoji_stats_dic["PartialEmoji_str"] = stats_tuple[0]
+        emoji_stats_dic["rank"] = rank
+        emoji_stats_dic["usage_count"] = stats_tuple[1]
+        rank_list.append(emoji_stats_dic)
+        rank += 1
+    res_dic["rankings"] = rank_list
+    res_dic["hour"] = hour
+    res_dic["total"] = len(rank_list)
+    return res_dic
+
+
+def approx_emoji_ranking(
+    guild_id: int, hour: int, by: str, filter_value, limit: int | None, mode: str
+) -> list[tuple] | None:
+    # The tracker only keeps per-guild totals, so rankings filtered by user
+    # or emoji are always exact.
+    if mode != "approx" or emoji_topk is None or filter_value is not None:
+        return None
+    return emoji_topk.top(guild_id, hour, by, limit)
+
+
+async def load_emoji_usage(
+    guild_id: int,
+    hour: int,
+    user_id: int | None,
+    limit: int | None,
+    mode: str,
+    semaphore: asyncio.Semaphore | None = None,
+) -> dict:
+    result = approx_emoji_ranking(guild_id, hour, "emoji", user_id, limit, mode)
+    if result is None:
+        mode = "exact"
+
+        async def load():
+            if semaphore is None:
+                return await db.get_emoji_usage(guild_id, hour, user_id, limit)
+            async with semaphore:
+                return await db.get_emoji_usage(guild_id, hour, user_id, limit)
+
+        result = await emoji_cache.get_or_load(
+            ("usage", guild_id, hour, user_id, limit), emoji_cache_ttl(hour), load
+        )
+    res_dic = emoji_usage_to_dict(result, hour)
+    res_dic["mode"] = mode
+    return res_dic
+
+
+def message_count_to_dict(result, guild_id: int, user_id: int, hours: int) -> dict:
+    res_dic = {}
+    res_dic["guild_id"] = guild_id
+    res_dic["user_id"] = user_id
+    res_dic["hours"] = hours
+    message_count_list = []
+    for message_count_tuple in result:
+        message_count_dic = {}
+        message_count_dic["date"] = message_count_tuple[0]
+        message_count_dic["count"] = message_count_tuple[1]
+        message_count_list.append(message_count_dic)
+    res_dic["message_count"] = message_count_list
+    res_dic["total_days"] = len(message_count_list)
+    return res_dic
+
+
+async def compute_guild_events(guild_id: int, topic: tuple) -> list:
+    hour, limit, mode, user_id, hours = topic
+    events = [
+        ("emoji_usage", await load_emoji_usage(guild_id, hour, None, limit, mode))
+    ]
+    if user_id is not None:
+        result = await db.get_message_count_by_guild_and_user_id(
+            guild_id, user_id, hours
+        )
+        events.append(
+            ("message_count", message_count_to_dict(result, guild_id, user_id, hours))
+        )
+    return events
+
+
+async def insert_message_logs_and_notify(rows: list) -> None:
+    await db.insert_message_logs(rows)
+    for guild_id in {row[0] for row in rows}:
+        guild_streams.notify(guild_id)
+
+
+def emoji_cache_ttl(hour: int) -> float:
+    for max_hour, ttl in EMOJI_CACHE_TTLS:
+        if hour <= max_hour:
+            return ttl
+    return EMOJI_CACHE_TTLS[-1][1] if EMOJI_CACHE_TTLS else 0
+
+
+def cache_headers(etag: str) -> dict[str, str]:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+
+def check_etag(request: Request, *tables: str) -> tuple[str, Response | None]:
+    # The ETag comes from in-process version counters, so a matching
+    # If-None-Match is answered with 304 before any database work.
+    etag = db_sync.versions.etag(*tables)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        if etag in tags or "*" in tags:
+            return etag, Response(status_code=304, headers=cache_headers(etag))
+    return etag, None
+
+
+def check_bulk_size(rows: list, max_rows: int = BULK_UPSERT_MAX_ROWS) -> None:
+    if len(rows) > max_rows:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {max_rows} rows per request",
+        )
+
+
+def parse_cursor(after: str | None, types: tuple) -> list | None:
+    # types are those of the values next_cursor put in the endpoint's
+    # cursors; anything else is a 400 rather than a failed query.
+    if after is None:
+        return None
+    try:
+        cursor = decode_cursor(after)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if len(cursor) != len(types) or not all(
+        isinstance(value, value_type) and not isinstance(value, bool)
+        for value, value_type in zip(cursor, types)
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid cursor: {after}"
+        )
+    return cursor
+
+
+def next_cursor(rows: list, limit: int | None, cursor_key) -> str | None:
+    if limit is None or not rows or len(rows) < limit:
+        return None
+    return encode_cursor(cursor_key(rows[-1]))
+
+
+def stream_json(
+    list_key: str,
+    rows,
+    encode_row,
+    res_dic: dict,
+    limit,
+    cursor_key,
+    headers: dict | None = None,
+):
+    # Writes {"<list_key>": [...], **res_dic, "total": n} while rows are
+    # still being read from the database cursor. rows is a db.iterate()
+    # iterator, or a list already in memory.
+    async def iterate_rows():
+        if isinstance(rows, list):
+            for row in rows:
+                yield row
+        else:
+            async for row in rows:
+                yield row
+
+    async def generate():
+        yield b'{"' + list_key.encode() + b'":['
+        total = 0
+        last = None
+        chunk = []
+        async for row in iterate_rows():
+            chunk.append(encode_row(row))
+            last = row
+            if len(chunk) >= 100:
+                yield (b"," if total else b"") + b",".join(chunk)
+                total += len(chunk)
+                chunk = []
+        if chunk:
+            yield (b"," if total else b"") + b",".join(chunk)
+            total += len(chunk)
+        trailer = dict(res_dic)
+        trailer["total"] = total
+        if limit is not None:
+            trailer["next"] = (
+                encode_cursor(cursor_key(last)) if total and total >= limit else None
+            )
+        yield b"]," + serialize.dumps(trailer)[1:]
+
+    return StreamingResponse(generate(), media_type="application/json", headers=headers)
 
 
 def get_current_username(
@@ -95,38 +471,75 @@ def get_current_username(
     return credentials.username
 
 
-@app.get("/emoji/usage-rank")
+@router.get("/emoji/usage-rank")
 async def get_emoji_usage_rank(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)],
     guild_id: int,
     hour: int = 720,
     user_id: int | None = None,
+    limit: RankLimit = None,
+    mode: Literal["approx", "exact"] = "exact",
+):
+    # mode=approx answers from the in-memory tracker when it can; the
+    # counts are estimates that may be slightly high.
+    return await load_emoji_usage(guild_id, hour, user_id, limit, mode)
+
+
+@router.post("/emoji/usage-ranks")
+async def get_emoji_usage_ranks(
+    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    specs: list[EmojiUsageSpec],
 ):
-    result = db.get_emoji_usage(guild_id, hour, user_id)
+    # The same leaderboards as /emoji/usage-rank for many guilds and windows
+    # in one call. Specs share the leaderboard cache, so repeated or
+    # recently requested ones are not queried again; at most
+    # EMOJI_BATCH_CONCURRENCY of the rest run at once, so one dashboard
+    # cannot take the whole connection pool.
+    check_bulk_size(specs, EMOJI_BATCH_MAX_SPECS)
+    semaphore = asyncio.Semaphore(EMOJI_BATCH_CONCURRENCY)
+    results = await asyncio.gather(
+        *(
+            load_emoji_usage(
+                spec.guild_id,
+                spec.hour,
+                spec.user_id,
+                spec.limit,
+                spec.mode,
+                semaphore,
+            )
+            for spec in specs
+        )
+    )
     res_dic = {}
-    rank_list = []
-    rank = 1
-    for stats_tuple in result:
-        emoji_stats_dic = {}
-        emoji_stats_dic["PartialEmoji_str"] = stats_tuple[0]
-        emoji_stats_dic["rank"] = rank
-        emoji_stats_dic["usage_count"] = stats_tuple[1]
-        rank_list.append(emoji_stats_dic)
-        rank += 1
-    res_dic["rankings"] = rank_list
-    res_dic["hour"] = hour
-    res_dic["total"] = len(rank_list)
+    result_list = []
+    for spec, result in zip(specs, results):
+        usage_dic = {}
+        usage_dic["guild_id"] = spec.guild_id
+        usage_dic["user_id"] = spec.user_id
+        usage_dic.update(result)
+        result_list.append(usage_dic)
+    res_dic["results"] = result_list
+    res_dic["total"] = len(result_list)
     return res_dic
 
 
-@app.get("/emoji/member-rank")
+@router.get("/emoji/member-rank")
 async def get_emoji_member_rank(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)],
     guild_id: int,
     emoji: str | None = None,
     hour: int = 720,
+    limit: RankLimit = None,
+    mode: Literal["approx", "exact"] = "exact",
 ):
-    result = db.get_emoji_member_rank(guild_id, emoji, hour)
+    result = approx_emoji_ranking(guild_id, hour, "user", emoji, limit, mode)
+    if result is None:
+        mode = "exact"
+        result = await emoji_cache.get_or_load(
+            ("member", guild_id, hour, emoji, limit),
+            emoji_cache_ttl(hour),
+            lambda: db.get_emoji_member_rank(guild_id, emoji, hour, limit),
+        )
     res_dic = {}
     rank_list = []
     rank = 1
@@ -140,31 +553,38 @@ async def get_emoji_member_rank(
     res_dic["rankings"] = rank_list
     res_dic["hour"] = hour
     res_dic["total"] = len(rank_list)
+    res_dic["mode"] = mode
 
     return res_dic
 
 
-@app.post("/friend-code/game/")
+@router.post("/friend-code/game/")
 async def insert_game(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)], game: Game
 ):
-    db.insert_game_title(game.game_title)
+    await db.insert_game_title(game.game_title)
     return game
 
 
-@app.delete("/friend-code/game/")
+@router.delete("/friend-code/game/")
 async def delete_game(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)], game: Game
 ):
-    db.delete_game_title(game.game_title)
+    await db.delete_game_title(game.game_title)
     return game
 
 
-@app.get("/friend-code/games/")
+@router.get("/friend-code/games/")
 async def get_game_titles(
-    credentials: Annotated[HTTPBasicCredentials, Depends(security)]
+    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    request: Request,
+    response: Response,
 ):
-    result = db.get_game_titles()
+    etag, not_modified = check_etag(request, "friend_code_games")
+    if not_modified is not None:
+        return not_modified
+    response.headers.update(cache_headers(etag))
+    result = await db.get_game_titles()
     res_dic = {}
     game_title_list = []
     for game_title_tuple in result:
@@ -176,64 +596,129 @@ async def get_game_titles(
     return res_dic
 
 
-@app.put("/friend-code")
+@router.put("/friend-code")
 async def upsert_friend_code(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)], fc: FriendCode
 ):
-    db.upsert_friend_code(fc.user_id, fc.game_title, fc.friend_code)
+    if not await db.upsert_friend_code(fc.user_id, fc.game_title, fc.friend_code):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown game titles: {fc.game_title}",
+        )
     return fc
 
 
-@app.delete("/friend-code")
+@router.put("/friend-code/bulk")
+async def upsert_friend_codes(
+    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    fcs: list[FriendCode],
+):
+    # All or nothing: one transaction, rejected if any game title is unknown.
+    check_bulk_size(fcs)
+    unknown = await db.upsert_friend_codes(
+        [(fc.user_id, fc.game_title, fc.friend_code) for fc in fcs]
+    )
+    if unknown is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Could not write friend codes",
+        )
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown game titles: {', '.join(unknown)}",
+        )
+    res_dic = {}
+    res_dic["total"] = len(fcs)
+    return res_dic
+
+
+@router.delete("/friend-code")
 async def delete_friend_code(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)],
     fc: FriendCodeDeletion,
 ):
-    db.delete_friend_code(fc.user_id, fc.game_title)
+    await db.delete_friend_code(fc.user_id, fc.game_title)
     return fc
 
 
-@app.get("/friend-code")
+@router.get("/friend-code")
 async def get_friend_code(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)],
     user_id: int | None = None,
     game_title: str | None = None,
+    after: str | None = None,
+    limit: PageLimit = None,
+    stream: bool = False,
 ):
+    # after/limit/stream only apply to the unfiltered listing.
     if user_id is None and game_title is not None:
-        result = db.get_friend_code_by_title(game_title)
+        result = await db.get_friend_code_by_title(game_title)
     elif user_id is not None and game_title is None:
-        result = db.get_friend_code_by_id(user_id)
+        result = await db.get_friend_code_by_id(user_id)
     elif user_id is not None and game_title is not None:
-        result = db.get_friend_code_by_id_and_title(user_id, game_title)
+        result = await db.get_friend_code_by_id_and_title(user_id, game_title)
     else:
-        result = db.get_friend_code()
+        cursor = parse_cursor(after, (int, int))
+        if stream:
+            rows = db.iterate(db_sync.iter_friend_code, cursor, limit)
+            return stream_json(
+                "friend_codes",
+                rows,
+                lambda row: serialize.dumps(friend_code_tuple_to_dict(row)),
+                {},
+                limit,
+                lambda row: [row[0], row[3]],
+            )
+        result = await db.get_friend_code(cursor, limit)
 
     res_dic = {}
     friend_code_list = []
     for friend_code_tuple in result:
-        friend_code_dic = {}
-        friend_code_dic["user_id"] = friend_code_tuple[0]
-        friend_code_dic["game_title"] = friend_code_tuple[1]
-        friend_code_dic["friend_code"] = friend_code_tuple[2]
-        friend_code_list.append(friend_code_dic)
+        friend_code_list.append(friend_code_tuple_to_dict(friend_code_tuple))
     res_dic["friend_codes"] = friend_code_list
     res_dic["total"] = len(friend_code_list)
+    if limit is not None and user_id is None and game_title is None:
+        res_dic["next"] = next_cursor(result, limit, lambda row: [row[0], row[3]])
 
     return res_dic
 
 
-@app.post("/message/log")
+@router.post("/message/log")
 async def insert_message_log(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)],
     message_log: MessageLog,
 ):
-    db.insert_message_log(
-        message_log.guild_id, message_log.channel_id, message_log.user_id
-    )
+    if message_log_buffer is not None:
+        message_log_buffer.add(
+            (message_log.guild_id, message_log.channel_id, message_log.user_id)
+        )
+    else:
+        await db.insert_message_log(
+            message_log.guild_id, message_log.channel_id, message_log.user_id
+        )
+        guild_streams.notify(message_log.guild_id)
     return message_log
 
 
-@app.get("/message/count")
+@router.post("/message/logs")
+async def insert_message_logs(
+    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    message_logs: list[MessageLog],
+):
+    check_bulk_size(message_logs)
+    rows = [(m.guild_id, m.channel_id, m.user_id) for m in message_logs]
+    if message_log_buffer is not None:
+        for row in rows:
+            message_log_buffer.add(row)
+    else:
+        await insert_message_logs_and_notify(rows)
+    res_dic = {}
+    res_dic["total"] = len(rows)
+    return res_dic
+
+
+@router.get("/message/count")
 async def get_message_log_count(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)],
     guild_id: int,
@@ -241,164 +726,295 @@ async def get_message_log_count(
     hours: int,
     channel_id: int | None = None,
 ):
-    result = db.get_message_count_by_guild_and_user_id(guild_id, user_id, hours)
+    result = await db.get_message_count_by_guild_and_user_id(
+        guild_id, user_id, hours, channel_id
+    )
+    return message_count_to_dict(result, guild_id, user_id, hours)
+
+
+@router.get("/message/series")
+async def get_message_count_series(
+    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    guild_id: int,
+    user_id: Annotated[list[int], Query()],
+    hours: int,
+    bucket: Literal["hour", "day", "week"] = "day",
+    tz: str | None = None,
+    channel_id: int | None = None,
+):
+    # Message counts for several users at once, as dense arrays with one
+    # entry per bucket (zero when a user sent nothing). Buckets are in tz,
+    # or the database's time zone when it is not given; weeks start on
+    # Monday.
+    check_bulk_size(user_id, MESSAGE_SERIES_MAX_USERS)
+    bucket_hours = {"hour": 1, "day": 24, "week": 168}[bucket]
+    if hours // bucket_hours + 2 > MESSAGE_SERIES_MAX_BUCKETS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MESSAGE_SERIES_MAX_BUCKETS} buckets per request",
+        )
+    try:
+        edges, user_ids, counts = await db.wrap(series.get_message_count_series)(
+            guild_id, user_id, hours, bucket, tz, channel_id
+        )
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown time zone {tz}"
+        )
     res_dic = {}
     res_dic["guild_id"] = guild_id
-    res_dic["user_id"] = user_id
     res_dic["hours"] = hours
-    message_count_list = []
-    for message_count_tuple in result:
-        message_count_dic = {}
-        message_count_dic["date"] = message_count_tuple[0]
-        message_count_dic["count"] = message_count_tuple[1]
-        message_count_list.append(message_count_dic)
-    res_dic["message_count"] = message_count_list
-    try:
-        res_dic["total_days"] = len(message_count_dic)
-    except UnboundLocalError:
-        res_dic["total_days"] = 0
+    res_dic["bucket"] = bucket
+    res_dic["tz"] = tz
+    res_dic["buckets"] = [edge.isoformat() for edge in edges]
+    series_list = []
+    for series_user_id, row in zip(user_ids, counts):
+        series_dic = {}
+        series_dic["user_id"] = series_user_id
+        series_dic["counts"] = row.tolist()
+        series_dic["total"] = int(row.sum())
+        series_list.append(series_dic)
+    res_dic["series"] = series_list
+    res_dic["total_buckets"] = len(edges)
     return res_dic
 
 
-@app.get("/advent/event")
+@router.get("/guild/events")
+async def get_guild_events(
+    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    guild_id: int,
+    hour: int = 720,
+    limit: RankLimit = None,
+    mode: Literal["approx", "exact"] = "exact",
+    user_id: int | None = None,
+    hours: int = 168,
+):
+    # Server-sent events instead of polling /emoji/usage-rank and
+    # /message/count. "emoji_usage" carries the /emoji/usage-rank result
+    # and, with user_id, "message_count" the /message/count one. Each is
+    # sent on subscribing and then whenever it changes; clients with the
+    # same parameters share the queries.
+    return StreamingResponse(
+        guild_streams.subscribe(guild_id, (hour, limit, mode, user_id, hours)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/advent/event")
 async def get_advent_by_id_and_date(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)],
     user_id: int,
     date_str: str,
 ):
-    result = db.get_advent_by_id_and_date(user_id, date_str)
+    try:
+        result = await db.get_advent_by_id_and_date(user_id, date_str)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     res_dic = {}
     events_list = []
     for events_tuple in result:
-        events_dic = {}
-        events_dic["user_id"] = events_tuple[1]
-        events_dic["author"] = events_tuple[2]
-        events_dic["title"] = events_tuple[3]
-        events_dic["url"] = events_tuple[4]
-        date_str = events_tuple[5].strftime("%Y-%m-%d")
-        events_dic["date_str"] = date_str
-        events_list.append(events_dic)
+        events_list.append(events_tuple_to_dict(events_tuple))
     res_dic["events"] = events_list
     res_dic["total"] = len(events_list)
     return res_dic
 
 
-@app.put("/advent/event")
+@router.put("/advent/event")
 async def upsert_advent(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)], advent: Advent
 ):
-    db.upsert_advent(
-        advent.user_id, advent.author, advent.title, advent.url, advent.date_str
-    )
+    try:
+        await db.upsert_advent(
+            advent.user_id, advent.author, advent.title, advent.url, advent.date_str
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     return advent
 
 
-@app.get("/advent/events")
+@router.put("/advent/events/bulk")
+async def upsert_advents(
+    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    advents: list[Advent],
+):
+    check_bulk_size(advents)
+    try:
+        written = await db.upsert_advents(
+            [(a.user_id, a.author, a.title, a.url, a.date_str) for a in advents]
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if not written:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Could not write advent events",
+        )
+    res_dic = {}
+    res_dic["total"] = len(advents)
+    return res_dic
+
+
+@router.get("/advent/events")
 async def get_advent_by_year(
-    credentials: Annotated[HTTPBasicCredentials, Depends(security)], year: int
+    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    request: Request,
+    response: Response,
+    year: int,
+    after: str | None = None,
+    limit: PageLimit = None,
+    stream: bool = False,
 ):
-    result = db.get_advent_by_year(year)
+    etag, not_modified = check_etag(request, "advent")
+    if not_modified is not None:
+        return not_modified
+    cursor = parse_cursor(after, (str, int))
+    if stream:
+        rows = db.iterate(db_sync.iter_advent_by_year, year, cursor, limit)
+        return stream_json(
+            "events",
+            rows,
+            lambda row: serialize.dumps(events_tuple_to_dict(row)),
+            {"year": year},
+            limit,
+            lambda row: [row[5], row[0]],
+            cache_headers(etag),
+        )
+    response.headers.update(cache_headers(etag))
+    result = await db.get_advent_by_year(year, cursor, limit)
     res_dic = {}
     events_list = []
     for events_tuple in result:
-        events_dic = {}
-        events_dic["user_id"] = events_tuple[1]
-        events_dic["author"] = events_tuple[2]
-        events_dic["title"] = events_tuple[3]
-        events_dic["url"] = events_tuple[4]
-        date_str = events_tuple[5].strftime("%Y-%m-%d")
-        events_dic["date_str"] = date_str
-        events_list.append(events_dic)
+        events_list.append(events_tuple_to_dict(events_tuple))
     res_dic["events"] = events_list
     res_dic["year"] = year
     res_dic["total"] = len(events_list)
+    if limit is not None:
+        res_dic["next"] = next_cursor(result, limit, lambda row: [row[5], row[0]])
     return res_dic
 
 
-@app.delete("/advent/event")
+@router.delete("/advent/event")
 async def delete_advent(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)], advent: Advent
 ):
-    db.delete_advent(advent.user_id, advent.date_str)
+    try:
+        await db.delete_advent(advent.user_id, advent.date_str)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     return advent
 
 
-@app.get("/rhythmgamedb/songs")
+@router.get("/rhythmgamedb/songs")
 async def get_song_by_title_and_game_name(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    request: Request,
     title: str | None = None,
     game_name: str | None = None,
     artist: str | None = None,
+    limit: PageLimit = None,
+    after: str | None = None,
+    stream: bool = False,
 ):
-    result = db.get_song_by_title_and_game_name_and_artist(title, game_name, artist)
+    etag, not_modified = check_etag(request, "rgdb")
+    if not_modified is not None:
+        return not_modified
+    cursor = parse_cursor(after, (int,))
+    result = await db.get_song_by_title_and_game_name_and_artist(
+        title, game_name, artist, limit, cursor
+    )
+    if stream:
+        return stream_json(
+            "songs",
+            result,
+            lambda document: document.json,
+            {},
+            limit,
+            lambda document: [document.song_id],
+            cache_headers(etag),
+        )
+    songs_list = [document.json for document in result]
     res_dic = {}
-    songs_list = []
-    for song_tuple in result:
-        song_dic = {}
-        song_dic["song_id"] = song_tuple[0]
-        game_id = song_tuple[1]
-        song_dic["game_id"] = game_id
-        song_dic["game_name"] = db.get_game_name_by_id(game_id)
-        song_dic["title"] = song_tuple[2]
-        song_dic["category"] = song_tuple[3]
-        song_dic["artist"] = song_tuple[4]
-        song_dic["jacket_image"] = song_tuple[5]
-        song_dic["length"] = song_tuple[6]
-        song_dic["bpm_main"] = song_tuple[7]
-        song_dic["bpm_min"] = song_tuple[8]
-        song_dic["bpm_max"] = song_tuple[9]
-        song_dic["description"] = song_tuple[10]
-        song_dic["song_url"] = song_tuple[11]
-        song_dic["wiki_url"] = song_tuple[12]
-        song_dic["release_date"] = song_tuple[13]
-        song_dic["charts"] = json.loads(song_tuple[14])
-        songs_list.append(song_dic)
-    res_dic["songs"] = songs_list
     res_dic["total"] = len(songs_list)
+    if limit is not None:
+        res_dic["next"] = next_cursor(
+            result, limit, lambda document: [document.song_id]
+        )
 
-    return res_dic
+    return Response(
+        serialize.json_object("songs", songs_list, res_dic),
+        media_type="application/json",
+        headers=cache_headers(etag),
+    )
 
 
-@app.get("/rhythmgamedb/random-song")
+@router.get("/rhythmgamedb/random-song")
 async def get_random_song(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)],
     game_name: str | None = None,
     level: str | None = None,
+    count: int = 1,
+    seed: int | None = None,
 ):
-    result = db.get_random_song(game_name, level)
+    count = max(1, min(count, RANDOM_SONG_MAX_COUNT))
+    result = await db.get_random_song(game_name, level, count, seed)
+    songs_list = [document.to_json(level) for document in result]
     res_dic = {}
-    songs_list = []
-    for song_tuple in result:
-        song_dic = {}
-        song_dic["song_id"] = song_tuple[0]
-        game_id = song_tuple[1]
-        song_dic["game_id"] = game_id
-        song_dic["game_name"] = db.get_game_name_by_id(game_id)
-        song_dic["title"] = song_tuple[2]
-        song_dic["category"] = song_tuple[3]
-        song_dic["artist"] = song_tuple[4]
-        song_dic["jacket_image"] = song_tuple[5]
-        song_dic["length"] = song_tuple[6]
-        song_dic["bpm_main"] = song_tuple[7]
-        song_dic["bpm_min"] = song_tuple[8]
-        song_dic["bpm_max"] = song_tuple[9]
-        song_dic["description"] = song_tuple[10]
-        song_dic["song_url"] = song_tuple[11]
-        song_dic["wiki_url"] = song_tuple[12]
-        song_dic["release_date"] = song_tuple[13]
-        song_dic["charts"] = json.loads(song_tuple[14])
-        songs_list.append(song_dic)
-    res_dic["songs"] = songs_list
     res_dic["total"] = len(songs_list)
 
-    return res_dic
+    return Response(
+        serialize.json_object("songs", songs_list, res_dic),
+        media_type="application/json",
+    )
 
 
-@app.get("/rhythmgamedb/game-names")
+@router.get("/rhythmgamedb/game-names")
 async def get_all_game_names(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    request: Request,
+    response: Response,
+):
+    etag, not_modified = check_etag(request, "rgdb")
+    if not_modified is not None:
+        return not_modified
+    response.headers.update(cache_headers(etag))
+    result = await db.get_all_game_names()
+    return game_names_to_dict(result)
+
+
+@router.post("/rhythmgamedb/game-names/refresh")
+async def refresh_game_names(
+    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+):
+    # A changed RGDB also bumps its ETag version; the names are reloaded
+    # either way.
+    await db.refresh_rgdb_if_changed()
+    await db.load_game_names()
+    result = await db.get_all_game_names()
+    return game_names_to_dict(result)
+
+
+@router.post("/rhythmgamedb/snapshot/rebuild")
+async def rebuild_rgdb_snapshot(
+    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
 ):
-    result = db.get_all_game_names()
+    if not RGDB_SNAPSHOT_PATH:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="RGDB_SNAPSHOT_PATH is not set",
+        )
+    if not await db.build_rgdb_snapshot():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Could not build the RGDB snapshot",
+        )
+    await db.refresh_rgdb_if_changed()
+    res_dic = {}
+    res_dic["path"] = RGDB_SNAPSHOT_PATH
+    return res_dic
+
+
+def game_names_to_dict(result) -> dict:
     res_dic = {}
     game_name_list = []
     for game_name_tuple in result:
@@ -410,5 +1026,141 @@ async def get_all_game_names(
     return res_dic
 
 
+@router.get("/emoji/cache-stats")
+async def get_emoji_cache_stats(
+    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+):
+    return emoji_cache.stats()
+
+
+def collect_runtime_metrics() -> list:
+    pool_connections = metrics.Gauge(
+        "db_pool_connections", "Pooled connections by state", ("pool", "state")
+    )
+    pool_waits = metrics.Counter(
+        "db_pool_waits_total", "Checkouts that had to wait", ("pool",)
+    )
+    pool_timeouts = metrics.Counter(
+        "db_pool_timeouts_total", "Checkouts that timed out", ("pool",)
+    )
+    for pool in db_sync.get_pool_stats():
+        pool_connections.set(pool["in_use"], pool["name"], "in_use")
+        pool_connections.set(pool["idle"], pool["name"], "idle")
+        pool_waits.set(pool["waits"], pool["name"])
+        pool_timeouts.set(pool["timeouts"], pool["name"])
+    emoji_cache_requests = metrics.Counter(
+        "emoji_cache_requests_total", "Emoji leaderboard cache lookups", ("result",)
+    )
+    cache_stats = emoji_cache.stats()
+    for result in ("hits", "misses", "coalesced"):
+        emoji_cache_requests.set(cache_stats[result], result)
+    collected = [pool_connections, pool_waits, pool_timeouts, emoji_cache_requests]
+    stream_subscribers = metrics.Gauge(
+        "guild_stream_subscribers", "Open /guild/events streams"
+    )
+    stream_subscribers.set(guild_streams.stats()["subscribers"])
+    collected.append(stream_subscribers)
+    if emoji_topk is not None:
+        topk_counters = metrics.Gauge(
+            "emoji_topk_counters", "Counters held by the approximate emoji tracker"
+        )
+        topk_counters.set(emoji_topk.stats()["counters"])
+        collected.append(topk_counters)
+    if db_sync.replicas is not None:
+        replica_stats = db_sync.replicas.stats()
+        replica_available = metrics.Gauge(
+            "db_replica_available", "1 while reads go to the replica", ("replica",)
+        )
+        replica_lag = metrics.Gauge(
+            "db_replica_lag_seconds", "Replication lag at the last check", ("replica",)
+        )
+        replica_fallbacks = metrics.Counter(
+            "db_replica_fallbacks_total",
+            "Reads sent to the primary because no replica was available",
+        )
+        for replica in replica_stats["hosts"]:
+            replica_available.set(int(replica["available"]), replica["host"])
+            if replica["lag"] is not None:
+                replica_lag.set(replica["lag"], replica["host"])
+        replica_fallbacks.set(replica_stats["fallbacks"])
+        collected += [replica_available, replica_lag, replica_fallbacks]
+    document_stats = db_sync.song_documents.stats()
+    song_documents = metrics.Gauge("song_documents", "Songs held as encoded documents")
+    song_document_bytes = metrics.Gauge(
+        "song_document_bytes", "Size of the encoded song documents"
+    )
+    song_documents.set(document_stats["songs"])
+    song_document_bytes.set(document_stats["bytes"])
+    collected += [song_documents, song_document_bytes]
+    if message_log_buffer is not None:
+        buffered = metrics.Gauge(
+            "message_log_buffered_rows", "Message logs waiting to be flushed"
+        )
+        dropped = metrics.Counter(
+            "message_log_dropped_rows_total",
+            "Message logs dropped after their flushes kept failing",
+        )
+        buffer_stats = message_log_buffer.stats()
+        buffered.set(buffer_stats["buffered"])
+        dropped.set(buffer_stats["dropped_rows"])
+        collected += [buffered, dropped]
+    return collected
+
+
+metrics.registry.add_collector(collect_runtime_metrics)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(
+    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+):
+    return PlainTextResponse(
+        metrics.registry.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@router.get("/db/pool-stats")
+async def get_pool_stats(
+    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+):
+    res_dic = {}
+    res_dic["pools"] = await db.get_pool_stats()
+    if db_sync.replicas is not None:
+        res_dic["replicas"] = db_sync.replicas.stats()
+    if message_log_buffer is not None:
+        res_dic["message_log_buffer"] = message_log_buffer.stats()
+    return res_dic
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(metrics.MetricsMiddleware, routes=router.routes)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.include_router(router)
+    return app
+
+
+app = create_app()
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host=HOST, port=PORT)
+    # Several workers need an import string and each imports the app itself;
+    # gunicorn.conf.py runs the same app with preloading instead.
+    if WEB_CONCURRENCY > 1:
+        uvicorn.run(
+            "main:app",
+            host=HOST,
+            port=PORT,
+            workers=WEB_CONCURRENCY,
+            timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        )
+    else:
+        uvicorn.run(
+            app, host=HOST, port=PORT, timeout_graceful_shutdown=GRACEFUL_TIMEOUT
+        )
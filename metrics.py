@@ -0,0 +1,229 @@
+import bisect
+import threading
+import time
+
+from starlette.routing import Match
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            labels = _format_labels(self.labels, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def set(self, value: float, *label_values) -> None:
+        with self._lock:
+            self._values[label_values] = value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            lines.append(
+                f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+            )
+        return lines
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *label_values, amount: float = 1) -> None:
+        self.inc(*label_values, amount=-amount)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect) -> None:
+        # collect() is called on every scrape and returns metrics whose
+        # values are read from elsewhere (pool stats, cache counters...).
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for metric in collect():
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_duration = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "HTTP request latency by route",
+        ("method", "route", "status"),
+    )
+)
+http_requests_in_flight = registry.register(
+    Gauge(
+        "http_requests_in_flight",
+        "HTTP requests currently being handled by route",
+        ("method", "route"),
+    )
+)
+db_query_duration = registry.register(
+    Histogram(
+        "db_query_duration_seconds",
+        "Latency of db.* calls, including connection checkout",
+        ("function",),
+    )
+)
+db_query_rows = registry.register(
+    Histogram(
+        "db_query_rows", "Rows returned by db.* calls", ("function",), ROW_BUCKETS
+    )
+)
+db_query_errors = registry.register(
+    Counter("db_query_errors_total", "db.* calls that raised", ("function",))
+)
+db_pool_acquire_duration = registry.register(
+    Histogram(
+        "db_pool_acquire_seconds",
+        "Time spent checking a connection out of the pool",
+        ("pool",),
+    )
+)
+
+
+def observe_db_call(function: str, started: float, result) -> None:
+    db_query_duration.observe(time.perf_counter() - started, function)
+    if isinstance(result, (list, tuple)):
+        db_query_rows.observe(len(result), function)
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware; BaseHTTPMiddleware would add a task and a
+    # memory stream to every request.
+    def __init__(self, app, routes=None):
+        # routes are matched before the app's own; routers included with
+        # include_router are not listed there route by route.
+        self.app = app
+        self.routes = routes or []
+        self._routes: dict[tuple[str, str], str] = {}
+
+    def _route_name(self, scope) -> str:
+        key = (scope["method"], scope["path"])
+        name = self._routes.get(key)
+        if name is not None:
+            return name
+        name = "unmatched"
+        for route in [*self.routes, *scope["app"].router.routes]:
+            if not hasattr(route, "path"):
+                continue
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                name = route.path
+                break
+        if name != "unmatched" and "{" not in name and len(self._routes) < 1024:
+            self._routes[key] = name
+        return name
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        route = self._route_name(scope)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc(method, route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec(method, route)
+            http_request_duration.observe(
+                time.perf_counter() - started, method, route, status_code
+            )
@@ -0,0 +1,57 @@
+import datetime
+import decimal
+
+import orjson
+
+# Output order of the song fields; the values are looked up by column name.
+SONG_FIELDS = (
+    "song_id",
+    "game_id",
+    "game_name",
+    "title",
+    "category",
+    "artist",
+    "jacket_image",
+    "length",
+    "bpm_main",
+    "bpm_min",
+    "bpm_max",
+    "description",
+    "song_url",
+    "wiki_url",
+    "release_date",
+)
+CHART_FIELDS = (
+    "chart_id",
+    "difficulty",
+    "const",
+    "level",
+    "num_notes",
+    "designer",
+    "chart_image_url",
+    "description",
+)
+
+
+def _default(obj):
+    # Same conversions as fastapi.encoders.jsonable_encoder for the types
+    # MariaDB hands back that orjson does not know.
+    if isinstance(obj, decimal.Decimal):
+        return int(obj) if obj.as_tuple().exponent >= 0 else float(obj)
+    if isinstance(obj, datetime.timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, bytes):
+        return obj.decode()
+    raise TypeError
+
+
+def dumps(obj) -> bytes:
+    return orjson.dumps(obj, default=_default)
+
+
+def json_object(list_key: str, items: list[bytes], res_dic: dict) -> bytes:
+    # {"<list_key>": [items...], **res_dic} from already encoded items.
+    head = b'{"' + list_key.encode() + b'":[' + b",".join(items) + b"]"
+    if not res_dic:
+        return head + b"}"
+    return head + b"," + dumps(res_dic)[1:]
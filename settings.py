@@ -0,0 +1,110 @@
+from os import getenv
+
+from dotenv import load_dotenv
+
+# Configuration from the environment and .env. Importing this module has no
+# other side effects, so db.*, the CLIs and the app can all read it without
+# building the FastAPI app.
+load_dotenv()
+DB_USER = getenv("DB_USER")
+DB_PASSWORD = getenv("DB_PASSWORD")
+DB_HOST = getenv("DB_HOST")
+DB_PORT = int(getenv("DB_PORT", "3306"))
+DB_NAME = getenv("DB_NAME")
+RGDB_NAME = getenv("RGDB_NAME")
+DB_POOL_SIZE = int(getenv("DB_POOL_SIZE", "5"))
+DB_POOL_MAX_OVERFLOW = int(getenv("DB_POOL_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = float(getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_IDLE_TIMEOUT = float(getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+DB_POOL_TIMEOUT = float(getenv("DB_POOL_TIMEOUT", "30"))
+DB_EXECUTOR_WORKERS = int(
+    getenv("DB_EXECUTOR_WORKERS", str(DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW))
+)
+# "host[:port],..." of read replicas of DB_HOST; empty sends every query to
+# DB_HOST. A replica more than DB_REPLICA_MAX_LAG seconds behind is not read
+# from, and one that cannot be reached is left out for
+# DB_REPLICA_EJECT_SECONDS. A read waits at most DB_REPLICA_ACQUIRE_TIMEOUT
+# for a busy replica before trying the next one or DB_HOST.
+DB_REPLICA_HOSTS = [
+    host.strip() for host in getenv("DB_REPLICA_HOSTS", "").split(",") if host.strip()
+]
+DB_REPLICA_MAX_LAG = float(getenv("DB_REPLICA_MAX_LAG", "5"))
+DB_REPLICA_EJECT_SECONDS = float(getenv("DB_REPLICA_EJECT_SECONDS", "30"))
+DB_REPLICA_CHECK_INTERVAL = float(getenv("DB_REPLICA_CHECK_INTERVAL", "5"))
+DB_REPLICA_ACQUIRE_TIMEOUT = float(getenv("DB_REPLICA_ACQUIRE_TIMEOUT", "0.1"))
+# 0 writes every message log synchronously; otherwise rows are buffered
+# and flushed once this many are pending or the oldest is MAX_AGE old.
+# While flushes fail, at most MAX_ROWS rows are kept, and rows are dropped
+# after MAX_RETRIES failed flushes in a row.
+MESSAGE_LOG_BUFFER_SIZE = int(getenv("MESSAGE_LOG_BUFFER_SIZE", "0"))
+MESSAGE_LOG_BUFFER_MAX_AGE = float(getenv("MESSAGE_LOG_BUFFER_MAX_AGE", "1.0"))
+MESSAGE_LOG_BUFFER_MAX_RETRIES = int(getenv("MESSAGE_LOG_BUFFER_MAX_RETRIES", "3"))
+MESSAGE_LOG_BUFFER_MAX_ROWS = int(
+    getenv("MESSAGE_LOG_BUFFER_MAX_ROWS", str(MESSAGE_LOG_BUFFER_SIZE * 10))
+)
+GAME_NAME_CACHE_TTL = float(getenv("GAME_NAME_CACHE_TTL", "600"))
+RGDB_CHANGE_CHECK_INTERVAL = float(getenv("RGDB_CHANGE_CHECK_INTERVAL", "60"))
+RGDB_SNAPSHOT_PATH = getenv("RGDB_SNAPSHOT_PATH")
+# Migrations are a deploy step (python -m db.migrate); with 1 the app also
+# applies pending ones at startup, otherwise it only logs them.
+RUN_MIGRATIONS = getenv("RUN_MIGRATIONS", "0") == "1"
+RANDOM_SONG_MAX_COUNT = int(getenv("RANDOM_SONG_MAX_COUNT", "50"))
+# Largest limit a paged listing accepts.
+PAGE_MAX_LIMIT = int(getenv("PAGE_MAX_LIMIT", "1000"))
+BULK_UPSERT_MAX_ROWS = int(getenv("BULK_UPSERT_MAX_ROWS", "1000"))
+EMOJI_BATCH_MAX_SPECS = int(getenv("EMOJI_BATCH_MAX_SPECS", "200"))
+EMOJI_BATCH_CONCURRENCY = int(getenv("EMOJI_BATCH_CONCURRENCY", "4"))
+MESSAGE_SERIES_MAX_USERS = int(getenv("MESSAGE_SERIES_MAX_USERS", "100"))
+MESSAGE_SERIES_MAX_BUCKETS = int(getenv("MESSAGE_SERIES_MAX_BUCKETS", "2000"))
+EMOJI_ROLLUP_INTERVAL = float(getenv("EMOJI_ROLLUP_INTERVAL", "300"))
+# Server-sent guild streams: updates are at most once per
+# STREAM_MIN_INTERVAL, and every STREAM_REFRESH_INTERVAL without new
+# messages.
+STREAM_MIN_INTERVAL = float(getenv("STREAM_MIN_INTERVAL", "1.0"))
+STREAM_REFRESH_INTERVAL = float(getenv("STREAM_REFRESH_INTERVAL", "30"))
+STREAM_KEEPALIVE = float(getenv("STREAM_KEEPALIVE", "15"))
+PARTITION_MAINTENANCE_INTERVAL = float(
+    getenv("PARTITION_MAINTENANCE_INTERVAL", "21600")
+)
+PARTITION_MONTHS_AHEAD = int(getenv("PARTITION_MONTHS_AHEAD", "3"))
+# 0 keeps the raw logs forever.
+EMOJI_LOG_RETENTION_MONTHS = int(getenv("EMOJI_LOG_RETENTION_MONTHS", "0"))
+MESSAGE_LOG_RETENTION_MONTHS = int(getenv("MESSAGE_LOG_RETENTION_MONTHS", "0"))
+PARTITION_ARCHIVE = getenv("PARTITION_ARCHIVE", "0") == "1"
+# "<max hour>:<ttl seconds>,..." - a leaderboard over a window of up to
+# <max hour> hours may be served from cache for <ttl seconds>.
+EMOJI_CACHE_TTLS = sorted(
+    (int(max_hour), float(ttl))
+    for max_hour, ttl in (
+        item.split(":")
+        for item in getenv("EMOJI_CACHE_TTLS", "24:10,168:60,720:300").split(",")
+        if item
+    )
+)
+EMOJI_CACHE_SIZE = int(getenv("EMOJI_CACHE_SIZE", "1024"))
+# mode=approx leaderboards; 0 disables the tracker and mode=approx falls
+# back to exact.
+EMOJI_TOPK_POLL_INTERVAL = float(getenv("EMOJI_TOPK_POLL_INTERVAL", "0"))
+EMOJI_TOPK_CAPACITY = int(getenv("EMOJI_TOPK_CAPACITY", "200"))
+EMOJI_TOPK_MAX_HOURS = int(getenv("EMOJI_TOPK_MAX_HOURS", "168"))
+CACHE_MAX_AGE = int(getenv("CACHE_MAX_AGE", "0"))
+CACHE_CONTROL = (
+    f"private, max-age={CACHE_MAX_AGE}" if CACHE_MAX_AGE > 0 else "private, no-cache"
+)
+HOST = getenv("HOST")
+PORT = int(getenv("PORT", "8000"))
+API_USERNAME = getenv("API_USERNAME")
+API_PASSWORD = getenv("API_PASSWORD")
+ORIGIN1 = getenv("ORIGIN1")
+ORIGIN2 = getenv("ORIGIN2")
+ORIGIN3 = getenv("ORIGIN3")
+# Server processes; gunicorn.conf.py and `python main.py` both use it.
+# Several processes each keep their own state (see gunicorn.conf.py), so
+# this stays 1 unless raised explicitly.
+WEB_CONCURRENCY = int(getenv("WEB_CONCURRENCY", "1"))
+# Seconds a stopping worker waits for open requests before cancelling them.
+GRACEFUL_TIMEOUT = float(getenv("GRACEFUL_TIMEOUT", "10"))
+# With several processes the ETag versions live in the table_versions table
+# and each process picks up the others' writes within this many seconds.
+SHARED_VERSIONS = getenv("SHARED_VERSIONS", "1" if WEB_CONCURRENCY > 1 else "0") == "1"
+VERSION_REFRESH_INTERVAL = float(getenv("VERSION_REFRESH_INTERVAL", "1.0"))
@@ -0,0 +1,140 @@
+import asyncio
+import time
+
+import serialize
+
+
+class GuildStreams:
+    # Server-sent event streams per guild. Subscribers asking for the same
+    # topic share one computation per update, and an event is only sent
+    # again when its payload changed.
+    def __init__(
+        self,
+        compute,
+        min_interval: float = 1.0,
+        refresh_interval: float = 30.0,
+        keepalive: float = 15.0,
+        queue_size: int = 16,
+    ):
+        # compute(guild_id, topic) is an async callable returning
+        # [(event name, payload), ...].
+        self._compute = compute
+        self.min_interval = min_interval
+        self.refresh_interval = refresh_interval
+        self.keepalive = keepalive
+        self.queue_size = queue_size
+        # guild_id -> {topic: {subscriber queues}}
+        self._topics: dict[int, dict[tuple, set[asyncio.Queue]]] = {}
+        # (guild_id, topic) -> {event name: last message sent}
+        self._last_sent: dict[tuple, dict[str, bytes]] = {}
+        self._dirty: set[int] = set()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.updates = 0
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def notify(self, guild_id: int) -> None:
+        # Called when the guild's data changed; updates are coalesced to at
+        # most one per min_interval.
+        if guild_id in self._topics:
+            self._dirty.add(guild_id)
+            self._wakeup.set()
+
+    def _put(self, queue: asyncio.Queue, message: bytes) -> None:
+        # A subscriber that falls behind loses its oldest updates, never
+        # the latest one.
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(message)
+
+    async def _update(self, guild_id: int) -> None:
+        for topic, queues in list(self._topics.get(guild_id, {}).items()):
+            try:
+                events = await self._compute(guild_id, topic)
+            except Exception as e:
+                print(f"Error computing stream update for guild {guild_id}: {e}")
+                continue
+            if topic not in self._topics.get(guild_id, {}):
+                continue
+            self.updates += 1
+            sent = self._last_sent.setdefault((guild_id, topic), {})
+            for event, payload in events:
+                message = (
+                    b"event: "
+                    + event.encode()
+                    + b"\ndata: "
+                    + serialize.dumps(payload)
+                    + b"\n\n"
+                )
+                if sent.get(event) == message:
+                    continue
+                sent[event] = message
+                for queue in queues:
+                    self._put(queue, message)
+
+    async def _run(self) -> None:
+        refreshed_at = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.refresh_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            # Not every change goes through the API (the bot writes
+            # emoji_log directly), so every guild is refreshed now and then.
+            if time.monotonic() - refreshed_at >= self.refresh_interval:
+                self._dirty.update(self._topics)
+                refreshed_at = time.monotonic()
+            dirty, self._dirty = self._dirty, set()
+            await asyncio.gather(*(self._update(guild_id) for guild_id in dirty))
+            await asyncio.sleep(self.min_interval)
+
+    async def subscribe(self, guild_id: int, topic: tuple):
+        # Yields server-sent event messages, starting with the latest
+        # payload of every event, until the client disconnects.
+        queue = asyncio.Queue(self.queue_size)
+        self._topics.setdefault(guild_id, {}).setdefault(topic, set()).add(queue)
+        sent = self._last_sent.get((guild_id, topic))
+        if sent:
+            for message in sent.values():
+                self._put(queue, message)
+        else:
+            self._dirty.add(guild_id)
+            self._wakeup.set()
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), self.keepalive)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+        finally:
+            topics = self._topics[guild_id]
+            topics[topic].discard(queue)
+            if not topics[topic]:
+                del topics[topic]
+                self._last_sent.pop((guild_id, topic), None)
+            if not topics:
+                del self._topics[guild_id]
+
+    def stats(self) -> dict:
+        return {
+            "guilds": len(self._topics),
+            "topics": sum(len(topics) for topics in self._topics.values()),
+            "subscribers": sum(
+                len(queues)
+                for topics in self._topics.values()
+                for queues in topics.values()
+            ),
+            "updates": self.updates,
+        }
@@ -0,0 +1,51 @@
+import asyncio
+import threading
+import time
+
+import httpx
+
+import db.aio
+import main
+
+SLOW_SECONDS = 1.0
+AUTH = ("user", "password")
+
+
+def test_slow_query_does_not_block_other_requests(monkeypatch):
+    # A blocking query runs on the db executor, so a request that needs a
+    # different query is answered while the slow one is still running.
+    started = threading.Event()
+
+    def slow_get_emoji_usage(guild_id, hour, user_id, limit):
+        started.set()
+        time.sleep(SLOW_SECONDS)
+        return []
+
+    def get_game_titles():
+        return [("maimai",)]
+
+    monkeypatch.setattr(db.aio, "get_emoji_usage", db.aio.wrap(slow_get_emoji_usage))
+    monkeypatch.setattr(db.aio, "get_game_titles", db.aio.wrap(get_game_titles))
+
+    async def requests():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test", auth=AUTH
+        ) as client:
+            slow = asyncio.create_task(
+                client.get("/emoji/usage-rank", params={"guild_id": 1})
+            )
+            await asyncio.to_thread(started.wait, SLOW_SECONDS)
+            began = time.perf_counter()
+            fast = await client.get("/friend-code/games/")
+            fast_seconds = time.perf_counter() - began
+            slow_done = slow.done()
+            return fast, fast_seconds, slow_done, await slow
+
+    fast, fast_seconds, slow_done, slow = asyncio.run(requests())
+
+    assert fast.status_code == 200
+    assert fast.json()["game_titles"] == [{"game_title": "maimai"}]
+    assert not slow_done
+    assert fast_seconds < SLOW_SECONDS / 4
+    assert slow.status_code == 200
@@ -0,0 +1,14 @@
+from uvicorn_worker import UvicornWorker
+
+from settings import GRACEFUL_TIMEOUT
+
+
+class Worker(UvicornWorker):
+    # gunicorn's graceful_timeout only bounds how long the arbiter waits
+    # before killing a worker. uvicorn needs its own timeout to cancel
+    # requests that never finish, such as /guild/events streams, and still
+    # run the lifespan shutdown that flushes buffered message logs.
+    CONFIG_KWARGS = {
+        **UvicornWorker.CONFIG_KWARGS,
+        "timeout_graceful_shutdown": GRACEFUL_TIMEOUT,
+    }